@@ -2,14 +2,21 @@ import numpy as np
 import os
 
 from astropy.io import fits
+from scipy import fft, sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import spsolve
+from scipy.spatial import cKDTree
 
 from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
+from specklepy.io import config
 from specklepy.logging import logger
 from specklepy.plotting.plots import imshow
+from specklepy.utils.parallel import get_n_jobs
 
 
 def get_shifts(files, reference_file=None, mode='correlation', lazy_mode=True, return_image_shape=False, in_dir=None,
-               debug=False):
+               batch_size=16, n_threads=None, upsample_factor=None, pyramid_levels=None, search_radius=2,
+               patch_size=128, header_cards=None, predicted_shifts=None, n_neighbors=4, debug=False):
     """Computes the the relative shift of data cubes relative to a reference
     image.
 
@@ -18,21 +25,57 @@ def get_shifts(files, reference_file=None, mode='correlation', lazy_mode=True, r
 
     Args:
         files (list or array_like):
-            List of files to align.
-        reference_file (str, int, optional):
-            Path to a reference file or index of the file in files, relative to which the shifts are computed. Default
-            is 0.
+            List of files to align. The list may also contain images or cubes as np.ndarray, which are then used
+            directly instead of reading them from disk.
+        reference_file (str, int, np.ndarray, optional):
+            Path to a reference file, reference image or index of the file in files, relative to which the shifts are
+            computed. Default is 0.
         mode (str, optional):
             Mode of the shift estimate. In 'correlation' mode, a 2D correlation is used to estimate the shift of the
             array. This is computationally much more expensive than the identical 'maximum' or 'peak' modes, which
             simply identify the coordinates of the emission peaks and return the difference. Though these modes may be
-            fooled by reference sources of similar brightness. Passed to get_shift() function. Default is 'correlation'.
+            fooled by reference sources of similar brightness. Passed to get_shift() function. The 'pyramid' mode
+            correlates block-averaged images first and refines the shift at every finer level within a small window,
+            see get_pyramid_shift(). The 'global' mode correlates pairs of neighbouring files and solves for consistent
+            shifts by weighted least squares, see get_global_shifts(). This is more robust for wide dither patterns,
+            where distant files overlap little with the reference file. Default is 'correlation'.
         lazy_mode (bool, optional):
             Set to False, to enforce the alignment of a single file with respect to the reference file. Default is True.
         return_image_shape (bool, optional):
             Set to True for for returning the shape of the anticipated output image. Default is False.
         in_dir (str, optional):
             Path to the files. `None` is substituted by an empty string.
+        batch_size (int, optional):
+            Number of images that are correlated with the reference image at once in 'correlation' mode. Default is
+            16.
+        n_threads (int, optional):
+            Number of threads for the FFTs. None or negative values use all CPUs. Default is None.
+        upsample_factor (int, optional):
+            If provided, the shifts are refined to a precision of 1/upsample_factor pixels in 'correlation' mode, see
+            refine_shift(). Default is None, which returns integer shifts.
+        pyramid_levels (int, optional):
+            Number of block-averaging levels in 'pyramid' mode. Derived from the image shape if not provided, see
+            get_pyramid().
+        search_radius (int, optional):
+            Radius of the window around the estimate from the coarser level, within which the shift is searched at each
+            finer level in 'pyramid' mode. Default is 2.
+        patch_size (int, optional):
+            Size of the patch around the brightest pixel of the reference image, over which the windowed correlation
+            is evaluated at the finer levels in 'pyramid' mode and around header predictions. Set to None for using
+            the full frames. Default is 128.
+        header_cards (dict or str, optional):
+            Mapping of the keys 'XOFFSET', 'YOFFSET' and optionally 'PIXSCALE' to the header cards that store the
+            telescope offsets, or name of an instrument in config/instruments.cfg that defines these keys. If
+            provided, the shifts are predicted from the header offsets and searched only within `search_radius` around
+            the prediction. Files whose prediction is rejected are aligned by the full-frame correlation, see
+            get_seeded_shift(). Only available in 'correlation' mode without upsampling, and in 'global' mode, where
+            the predictions select the neighbouring pairs of files. Default is None.
+        predicted_shifts (list, optional):
+            List of predicted shifts for each file, with None for files without a prediction, as obtained from
+            get_predicted_shifts(). Used instead of reading the header offsets, for instance if the files are provided
+            as arrays. Default is None.
+        n_neighbors (int, optional):
+            Number of neighbours of each file, with which it is correlated in 'global' mode. Default is 4.
         debug (bool, optional):
             If set to True, it shows the 2D correlation.
 
@@ -49,16 +92,23 @@ def get_shifts(files, reference_file=None, mode='correlation', lazy_mode=True, r
             raise SpecklepyTypeError('get_shifts()', argname='files', argtype=type(files), expected='list')
 
     if reference_file is None:
-        reference_file = files[0]
+        reference_index = 0
     elif isinstance(reference_file, int):
-        reference_file = files[reference_file]
-    elif not isinstance(reference_file, str):
-        raise SpecklepyTypeError('get_shifts()', argname='reference_file', argtype=type(reference_file), expected='str')
+        reference_index = reference_file
+    elif isinstance(reference_file, str):
+        reference_index = _find_file_index(files, reference_file)
+    elif isinstance(reference_file, np.ndarray):
+        reference_index = None
+    else:
+        raise SpecklepyTypeError('get_shifts()', argname='reference_file', argtype=type(reference_file),
+                                 expected='str, int or np.ndarray')
+    if reference_index is not None:
+        reference_file = files[reference_index]
 
     if isinstance(mode, str):
-        if mode not in ['correlation', 'maximum', 'peak']:
+        if mode not in ['correlation', 'maximum', 'peak', 'pyramid', 'global']:
             raise SpecklepyValueError('get_shifts()', argname='mode', argvalue=mode,
-                                      expected="'correlation', 'maximum' or 'peak'")
+                                      expected="'correlation', 'maximum', 'peak', 'pyramid' or 'global'")
     else:
         raise SpecklepyTypeError('get_shifts()', argname='mode', argtype=type(mode), expected='str')
 
@@ -69,6 +119,28 @@ def get_shifts(files, reference_file=None, mode='correlation', lazy_mode=True, r
         raise SpecklepyTypeError('get_shifts()', argname='return_image_shape', argtype=type(return_image_shape),
                                  expected='bool')
 
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise SpecklepyValueError('get_shifts()', argname='batch_size', argvalue=batch_size, expected='positive int')
+    n_threads = get_n_jobs(n_threads)
+
+    if upsample_factor is not None and (not isinstance(upsample_factor, int) or upsample_factor < 1):
+        raise SpecklepyValueError('get_shifts()', argname='upsample_factor', argvalue=upsample_factor,
+                                  expected='positive int')
+
+    if header_cards is not None or predicted_shifts is not None:
+        if mode not in ['correlation', 'global'] or (mode == 'correlation' and upsample_factor is not None):
+            raise SpecklepyValueError('get_shifts()', argname='header_cards', argvalue=header_cards,
+                                      expected="None in other than 'correlation' or 'global' mode, or with "
+                                               "upsample_factor in 'correlation' mode")
+        if predicted_shifts is None:
+            header_cards = get_header_cards(header_cards)
+        elif len(predicted_shifts) != len(files):
+            raise SpecklepyValueError('get_shifts()', argname='len(predicted_shifts)', argvalue=len(predicted_shifts),
+                                      expected=f"{len(files)}, the number of files")
+
+    if not isinstance(n_neighbors, int) or n_neighbors < 1:
+        raise SpecklepyValueError('get_shifts()', argname='n_neighbors', argvalue=n_neighbors, expected='positive int')
+
     if in_dir is None:
         in_dir = ''
 
@@ -76,35 +148,87 @@ def get_shifts(files, reference_file=None, mode='correlation', lazy_mode=True, r
     if lazy_mode and len(files) == 1:
         logger.info("Only one data cube is provided, nothing to align.")
         shifts = [(0, 0)]
-        image_shape = fits.getdata(os.path.join(in_dir, files[0])).shape
-        image_shape = (image_shape[-2], image_shape[-1])
+        image_shape = load_image(files[0], in_dir=in_dir).shape
 
     # Otherwise estimate shifts
     else:
-        shifts = []
+        shifts = [(0, 0)] * len(files)
 
         # Identify reference file and Fourier transform the integrated image
-        logger.info(f"Computing relative shifts between data cubes. Reference file is {reference_file}")
-        reference_image = fits.getdata(os.path.join(in_dir, reference_file))
-        if reference_image.ndim == 3:
-            # Integrating over time axis if reference image is a cube
-            reference_image = np.sum(reference_image, axis=0)
-        f_reference_image = np.fft.fft2(reference_image)
+        logger.info(f"Computing relative shifts between data cubes. Reference file is {_describe(reference_file)}")
+        reference_image = load_image(reference_file, in_dir=in_dir)
         image_shape = reference_image.shape
-        del reference_image
-
-        # Iterate over files and estimate shift via 2D correlation of the integrated cubes
-        for index, file in enumerate(files):
-            if file == reference_file:
-                shift = (0, 0)
-            else:
-                image = fits.getdata(os.path.join(in_dir, file))
-                if image.ndim == 3:
-                    image = np.sum(image, axis=0)
-                shift = get_shift(image, reference_image=f_reference_image, is_fourier_transformed=True, mode=mode,
-                                  debug=debug)
-            shifts.append(shift)
-            logger.info(f"Identified a shift of {shift} for file {file}")
+        indizes = [index for index in range(len(files)) if index != reference_index]
+
+        if mode == 'pyramid':
+            # Correlate the coarsest level of the pyramids in batches and refine the shifts at the finer levels
+            reference_pyramid = get_pyramid(reference_image, n_levels=pyramid_levels)
+            reference_patches = [get_patch_slices(level, patch_size) for level in reference_pyramid]
+            f_reference_image = fft.rfft2(reference_pyramid[-1], workers=n_threads)
+            for start in range(0, len(indizes), batch_size):
+                batch = indizes[start: start + batch_size]
+                pyramids = [get_pyramid(load_image(files[index], in_dir=in_dir), n_levels=len(reference_pyramid) - 1)
+                            for index in batch]
+                coarse_shifts = get_correlation_shifts(np.array([pyramid[-1] for pyramid in pyramids]),
+                                                       f_reference_image, n_threads=n_threads)
+                for index, pyramid, shift in zip(batch, pyramids, coarse_shifts):
+                    shifts[index] = refine_pyramid_shift(pyramid, reference_pyramid, shift, search_radius=search_radius,
+                                                         reference_patches=reference_patches)
+
+        elif mode == 'global':
+            # Solve for the shifts from the correlations of neighbouring files, appending an external reference image
+            if header_cards is not None and predicted_shifts is None:
+                predicted_shifts = get_predicted_shifts(files, reference_file, header_cards, in_dir=in_dir)
+            nodes = list(files)
+            node_index = reference_index
+            if reference_index is None:
+                nodes.append(reference_image)
+                node_index = len(files)
+                if predicted_shifts is not None:
+                    predicted_shifts = list(predicted_shifts) + [(0, 0)]
+            del reference_image
+            shifts = get_global_shifts(nodes, reference_index=node_index, in_dir=in_dir,
+                                       predicted_shifts=predicted_shifts, n_neighbors=n_neighbors,
+                                       batch_size=batch_size, n_threads=n_threads,
+                                       upsample_factor=upsample_factor)[:len(files)]
+
+        elif mode == 'correlation' and not debug:
+            if header_cards is not None and predicted_shifts is None:
+                predicted_shifts = get_predicted_shifts(files, reference_file, header_cards, in_dir=in_dir)
+            if predicted_shifts is not None:
+                # Search the correlation peak only around the shifts predicted from the header offsets
+                rejected = []
+                for index in indizes:
+                    if predicted_shifts[index] is not None:
+                        shift = get_seeded_shift(load_image(files[index], in_dir=in_dir), reference_image,
+                                                 predicted_shifts[index], search_radius=search_radius,
+                                                 patch_size=patch_size)
+                        if shift is not None:
+                            shifts[index] = shift
+                            continue
+                        logger.info(f"Rejected the predicted shift {predicted_shifts[index]} for file "
+                                    f"{_describe(files[index])}, falling back to the full-frame correlation")
+                    rejected.append(index)
+                indizes = rejected
+
+            # Correlate batches of images with the reference image, re-using the FFT plans for the identical shapes
+            f_reference_image = fft.rfft2(reference_image, workers=n_threads)
+            del reference_image
+            for start in range(0, len(indizes), batch_size):
+                batch = indizes[start: start + batch_size]
+                images = np.array([load_image(files[index], in_dir=in_dir) for index in batch])
+                batch_shifts = get_correlation_shifts(images, f_reference_image, n_threads=n_threads,
+                                                      upsample_factor=upsample_factor)
+                for index, shift in zip(batch, batch_shifts):
+                    shifts[index] = shift
+        else:
+            for index in indizes:
+                image = load_image(files[index], in_dir=in_dir)
+                shifts[index] = get_shift(image, reference_image=reference_image, mode=mode,
+                                          upsample_factor=upsample_factor, debug=debug)
+
+        for file, shift in zip(files, shifts):
+            logger.info(f"Identified a shift of {shift} for file {_describe(file)}")
         logger.info(f"Identified the following shifts:\n\t{shifts}")
 
     if return_image_shape:
@@ -113,7 +237,699 @@ def get_shifts(files, reference_file=None, mode='correlation', lazy_mode=True, r
         return shifts
 
 
-def get_shift(image, reference_image=None, is_fourier_transformed=False, mode='correlation', debug=False):
+def _find_file_index(files, file):
+    """Return the index of a file name in a list of files and arrays, or None if not contained."""
+    for index, item in enumerate(files):
+        if isinstance(item, str) and item == file:
+            return index
+    return None
+
+
+def _describe(file):
+    """Describe a file or array for logging."""
+    if isinstance(file, np.ndarray):
+        return f"array of shape {file.shape}"
+    return file
+
+
+def load_image(file, in_dir=''):
+    """Read an image from a file or take the array, and integrate cubes over the time axis."""
+    if isinstance(file, np.ndarray):
+        image = file
+    else:
+        image = fits.getdata(os.path.join(in_dir, file))
+    if image.ndim == 3:
+        # Integrating over time axis if image is a cube
+        image = np.sum(image, axis=0)
+    return image
+
+
+def get_header_cards(header_cards):
+    """Obtain the mapping of the offset keys to header cards.
+
+    Args:
+        header_cards (dict or str):
+            Mapping of the keys 'XOFFSET', 'YOFFSET' and optionally 'PIXSCALE' to header cards, or name of an
+            instrument section in config/instruments.cfg.
+
+    Returns:
+        header_cards (dict):
+            Mapping of the keys to header cards. The 'PIXSCALE' entry may also be a number.
+    """
+    if isinstance(header_cards, str):
+        instrument_config_file = os.path.join(os.path.dirname(__file__), '../config/instruments.cfg')
+        configs = config.read(instrument_config_file)
+        if header_cards.upper() not in configs:
+            raise SpecklepyValueError('get_header_cards()', argname='header_cards', argvalue=header_cards,
+                                      expected=f"instrument defined in {instrument_config_file}")
+        header_cards = configs[header_cards.upper()]
+    elif not isinstance(header_cards, dict):
+        raise SpecklepyTypeError('get_header_cards()', argname='header_cards', argtype=type(header_cards),
+                                 expected='dict or str')
+
+    for key in ['XOFFSET', 'YOFFSET']:
+        if key not in header_cards:
+            raise SpecklepyValueError('get_header_cards()', argname='header_cards', argvalue=header_cards,
+                                      expected=f"mapping with the key {key!r}")
+    return {key: header_cards[key] for key in ['XOFFSET', 'YOFFSET', 'PIXSCALE'] if key in header_cards}
+
+
+def get_predicted_shifts(files, reference_file, header_cards, in_dir=''):
+    """Predict the shifts of files relative to a reference file from the telescope offsets in their headers.
+
+    The offsets are assumed to measure the position of the target on the detector in units of 'PIXSCALE', such that a
+    file that is offset by +1 pixel has to be shifted by -1 pixel. Use a negative 'PIXSCALE' for the opposite sign
+    convention.
+
+    Args:
+        files (list):
+            List of files. Arrays within the list do not provide a header and obtain no prediction.
+        reference_file (str or np.ndarray):
+            Reference file of the shifts. No predictions are possible for a reference array.
+        header_cards (dict):
+            Mapping of the offset keys to header cards, as obtained from get_header_cards().
+        in_dir (str, optional):
+            Path to the files. Default is ''.
+
+    Returns:
+        predicted_shifts (list):
+            List of predicted integer shifts, or None for files without the offset cards.
+    """
+    reference_offsets = _read_offsets(reference_file, header_cards, in_dir=in_dir)
+    if reference_offsets is None:
+        logger.warning(f"Reference {_describe(reference_file)} provides no offsets, skipping the shift predictions")
+        return [None] * len(files)
+
+    predicted_shifts = []
+    for file in files:
+        offsets = _read_offsets(file, header_cards, in_dir=in_dir)
+        if offsets is None:
+            predicted_shifts.append(None)
+        else:
+            predicted_shifts.append(tuple(int(x) for x in np.round(reference_offsets - offsets)))
+    return predicted_shifts
+
+
+def _read_offsets(file, header_cards, in_dir=''):
+    """Read the offsets of a file in pixels along the (y, x) axes, or return None if not available."""
+    if not isinstance(file, str):
+        return None
+    header = fits.getheader(os.path.join(in_dir, file))
+    try:
+        offsets = np.array([header[header_cards['YOFFSET']], header[header_cards['XOFFSET']]], dtype=float)
+    except KeyError:
+        logger.warning(f"File {file} does not provide the offset cards {header_cards['YOFFSET']!r} and "
+                       f"{header_cards['XOFFSET']!r}")
+        return None
+    pixel_scale = header_cards.get('PIXSCALE', 1.)
+    if isinstance(pixel_scale, str):
+        pixel_scale = header[pixel_scale]
+    return offsets / pixel_scale
+
+
+def get_seeded_shift(image, reference_image, predicted_shift, search_radius=2, patch_size=128):
+    """Estimate the shift within a small window around a predicted shift.
+
+    The correlation is evaluated directly over a patch around the brightest reference pixel within the overlap of the
+    predicted position of the image and the reference image, see get_windowed_correlation(). The prediction is rejected
+    if this overlap is empty or if the correlation maximum lies on the border of the window, where the true peak may be
+    located outside of the window.
+
+    Args:
+        image (np.ndarray, ndim=2):
+            Image to be shifted.
+        reference_image (np.ndarray, ndim=2):
+            Reference image of the shift.
+        predicted_shift (tuple):
+            Integer shift predicted from the header offsets.
+        search_radius (int, optional):
+            Radius of the window around the prediction. Default is 2.
+        patch_size (int, optional):
+            Size of the reference patch. Set to None for using the full overlap. Default is 128.
+
+    Returns:
+        shift (tuple or None):
+            Shift of maximum correlation within the window, or None if the prediction is rejected.
+    """
+    # Restrict the patch to reference pixels, which are covered by the image for all shifts within the window
+    region, _ = get_overlap_slices(predicted_shift, image.shape, reference_image.shape)
+    region = tuple(slice(axis.start + search_radius, axis.stop - search_radius) for axis in region)
+    if any(axis.stop <= axis.start for axis in region):
+        return None
+    reference_slices = get_patch_slices(reference_image, patch_size, region=region)
+
+    correlations = get_windowed_correlation(image, reference_image, center=predicted_shift,
+                                            search_radius=search_radius, reference_slices=reference_slices)
+    peak = np.unravel_index(np.argmax(correlations), correlations.shape)
+    if min(peak) == 0 or max(peak) == 2 * search_radius or not correlations[peak] > 0:
+        return None
+    return int(predicted_shift[0] + peak[0] - search_radius), int(predicted_shift[1] + peak[1] - search_radius)
+
+
+def get_global_shifts(files, reference_index=0, in_dir='', predicted_shifts=None, n_neighbors=4, batch_size=16,
+                      n_threads=1, upsample_factor=None, min_overlap=0.1, max_residual=1.5):
+    """Estimate globally consistent shifts from the correlations of neighbouring pairs of files.
+
+    Every image is zero-padded and Fourier transformed once and the transforms are cached for correlating the pairs of
+    the graph from get_pair_graph(), in batches, see get_pair_shifts(). The pairs are processed in the order of their
+    later file and each transform is released after the last pair of its file, such that the memory is bounded by the
+    files with open pairs instead of the number of files. Each pair provides a measurement of the difference of the
+    shifts of its files, which is weighted by the normalized correlation at the peak. The shifts are then obtained by
+    weighted least squares, relative to the reference file, see solve_global_shifts(). Files that are not connected to
+    the reference file by the pair graph are correlated with the reference file directly.
+
+    Args:
+        files (list):
+            List of files or arrays of identical shapes.
+        reference_index (int, optional):
+            Index of the reference file. Default is 0.
+        in_dir (str, optional):
+            Path to the files. Default is ''.
+        predicted_shifts (list, optional):
+            Predicted shifts of the files, with None for files without a prediction, which select the neighbours of
+            each file. Neighbours are selected by the order of the files if not provided.
+        n_neighbors (int, optional):
+            Number of neighbours of each file. Default is 4.
+        batch_size (int, optional):
+            Number of pairs that are correlated at once. Default is 16.
+        n_threads (int, optional):
+            Number of threads for the FFTs. Default is 1.
+        upsample_factor (int, optional):
+            If provided, the pairwise shifts are refined to a precision of 1/upsample_factor pixels and the float
+            solution is returned. The shifts are rounded to integers otherwise.
+        min_overlap (float, optional):
+            Minimum fraction of overlapping pixels of two images for the shifts considered. Default is 0.1.
+        max_residual (float, optional):
+            Pairs deviating by more than this number of pixels from the solution are rejected as outliers, see
+            solve_global_shifts(). Default is 1.5.
+
+    Returns:
+        shifts (list):
+            List of shifts for each file relative to the reference file.
+    """
+    # Transform the images once, zero-padded to twice their shape, such that the correlations of pairs with large
+    # shifts do not wrap around. The sums of the images and their squares within the overlaps at each shift are cached
+    # as well, for normalizing the correlations.
+    image_shape = load_image(files[reference_index], in_dir=in_dir).shape
+    padded_shape = (2 * image_shape[0], 2 * image_shape[1])
+    f_mask = np.conjugate(fft.rfft2(np.ones(image_shape), s=padded_shape, workers=n_threads))
+    overlap = np.round(_correlate(f_mask * np.conjugate(f_mask), padded_shape, n_threads=n_threads))
+    f_mask = f_mask.astype(np.complex64)
+    cache = {}
+
+    def transform(index):
+        if index not in cache:
+            image = load_image(files[index], in_dir=in_dir).astype(np.float32)
+            image -= np.mean(image)
+            f_image = fft.rfft2(image, s=padded_shape, workers=n_threads)
+            window_sum = _correlate(f_image * f_mask, padded_shape, n_threads=n_threads)
+            window_square = _correlate(fft.rfft2(np.square(image), s=padded_shape, workers=n_threads) * f_mask,
+                                       padded_shape, n_threads=n_threads)
+            cache[index] = f_image, window_sum, window_square
+        return cache[index]
+
+    def correlate(pairs):
+        indizes, local_pairs = np.unique(pairs, return_inverse=True)
+        f_images, window_sums, window_squares = (np.stack(arrays) for arrays in zip(*map(transform, indizes)))
+        return get_pair_shifts(f_images, window_sums, window_squares, overlap, local_pairs.reshape(pairs.shape),
+                               image_shape, n_threads=n_threads, upsample_factor=upsample_factor,
+                               min_overlap=min_overlap)
+
+    # Correlate the pairs in batches, in the order of their later file, such that only the transforms of files with
+    # pairs left are cached. For neighbours by the order of the files, these are about `n_neighbors` files.
+    pairs = get_pair_graph(len(files), positions=predicted_shifts, n_neighbors=n_neighbors)
+    pairs = pairs[np.lexsort((pairs[:, 0], pairs[:, 1]))]
+    last_pair = np.full(len(files), -1)
+    for column in pairs.T:
+        np.maximum.at(last_pair, column, np.arange(len(pairs)))
+    logger.info(f"Correlating {len(pairs)} pairs of files")
+    pair_shifts = np.empty((len(pairs), 2))
+    weights = np.empty(len(pairs))
+    for start in range(0, len(pairs), batch_size):
+        batch = pairs[start: start + batch_size]
+        pair_shifts[start: start + len(batch)], weights[start: start + len(batch)] = correlate(batch)
+        for index in np.unique(batch):
+            if last_pair[index] < start + len(batch) and index != reference_index:
+                del cache[index]
+
+    shifts, solved = solve_global_shifts(len(files), pairs, pair_shifts, weights, reference_index=reference_index,
+                                         max_residual=max_residual)
+
+    # Correlate the disconnected files directly with the reference file
+    for index in np.flatnonzero(~solved):
+        logger.warning(f"File {_describe(files[index])} is not connected to the reference file by overlapping pairs, "
+                       f"correlating it with the reference file directly")
+        shifts[index] = correlate(np.array([[reference_index, index]]))[0][0]
+
+    if upsample_factor is None:
+        return [(int(y), int(x)) for y, x in np.round(shifts)]
+    return [(float(y), float(x)) for y, x in shifts]
+
+
+def get_pair_shifts(f_images, window_sums, window_squares, overlap, pairs, image_shape, n_threads=1,
+                    upsample_factor=None, min_overlap=0.1):
+    """Estimate the shifts of pairs of images from the peaks of their normalized cross-correlations.
+
+    The correlation at each shift is normalized by the mean and standard deviation of both images within their
+    overlap, following Padfield (2012). This removes the bias of the correlation of zero-padded images towards small
+    shifts with large overlaps. The sums within the overlaps are provided per image, such that only the cross-power
+    spectrum of each pair needs to be transformed.
+
+    Args:
+        f_images (np.ndarray, ndim=3):
+            Real-input transforms of the zero-padded images.
+        window_sums (np.ndarray, ndim=3):
+            Sums of the images within the overlap at each shift, relative to an image that is placed at this shift.
+        window_squares (np.ndarray, ndim=3):
+            Sums of the squared images within the overlap at each shift, as window_sums.
+        overlap (np.ndarray, ndim=2):
+            Number of overlapping pixels at each shift.
+        pairs (np.ndarray):
+            Array of shape (n_pairs, 2) with the indizes of the images of each pair.
+        image_shape (tuple):
+            Shape of the images before padding.
+        n_threads (int, optional):
+            Number of threads for the FFTs. Default is 1.
+        upsample_factor (int, optional):
+            If provided, the integer shifts are refined by fitting parabolas to the normalized correlations and
+            rounded to a precision of 1/upsample_factor pixels.
+        min_overlap (float, optional):
+            Minimum fraction of overlapping pixels for the shifts considered. Default is 0.1.
+
+    Returns:
+        shifts (np.ndarray):
+            Array of shape (n_pairs, 2) with the shift of the second image relative to the first image of each pair.
+        peaks (np.ndarray):
+            Normalized correlations at the shifts, between -1 and 1.
+    """
+    padded_shape = overlap.shape
+    first, second = pairs[:, 0], pairs[:, 1]
+
+    # The sums of the second image within the overlaps are those of the first image at the inverted shifts
+    sums_first = window_sums[first]
+    sums_second = np.roll(np.flip(window_sums[second], axis=(-2, -1)), 1, axis=(-2, -1))
+    squares_second = np.roll(np.flip(window_squares[second], axis=(-2, -1)), 1, axis=(-2, -1))
+    inverse_overlap = np.where(overlap >= min_overlap * np.prod(image_shape), 1 / np.maximum(overlap, 1), 0)
+    means_first = sums_first * inverse_overlap
+    covariance = _correlate(f_images[first] * np.conjugate(f_images[second]), padded_shape, n_threads=n_threads)
+    covariance -= means_first * sums_second
+    variance = window_squares[first] - means_first * sums_first
+    variance *= squares_second - np.square(sums_second) * inverse_overlap
+    valid = (variance > 0) & (inverse_overlap > 0)
+    np.sqrt(variance, out=variance, where=valid)
+    correlations = np.divide(covariance, variance, out=np.full(covariance.shape, -np.inf), where=valid)
+
+    # Derive the shifts from the normalized correlations
+    indizes = np.argmax(correlations.reshape((len(pairs), -1)), axis=1)
+    peaks = np.unravel_index(indizes, padded_shape)
+    centers = correlations[(np.arange(len(pairs)),) + peaks]
+    shifts = np.stack(peaks, axis=-1) - [int(extent / 2) for extent in padded_shape]
+
+    # Refine the shifts by fitting parabolas through the peaks and their direct neighbours
+    if upsample_factor is not None:
+        shifts = shifts.astype(float)
+        for axis, extent in enumerate(padded_shape):
+            neighbors = []
+            for step in [-1, 1]:
+                index = list(peaks)
+                index[axis] = np.clip(peaks[axis] + step, 0, extent - 1)
+                neighbors.append(correlations[(np.arange(len(pairs)),) + tuple(index)])
+            lower, upper = neighbors
+            curvature = lower - 2 * centers + upper
+            with np.errstate(divide='ignore', invalid='ignore'):
+                delta = np.where(np.isfinite(curvature) & (curvature < 0), 0.5 * (lower - upper) / curvature, 0.)
+            shifts[:, axis] += np.round(np.clip(delta, -0.5, 0.5) * upsample_factor) / upsample_factor
+    return shifts, centers
+
+
+def _correlate(f_correlations, shape, n_threads=1):
+    """Transform cross-power spectra back into correlations with the zero shift at the center."""
+    return np.fft.fftshift(fft.irfft2(f_correlations, s=shape, workers=n_threads), axes=(-2, -1))
+
+
+def get_pair_graph(n_files, positions=None, n_neighbors=4):
+    """Select the pairs of files to correlate.
+
+    Files with a known position are paired with their `n_neighbors` nearest neighbours, using a k-d tree. Files without
+    a position are paired with the files that precede and follow them in the list, within `n_neighbors // 2` places.
+    The number of pairs therefore grows linearly with the number of files.
+
+    Args:
+        n_files (int):
+            Number of files.
+        positions (list, optional):
+            Positions of the files, for instance their predicted shifts, with None for unknown positions.
+        n_neighbors (int, optional):
+            Number of neighbours of each file. Default is 4.
+
+    Returns:
+        pairs (np.ndarray):
+            Array of shape (n_pairs, 2) with the indizes of the files of each pair, in ascending order.
+    """
+    pairs = set()
+    if positions is None:
+        positions = [None] * n_files
+    known = [index for index, position in enumerate(positions) if position is not None]
+    if len(known) < 2:
+        known = []
+
+    # Nearest neighbours by position
+    if len(known) > 0:
+        points = np.array([positions[index] for index in known], dtype=float)
+        _, neighbors = cKDTree(points).query(points, k=min(n_neighbors + 1, len(known)))
+        for index, row in zip(known, neighbors):
+            for neighbor in row:
+                neighbor = known[neighbor]
+                if neighbor != index:
+                    pairs.add((min(index, neighbor), max(index, neighbor)))
+
+    # Neighbours by order for the remaining files
+    unknown = set(range(n_files)) - set(known)
+    for index in unknown:
+        for distance in range(1, max(n_neighbors // 2, 1) + 1):
+            for neighbor in [index - distance, index + distance]:
+                if 0 <= neighbor < n_files:
+                    pairs.add((min(index, neighbor), max(index, neighbor)))
+
+    return np.array(sorted(pairs), dtype=int).reshape((-1, 2))
+
+
+def solve_global_shifts(n_files, pairs, pair_shifts, weights, reference_index=0, max_residual=1.5, max_iterations=10):
+    """Solve for the shifts of files from the shift differences of pairs by weighted least squares.
+
+    Each pair (i, j) measures the difference shifts[j] - shifts[i]. The shift of the reference file is fixed to zero
+    and the normal equations of the remaining shifts are solved as a sparse linear system. Pairs with non-positive
+    weights are ignored. Pairs deviating by more than `max_residual` from the solution are rejected iteratively, each
+    time those above half of the largest residual, and the system is solved again.
+
+    Args:
+        n_files (int):
+            Number of files.
+        pairs (np.ndarray):
+            Array of shape (n_pairs, 2) with the indizes of the files of each pair.
+        pair_shifts (np.ndarray):
+            Array of shape (n_pairs, 2) with the shift of the second file relative to the first file of each pair.
+        weights (np.ndarray):
+            Weights of the pairs.
+        reference_index (int, optional):
+            Index of the reference file. Default is 0.
+        max_residual (float, optional):
+            Threshold in pixels for rejecting pairs as outliers. Default is 1.5.
+        max_iterations (int, optional):
+            Maximum number of iterations of rejecting outliers. Default is 10.
+
+    Returns:
+        shifts (np.ndarray):
+            Array of shape (n_files, 2) with the shifts of the files relative to the reference file.
+        solved (np.ndarray):
+            Boolean array marking the files that are connected to the reference file. The shifts of the other files
+            are zero.
+    """
+    pair_shifts = np.asarray(pair_shifts, dtype=float)
+    valid = np.asarray(weights) > 0
+
+    for iteration in range(max_iterations + 1):
+        _pairs = pairs[valid]
+        _weights = weights[valid]
+        _pair_shifts = pair_shifts[valid]
+
+        # Identify the files that are connected to the reference file
+        graph = sparse.coo_matrix((np.ones(len(_pairs)), (_pairs[:, 0], _pairs[:, 1])), shape=(n_files, n_files))
+        _, labels = connected_components(graph, directed=False)
+        solved = labels == labels[reference_index]
+        unknowns = np.flatnonzero(solved & (np.arange(n_files) != reference_index))
+        columns = np.full(n_files, -1)
+        columns[unknowns] = np.arange(len(unknowns))
+
+        # Design matrix of the shift differences, leaving out the fixed reference shift
+        shifts = np.zeros((n_files, 2))
+        if len(unknowns) > 0:
+            connected = np.flatnonzero(solved[_pairs[:, 0]])
+            row_indizes, column_indizes, values = [], [], []
+            for side, sign in [(1, 1.), (0, -1.)]:
+                _columns = columns[_pairs[connected, side]]
+                is_unknown = _columns >= 0
+                row_indizes.append(connected[is_unknown])
+                column_indizes.append(_columns[is_unknown])
+                values.append(np.full(np.sum(is_unknown), sign))
+            row_indizes = np.concatenate(row_indizes)
+            column_indizes = np.concatenate(column_indizes)
+            values = np.concatenate(values)
+            design = sparse.csr_matrix((values, (row_indizes, column_indizes)), shape=(len(_pairs), len(unknowns)))
+
+            weighted = design.T.multiply(_weights).tocsr()
+            normal = (weighted @ design).tocsc()
+            rhs = weighted @ _pair_shifts
+            shifts[unknowns] = np.reshape(spsolve(normal, rhs), (len(unknowns), 2))
+
+        # Reject the largest outliers
+        residuals = np.linalg.norm(shifts[_pairs[:, 1]] - shifts[_pairs[:, 0]] - _pair_shifts, axis=1)
+        residuals[~solved[_pairs[:, 0]]] = 0
+        if iteration == max_iterations or not np.any(residuals > max_residual):
+            break
+        outliers = residuals > max(max_residual, np.max(residuals) / 2)
+        logger.debug(f"Rejecting {np.sum(outliers)} pairs as outliers")
+        valid[np.flatnonzero(valid)[outliers]] = False
+
+    return shifts, solved
+
+
+def get_pyramid(image, n_levels=None, min_size=64):
+    """Create a pyramid of block-averaged images.
+
+    Args:
+        image (np.ndarray, ndim=2):
+            Image at full resolution.
+        n_levels (int, optional):
+            Number of levels below the full resolution, each averaging blocks of 2x2 pixels of the level above. Derived
+            such that the coarsest level is at least `min_size` pixels wide along both axes, if not provided.
+        min_size (int, optional):
+            Minimum size of the coarsest level, if n_levels is not provided. Default is 64.
+
+    Returns:
+        pyramid (list):
+            List of the images from full resolution to the coarsest level.
+    """
+    if n_levels is None:
+        n_levels = max(int(np.log2(min(image.shape) / min_size)), 0)
+    pyramid = [image]
+    for level in range(n_levels):
+        image = pyramid[-1]
+        height, width = image.shape[0] // 2, image.shape[1] // 2
+        pyramid.append(image[:2 * height, :2 * width].reshape((height, 2, width, 2)).mean(axis=(1, 3)))
+    return pyramid
+
+
+def get_patch_slices(image, patch_size=None, region=None):
+    """Slices of a square patch centered on the brightest pixel of an image, shifted to lie within the image.
+
+    Args:
+        image (np.ndarray, ndim=2):
+            Image to select the patch from.
+        patch_size (int, optional):
+            Size of the patch. Returns slices covering the full image or region if None.
+        region (tuple of slices, optional):
+            Region of the image, to which the patch is restricted. Using the full image if not provided.
+
+    Returns:
+        slices (tuple of slices):
+            Slices selecting the patch.
+    """
+    if region is None:
+        region = slice(0, image.shape[0]), slice(0, image.shape[1])
+    if patch_size is None:
+        return region
+    peak = np.unravel_index(np.argmax(image[region]), image[region].shape)
+    slices = []
+    for center, axis in zip(peak, region):
+        extent = axis.stop - axis.start
+        size = min(patch_size, extent)
+        start = min(max(center - size // 2, 0), extent - size) + axis.start
+        slices.append(slice(int(start), int(start + size)))
+    return tuple(slices)
+
+
+def refine_pyramid_shift(pyramid, reference_pyramid, shift, search_radius=2, reference_patches=None):
+    """Refine a shift from the coarsest level of an image pyramid to the full resolution.
+
+    Args:
+        pyramid (list):
+            Pyramid of the image, as obtained from get_pyramid().
+        reference_pyramid (list):
+            Pyramid of the reference image with the same number of levels.
+        shift (tuple):
+            Shift estimate at the coarsest level.
+        search_radius (int, optional):
+            Radius of the search window around the doubled shift of the coarser level. Default is 2.
+        reference_patches (list, optional):
+            Slices of the reference patch at each level, see get_patch_slices(). Using the full frames if not
+            provided.
+
+    Returns:
+        shift (tuple):
+            Shift at full resolution.
+    """
+    if reference_patches is None:
+        reference_patches = [None] * len(reference_pyramid)
+    for level in reversed(range(len(pyramid) - 1)):
+        shift = get_windowed_shift(pyramid[level], reference_pyramid[level], center=(2 * shift[0], 2 * shift[1]),
+                                   search_radius=search_radius, reference_slices=reference_patches[level])
+    return shift
+
+
+def get_windowed_shift(image, reference_image, center, search_radius=2, reference_slices=None):
+    """Estimate the shift by a direct correlation restricted to a window of candidate shifts.
+
+    The correlation is evaluated only for the (2 * search_radius + 1)^2 shifts around `center`, as the sum over the
+    overlap of the reference patch and the shifted image. The cost hence scales with the search window and the patch
+    size instead of requiring FFTs of the full frames.
+
+    Args:
+        image (np.ndarray, ndim=2):
+            Image to be shifted.
+        reference_image (np.ndarray, ndim=2):
+            Reference image of the shift.
+        center (tuple):
+            Center of the window of candidate shifts.
+        search_radius (int, optional):
+            Radius of the window. Default is 2.
+        reference_slices (tuple of slices, optional):
+            Patch of the reference image, over which the correlation is evaluated. Using the full reference image if
+            not provided.
+
+    Returns:
+        shift (tuple):
+            Shift of maximum correlation within the window.
+    """
+    correlations = get_windowed_correlation(image, reference_image, center, search_radius=search_radius,
+                                            reference_slices=reference_slices)
+    peak = np.unravel_index(np.argmax(correlations), correlations.shape)
+    return int(center[0] + peak[0] - search_radius), int(center[1] + peak[1] - search_radius)
+
+
+def get_windowed_correlation(image, reference_image, center, search_radius=2, reference_slices=None):
+    """Evaluate the direct correlation for a window of candidate shifts.
+
+    Args:
+        image (np.ndarray, ndim=2):
+            Image to be shifted.
+        reference_image (np.ndarray, ndim=2):
+            Reference image of the shift.
+        center (tuple):
+            Center of the window of candidate shifts.
+        search_radius (int, optional):
+            Radius of the window. Default is 2.
+        reference_slices (tuple of slices, optional):
+            Patch of the reference image, over which the correlation is evaluated. Using the full reference image if
+            not provided.
+
+    Returns:
+        correlations (np.ndarray):
+            Array of shape (2 * search_radius + 1, 2 * search_radius + 1) with the correlation of the candidate shift
+            center + (index - search_radius) at each index.
+    """
+    if reference_slices is None:
+        reference_slices = get_patch_slices(reference_image)
+    patch = reference_image[reference_slices]
+    patch_origin = np.array([reference_slices[0].start, reference_slices[1].start])
+
+    window = np.arange(-search_radius, search_radius + 1)
+    correlations = np.empty((window.size, window.size))
+    for iy, shift_y in enumerate(center[0] + window):
+        for ix, shift_x in enumerate(center[1] + window):
+            # The image pixel p - shift overlaps with the reference pixel p
+            patch_slices, image_slices = get_overlap_slices(np.array([shift_y, shift_x]) - patch_origin, image.shape,
+                                                            patch.shape)
+            correlations[iy, ix] = np.sum(patch[patch_slices] * image[image_slices])
+    return correlations
+
+
+def get_correlation_shifts(images, f_reference_image, n_threads=1, upsample_factor=None):
+    """Estimate the shifts of a batch of images by their 2D correlation with a reference image.
+
+    The correlations are computed with real-input FFTs over the last two axes of the whole batch at once.
+
+    Args:
+        images (np.ndarray, ndim=3):
+            Stack of images of identical shape along the zero-th axis.
+        f_reference_image (np.ndarray):
+            Real-input Fourier transform of the reference image, as obtained from scipy.fft.rfft2.
+        n_threads (int, optional):
+            Number of threads for the FFTs. Default is 1.
+        upsample_factor (int, optional):
+            If provided, the integer shifts are refined to a precision of 1/upsample_factor pixels, see refine_shift().
+
+    Returns:
+        shifts (list):
+            List of shift tuples for each image.
+    """
+    image_shape = images.shape[-2:]
+    f_images = fft.rfft2(images, workers=n_threads)
+    np.conjugate(f_images, out=f_images)
+    f_images *= f_reference_image
+    correlations = fft.irfft2(f_images, s=image_shape, workers=n_threads)
+
+    # Derive the shifts from the correlations, wrapping the peaks into the interval of the fftshift-ed correlations
+    # instead of shifting the correlations themselves
+    peaks = np.unravel_index(np.argmax(correlations.reshape((len(images), -1)), axis=1), image_shape)
+    offsets = [int(extent / 2) for extent in image_shape]
+    peaks = [(peak + offset) % extent - offset for peak, offset, extent in zip(peaks, offsets, image_shape)]
+    shifts = [(int(y), int(x)) for y, x in zip(*peaks)]
+
+    # Refine the shifts on the cross-power spectra
+    if upsample_factor is not None:
+        shifts = [refine_shift(f_image, shift, image_shape, upsample_factor=upsample_factor)
+                  for f_image, shift in zip(f_images, shifts)]
+    return shifts
+
+
+def refine_shift(f_correlation, shift, image_shape, upsample_factor=10):
+    """Refine an integer shift with the upsampled cross-correlation in a small neighborhood.
+
+    The correlation is evaluated on a grid of 1.5 x 1.5 pixels around the coarse shift with a spacing of
+    1/upsample_factor pixels, by a matrix-multiply DFT of the cross-power spectrum, following Guizar-Sicairos et al.
+    (2008). This avoids upsampling the whole correlation. As the correlation of real images is real, the half-plane
+    spectrum of the real-input FFT is evaluated with doubled weights for the redundant columns.
+
+    Args:
+        f_correlation (np.ndarray):
+            Real-input cross-power spectrum, that is the product of the transformed reference image and the conjugate
+            of the transformed image.
+        shift (tuple):
+            Integer shift, as obtained from the peak of the correlation.
+        image_shape (tuple):
+            Shape of the correlated images.
+        upsample_factor (int, optional):
+            Number of sub-pixel steps per pixel. Default is 10.
+
+    Returns:
+        shift (tuple):
+            Refined shift of float values.
+    """
+    n_steps = int(np.ceil(1.5 * upsample_factor))
+    steps = (np.arange(n_steps) - n_steps // 2) / upsample_factor
+    grid_y = shift[0] + steps
+    grid_x = shift[1] + steps
+
+    # Weights of the columns of the half-plane spectrum
+    frequencies_y = np.fft.fftfreq(image_shape[0])
+    frequencies_x = np.fft.rfftfreq(image_shape[1])
+    weights_x = np.full(frequencies_x.shape, 2.)
+    weights_x[0] = 1.
+    if image_shape[1] % 2 == 0:
+        weights_x[-1] = 1.
+
+    # Evaluate the correlation on the local grid by matrix-multiply DFTs along both axes
+    kernel_y = np.exp(2j * np.pi * np.outer(grid_y, frequencies_y))
+    kernel_x = np.exp(2j * np.pi * np.outer(frequencies_x, grid_x))
+    upsampled = np.real(kernel_y @ (f_correlation * weights_x) @ kernel_x)
+
+    peak = np.unravel_index(np.argmax(upsampled), upsampled.shape)
+    return float(grid_y[peak[0]]), float(grid_x[peak[1]])
+
+
+def get_shift(image, reference_image=None, is_fourier_transformed=False, mode='correlation', upsample_factor=None,
+              debug=False):
     """Estimate the shift between an image and a reference image.
 
     Estimate the relative shift between an image and a reference image by means of a 2D correlation
@@ -126,18 +942,22 @@ def get_shift(image, reference_image=None, is_fourier_transformed=False, mode='c
             2D array of the reference image of the shift.
         is_fourier_transformed (bool):
             Indicate whether the reference image is already Fourier transformed. This is implemented to save
-            computation by computing that transform only once.
+            computation by computing that transform only once. Both the real-input transform from scipy.fft.rfft2 and
+            the full transform from np.fft.fft2 are accepted.
         mode (str, optional):
             Mode of the shift estimate. In 'correlation' mode, a 2D correlation is used to estimate the shift of the
             array. This is computationally much more expensive than the identical 'maximum' or 'peak' modes, which
             simply identify the coordinates of the emission peaks and return the difference. Though these modes may be
             fooled by reference sources of similar brightness. Default is 'correlation'.
+        upsample_factor (int, optional):
+            If provided, the shift is refined to a precision of 1/upsample_factor pixels in 'correlation' mode, see
+            refine_shift(). Default is None.
         debug (bool, optional):
             Set to True to inspect intermediate results. Default is False.
 
     Returns:
         shift (tuple):
-            Tuple of shift indices for each axis.
+            Tuple of shift indices for each axis, or of float values if upsample_factor is provided.
     """
 
     # Check input parameters
@@ -165,23 +985,19 @@ def get_shift(image, reference_image=None, is_fourier_transformed=False, mode='c
     elif mode == 'correlation':
         # Get the Fourier transformed reference image for cross-correlation
         if not is_fourier_transformed:
-            f_reference_image = np.fft.fft2(reference_image)
+            f_reference_image = fft.rfft2(reference_image)
+        elif reference_image.shape == image.shape:
+            # The full transform contains the real-input transform in its first half
+            f_reference_image = reference_image[:, :image.shape[1] // 2 + 1]
         else:
             f_reference_image = reference_image
 
-        # Fourier transform the image
-        f_image = np.conjugate(np.fft.fft2(image))
-
         # Compute the 2-dimensional correlation
-        correlation = np.fft.ifft2(np.multiply(f_reference_image, f_image))
-        correlation = np.fft.fftshift(correlation)
         if debug:
-            imshow(np.abs(correlation), title='FFT shifted correlation')
+            correlation = fft.irfft2(f_reference_image * np.conjugate(fft.rfft2(image)), s=image.shape)
+            imshow(np.abs(np.fft.fftshift(correlation)), title='FFT shifted correlation')
 
-        # Derive the shift from the correlation
-        shift = np.unravel_index(np.argmax(correlation), correlation.shape)
-        shift = tuple(x - int(correlation.shape[i] / 2) for i, x in enumerate(shift))
-        return shift
+        return get_correlation_shifts(image[np.newaxis], f_reference_image, upsample_factor=upsample_factor)[0]
 
 
 def get_pad_vectors(shifts, cube_mode=False, return_reference_image_pad_vector=False):
@@ -249,7 +1065,9 @@ def pad_array(array, pad_vector, mode='same', reference_image_pad_vector=None):
     mode.
 
     Pads an array with zeros to match a desired field size. Intermediately, it always creates a 'full' image and only
-    in 'same' mode it crops the edges such that the returned array covers only the field of the reference image.
+    in 'same' mode it crops the edges such that the returned array covers only the field of the reference image. In
+    'valid' mode, the array is not padded at all but only cropped to the field that is covered by all shifted arrays,
+    such that subsequent computations on the returned view process only the common overlap.
 
     Args:
         array (np.ndarray):
@@ -257,15 +1075,15 @@ def pad_array(array, pad_vector, mode='same', reference_image_pad_vector=None):
         pad_vector (list):
             List of padding vectors, as obtained from get_pad_vectors().
         mode (str, optional):
-            Define the size of the output image as 'same' to the reference image or expanding to include the 'full'
-            covered field.
+            Define the size of the output image as 'same' to the reference image, expanding to include the 'full'
+            covered field, or cropped to the 'valid' field that is covered by all arrays.
         reference_image_pad_vector (tuple or list, optional):
             Used in `same` mode to estimate the position of the reference image and crop beyond.
 
     Returns:
         padded (np.ndarray):
             Padded array, matching the field of the reference image in 'same'
-            mode, or the complete field in 'full' mode.
+            mode, or the complete field in 'full' mode. In 'valid' mode, this is a cropped view of the input array.
     """
 
     # Check input parameters
@@ -275,6 +1093,11 @@ def pad_array(array, pad_vector, mode='same', reference_image_pad_vector=None):
     else:
         raise SpecklepyTypeError('pad_array()', argname='array', argtype=type(array), expected='np.ndarray')
 
+    # Only crop in 'valid' mode: The covered field starts at the upper padding, i.e. the distance to the largest shift,
+    # and ends the lower padding, i.e. the distance to the smallest shift, before the array edge
+    if mode == 'valid':
+        return array[tuple(slice(upper, extent - lower) for (lower, upper), extent in zip(pad_vector, array.shape))]
+
     #
     padded = np.pad(array, pad_vector, mode='constant')
 
@@ -292,12 +1115,100 @@ def pad_array(array, pad_vector, mode='same', reference_image_pad_vector=None):
         # There is nothing to crop in 'full' mode
         pass
 
-    elif mode == 'valid':
-        raise NotImplementedError("specklepy.core.alignment.pad_array does not support the 'valid' mode yet!")
-
     return padded
 
 
+def get_overlap_slices(offset, array_shape, target_shape):
+    """Computes the slices that place a shifted array into a target array.
+
+    The array is placed with its origin at the position `offset` of the target array. This is equivalent to padding the
+    array by the offset and cropping the result to the target shape, but avoids allocating the padded copy.
+
+    Args:
+        offset (tuple or array_like):
+            Position of the origin of the array within the target array, along each of the last two axes.
+        array_shape (tuple):
+            Shape of the array that shall be placed.
+        target_shape (tuple):
+            Shape of the target array.
+
+    Returns:
+        target_slices (tuple of slices):
+            Slices selecting the target pixels covered by the array.
+        array_slices (tuple of slices):
+            Slices selecting the array pixels that fall into the target array. Both slices select regions of identical
+            shape, which may be empty.
+    """
+    target_slices = []
+    array_slices = []
+    for shift, array_size, target_size in zip(offset, array_shape[-2:], target_shape[-2:]):
+        shift = int(shift)
+        start = min(max(shift, 0), target_size)
+        stop = max(min(shift + array_size, target_size), start)
+        target_slices.append(slice(start, stop))
+        array_slices.append(slice(start - shift, stop - shift))
+    return tuple(target_slices), tuple(array_slices)
+
+
+def add_shifted(target, array, offset, squared=False):
+    """Adds an array with its origin placed at `offset` in-place to the target array.
+
+    Args:
+        target (np.ndarray):
+            Array that is updated in-place.
+        array (np.ndarray):
+            Array that is added to the target. Pixels shifted beyond the target borders are ignored.
+        offset (tuple or array_like):
+            Position of the origin of the array within the target array. Fractional offsets are distributed onto the
+            four neighbouring integer offsets with bilinear weights.
+        squared (bool, optional):
+            Apply the squared bilinear weights, for adding variance maps. Default is False.
+
+    Returns:
+        target (np.ndarray):
+            The updated target array.
+    """
+    if isinstance(offset, np.ndarray) and offset.dtype.kind in 'iu':
+        offsets = [(offset, None)]
+    else:
+        offsets = get_bilinear_offsets(offset)
+    for integer_offset, weight in offsets:
+        target_slices, array_slices = get_overlap_slices(integer_offset, array.shape, target.shape)
+        if weight is None:
+            target[(Ellipsis,) + target_slices] += array[(Ellipsis,) + array_slices]
+        else:
+            weight = weight ** 2 if squared else weight
+            target[(Ellipsis,) + target_slices] += weight * array[(Ellipsis,) + array_slices]
+    return target
+
+
+def get_bilinear_offsets(offset):
+    """Split a fractional offset into the neighbouring integer offsets and their bilinear weights.
+
+    Args:
+        offset (tuple or array_like):
+            Offset along the last two axes.
+
+    Returns:
+        offsets (list):
+            List of (integer_offset, weight) tuples. The weight is None for integer offsets, which are returned as the
+            single entry.
+    """
+    offset = np.asarray(offset, dtype=float)
+    lower = np.floor(offset)
+    fraction = offset - lower
+    lower = lower.astype(int)
+    if not np.any(fraction):
+        return [(lower, None)]
+
+    offsets = []
+    for corner in [(0, 0), (0, 1), (1, 0), (1, 1)]:
+        weight = np.prod(np.where(corner, fraction, 1 - fraction))
+        if weight > 0:
+            offsets.append((lower + corner, weight))
+    return offsets
+
+
 def _adapt_max_coordinate(index):
     """Cast the upper interval border, such that indexing returns the correct
     entries.
@@ -2,7 +2,7 @@ import numpy as np
 
 
 
-def get_sample_draw_vectors(nDraws, nFrames, first_uniform=False):
+def get_sample_draw_vectors(nDraws, nFrames, first_uniform=False, seed=None):
     """Generate draw or weight vectors for bootstrap resampling.
 
     Args:
@@ -12,6 +12,8 @@ def get_sample_draw_vectors(nDraws, nFrames, first_uniform=False):
             Number of frames to pick from.
         first_uniform (bool):
             Set True to receive the first draw as uniform wights/ all ones.
+        seed (int or np.random.SeedSequence, optional):
+            Seed of the random number generator, for reproducible draws.
 
     Returns:
         sample_draw_vectors (numpy.ndarray):
@@ -20,12 +22,11 @@ def get_sample_draw_vectors(nDraws, nFrames, first_uniform=False):
     """
 
     shape = (nDraws, nFrames)
-    draw_indizes = np.random.randint(nFrames, size=shape)
+    draw_indizes = np.random.default_rng(seed).integers(nFrames, size=shape)
 
-    sample_draw_vectors = np.zeros(shape=shape)
-    for sample_draw_index, sample_draw_vector in enumerate(sample_draw_vectors):
-        unique_indizes, counts = np.unique(draw_indizes[sample_draw_index], return_counts=True)
-        sample_draw_vectors[sample_draw_index][unique_indizes] = counts
+    # Count the draws of all samples at once, by offsetting the indizes of each draw into a separate block
+    draw_indizes += np.arange(nDraws).reshape((-1, 1)) * nFrames
+    sample_draw_vectors = np.bincount(draw_indizes.ravel(), minlength=nDraws * nFrames).reshape(shape).astype(float)
 
     if first_uniform:
         sample_draw_vectors[0] = 1
@@ -33,3 +34,15 @@ def get_sample_draw_vectors(nDraws, nFrames, first_uniform=False):
     return sample_draw_vectors
 
 
+def get_bootstrap_error(samples):
+    """Estimate the uncertainty from bootstrap samples.
+
+    Args:
+        samples (numpy.ndarray):
+            Array of bootstrap samples along the zero-th axis.
+
+    Returns:
+        error (numpy.ndarray):
+            Standard deviation of the samples.
+    """
+    return np.std(samples, axis=0, ddof=1)
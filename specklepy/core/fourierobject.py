@@ -1,15 +1,15 @@
+from functools import partial
+import hashlib
 import numpy as np
-from numpy.fft import fft2, ifft2, fftshift
 import os
-from tqdm import trange
+from scipy import fft
 
-from astropy.io import fits
-
-from specklepy.core.alignment import get_pad_vectors, pad_array
+from specklepy.core.alignment import add_shifted, get_pad_vectors, pad_array
 from specklepy.core.psfmodel import PSFModel
 from specklepy.exceptions import SpecklepyValueError
+from specklepy.io.cubereader import CubeInfo, CubeReader, check_time_binning
 from specklepy.logging import logger
-from specklepy.utils.transferfunctions import otf
+from specklepy.utils.parallel import get_n_jobs, parallel_reduce
 
 
 class FourierObject(object):
@@ -17,17 +17,21 @@ class FourierObject(object):
     """Reconstruction of the Fourier transformed object.
 
     This class computes the Fourier transformed object information, as defined in Eq. 1 (Schoedel et al., 2013).
-    Therefore it estimates the padding of the PSF and image frames.
+    Therefore it estimates the padding of the PSF and image frames. The frames are placed into reusable buffers and
+    transformed in chunks by real-valued FFTs, such that the Fourier-plane arrays cover only the non-negative
+    frequencies along the last axis, in the unshifted layout of scipy.fft.rfft2.
     """
 
-    def __init__(self, in_files, psf_files, shifts, mode='same', in_dir=None):
+    def __init__(self, in_files, psf_files, shifts, mode='same', in_dir=None, frame_shifts=None, time_binning=None,
+                 roi=None, chunk_size=32, n_threads=None, spectra_cache=None, psf_extractor=None, n_jobs=1,
+                 task_size=None):
         """ Initialize a FourierObject instance.
 
         Args:
             in_files (list):
                 List of paths of the input files.
-            psf_files (list):
-                List of paths of the PSF files.
+            psf_files (list or None):
+                List of paths of the PSF files. May be None if a psf_extractor is provided.
             shifts (list):
                 List of integer shifts between the files.
             mode (str, optional):
@@ -35,16 +39,77 @@ class FourierObject(object):
                 covered field. Default is 'same'.
             in_dir (str, optional):
                 Path to the input files.
+            frame_shifts (list, optional):
+                List of arrays of shape (n_frames, 2) with the shifts of the frames within each file, for instance from
+                a FrameTracker. The frames are shifted by these before the transformation. Note that the PSFs should
+                then be extracted from the shifted frames as well. With time_binning, the shifts refer to the binned
+                frames.
+            time_binning (int, optional):
+                If provided, this number of consecutive image and PSF frames is co-added before the transformation.
+                Since the binned image is the convolution of the object with the sum of the PSFs, the PSFs can be
+                extracted from the unbinned frames. Default is None.
+            roi (ROI, optional):
+                If provided, the image frames are cropped to this region of interest before the transformation, such
+                that the FFT sizes scale with the region instead of the detector. The shifts then refer to the cropped
+                frames. Default is None.
+            chunk_size (int, optional):
+                Number of frames that are transformed at once. Default is 32.
+            n_threads (int, optional):
+                Number of threads for the FFTs. None or negative values use all CPUs. Default is None.
+            spectra_cache (FileCache, optional):
+                If provided, the Fourier transforms of the padded image frames are stored to this cache as
+                memory-mapped complex64 arrays, and restored from it in subsequent calls of coadd_fft(), for instance
+                by the FourierObject instances of later holography iterations, in which only the PSFs change. Default
+                is None.
+            psf_extractor (PSFExtractor, optional):
+                If provided, the PSFs are extracted from the chunks of image frames while co-adding, instead of being
+                read from the psf_files. Every cube is then read only once. With time_binning, the PSFs are extracted
+                from the binned frames. The 'weighted_mean' mode is not supported with time_binning or frame_shifts.
+                Default is None.
+            n_jobs (int, optional):
+                Number of worker processes, which accumulate partial enumerators and denominators of subsets of the
+                frames. The FFT threads are then divided among the workers. None or negative values use all CPUs.
+                Default is 1.
+            task_size (int, optional):
+                Number of frames per task of the workers. Files are split into tasks of this size, such that single
+                large cubes can be distributed as well. Defaults to whole files per task.
         """
 
         # Assert that there are the same number of inFiles and psfFiles, which should be the case after running the
         # holography function.
-        if not len(in_files) == len(psf_files):
+        if psf_files is None and psf_extractor is None:
+            raise SpecklepyValueError('FourierObject', argname='psf_files', argvalue=psf_files,
+                                      expected='provided if no psf_extractor is provided')
+        if psf_files is not None and not len(in_files) == len(psf_files):
             raise ValueError(f"The number of input files ({len(in_files)}) and PSF files ({len(psf_files)}) do not "
                              f"match!")
         self.in_files = in_files
         self.psf_files = psf_files
         self.shifts = shifts
+        if frame_shifts is not None and len(frame_shifts) != len(in_files):
+            raise SpecklepyValueError('FourierObject', argname='len(frame_shifts)', argvalue=len(frame_shifts),
+                                      expected=f"{len(in_files)} (number of input files)")
+        self.frame_shifts = frame_shifts
+        self.time_binning = check_time_binning(time_binning, 'FourierObject')
+        self.roi = roi
+        if not isinstance(chunk_size, int) or chunk_size < 1:
+            raise SpecklepyValueError('FourierObject', argname='chunk_size', argvalue=chunk_size,
+                                      expected='positive int')
+        self.chunk_size = chunk_size
+        self.n_threads = get_n_jobs(n_threads)
+        self.spectra_cache = spectra_cache
+        # The weights of the 'weighted_mean' mode derive from the variances of the raw frames, which do not match
+        # binned or shifted frames
+        weighted = psf_extractor is not None and psf_extractor.mode == 'weighted_mean'
+        if weighted and (self.time_binning > 1 or frame_shifts is not None):
+            raise SpecklepyValueError('FourierObject', argname='psf_extractor.mode', argvalue=psf_extractor.mode,
+                                      expected="'mean' or 'median' with time_binning or frame_shifts")
+        self.psf_extractor = psf_extractor
+        self.n_jobs = get_n_jobs(n_jobs)
+        if task_size is not None and (not isinstance(task_size, int) or task_size < 1):
+            raise SpecklepyValueError('FourierObject', argname='task_size', argvalue=task_size,
+                                      expected='positive int or None')
+        self.task_size = task_size
 
         # Check whether mode is supported
         if mode not in ['same', 'full', 'valid']:
@@ -65,19 +130,23 @@ class FourierObject(object):
         file_index = 0
         image_pad_vector = self.pad_vectors[file_index]
 
-        # Get example image frame, used as final image size
+        # Get example image frame from the header, used as final image size
         image_file = in_files[file_index]
         logger.info(f"\tUsing example image frame from {image_file}")
-        img = fits.getdata(os.path.join(self.in_dir, image_file))[0]  # Remove time axis padding
+        frame_shape = CubeInfo(image_file, in_dir=self.in_dir).frame_shape
+        img = np.zeros(self.roi.get_shape(frame_shape) if self.roi is not None else frame_shape)
         img = pad_array(array=img, pad_vector=image_pad_vector, mode=mode,
                         reference_image_pad_vector=self.reference_image_pad_vector)
         logger.info(f"\tShift: {shifts[file_index]}")
         logger.info(f"\tShape: {img.shape}")
 
-        # Get example PSF frame
-        psf_file = psf_files[file_index]
-        logger.info(f"\tUsing example PSF frame from {psf_file}")
-        psf = fits.getdata(psf_file)[0]
+        # Get example PSF frame from the header or the extractor
+        if psf_extractor is not None:
+            psf = np.zeros(psf_extractor.frame_shape)
+        else:
+            psf_file = psf_files[file_index]
+            logger.info(f"\tUsing example PSF frame from {psf_file}")
+            psf = np.zeros(CubeInfo(psf_file).frame_shape)
         logger.info(f"\tShape: {psf.shape}")
 
         # Estimate the padding vector for the f_psf frames to have the same xy-extent as f_img
@@ -92,52 +161,231 @@ class FourierObject(object):
             raise ValueError(f"The Fourier transformed images and PSFs have different shape, {img.shape} and "
                              f"{psf.shape}. Something went wrong with the padding!")
         self.psf_pad_vector = psf_pad_vector
+        self.shape = img.shape
+
+        # The enumerator and denominator cover the half-plane of the real-valued FFT. The denominator is the sum of the
+        # PSF power spectra and thus real-valued. Both are allocated only when co-adding, such that copies of the
+        # instance for worker processes remain small
+        self.f_shape = self.shape[:-1] + (self.shape[-1] // 2 + 1,)
+        self.enumerator = None
+        self.denominator = None
+        self.fourier_image = None
+
+    def get_offset(self, file_index):
+        """Position of the origin of the frames of a file within the padded image, as arranged by pad_array()."""
+        pad_vector = self.pad_vectors[file_index]
+        if self.mode == 'full':
+            return np.array([lower for lower, _ in pad_vector])
+        elif self.mode == 'same':
+            return np.array([lower - reference_lower for (lower, _), (reference_lower, _) in
+                             zip(pad_vector, self.reference_image_pad_vector)])
+        else:
+            return np.array([-upper for _, upper in pad_vector])
+
+    def get_spectra_key(self, file_index):
+        """Key of the image spectra of a file in the spectra cache, which depends on all parameters of the padding."""
+        frame_shifts = self.frame_shifts[file_index] if self.frame_shifts is not None else None
+        if frame_shifts is not None:
+            frame_shifts = hashlib.sha256(np.ascontiguousarray(frame_shifts, dtype=float).tobytes()).hexdigest()
+        return self.spectra_cache.get_key(files=[os.path.join(self.in_dir, self.in_files[file_index])],
+                                          product='spectra', shape=self.shape, offset=self.get_offset(file_index),
+                                          time_binning=self.time_binning, roi=self.roi, frame_shifts=frame_shifts)
+
+    def shift_frames(self, file_index, start, frames):
+        """Shift a chunk of frames of a file by their frame_shifts, if provided."""
+        if self.frame_shifts is None:
+            return frames
+        shifted = np.zeros(frames.shape, dtype=np.float32)
+        for index, shift in enumerate(self.frame_shifts[file_index][start: start + len(frames)]):
+            add_shifted(shifted[index], frames[index], offset=shift)
+        return shifted
+
+    def iter_image_spectra(self, file_index, start=0, stop=None, spectra=None, n_threads=None):
+        """Iterate over the Fourier transforms of the padded image frames of a file in chunks.
+
+        The transforms are restored from the spectra cache, if available. Otherwise, the frames are shifted, placed
+        into a zero-padded buffer and transformed.
 
-        # Initialize the enumerator, denominator and Fourier object attributes
-        self.enumerator = np.zeros(img.shape, dtype='complex128')
-        self.denominator = np.zeros(img.shape, dtype='complex128')
-        self.fourier_image = np.zeros(img.shape, dtype='complex128')
+        Args:
+            file_index (int):
+                Index of the file in the in_files attribute.
+            start (int, optional):
+                Index of the first frame. Default is 0.
+            stop (int, optional):
+                Index after the last frame. Defaults to the number of frames of the file.
+            spectra (np.ndarray, optional):
+                Array of shape (n_frames,) + f_shape, into which the computed transforms are written, for instance a
+                memory-mapped array of the spectra cache. Default is None.
+            n_threads (int, optional):
+                Number of threads for the FFTs. Defaults to the n_threads attribute.
+
+        Yields:
+            start (int):
+                Index of the first frame in the chunk.
+            frames (np.ndarray or None):
+                Frames of the chunk, after shifting them by the frame_shifts, or None if the transforms have been
+                restored from the cache.
+            f_img (np.ndarray, dtype=np.complex64):
+                Fourier transforms of the frames of the chunk, on the half-plane of the real-valued FFT.
+        """
+        if n_threads is None:
+            n_threads = self.n_threads
+
+        # Restore the spectra from the cache
+        if self.spectra_cache is not None:
+            cached = self.spectra_cache.load_memmap(self.get_spectra_key(file_index))
+            if cached is not None:
+                stop = len(cached) if stop is None else stop
+                for index in range(start, stop, self.chunk_size):
+                    yield index, None, np.array(cached[index: min(index + self.chunk_size, stop)])
+                return
+
+        offset = self.get_offset(file_index)
+        img_buffer = np.zeros((self.chunk_size,) + self.shape, dtype=np.float32)
+        with CubeReader(self.in_files[file_index], in_dir=self.in_dir, time_binning=self.time_binning,
+                        roi=self.roi) as image_cube:
+            stop = len(image_cube) if stop is None else stop
+            for index in range(start, stop, self.chunk_size):
+                chunk = image_cube[index: min(index + self.chunk_size, stop)]
+                n = len(chunk)
+
+                # Shift the frames within the cube, then place them into the padded field
+                chunk = self.shift_frames(file_index, index, chunk)
+                img_buffer[:n] = 0
+                add_shifted(img_buffer[:n], chunk, offset=offset)
+
+                f_img = fft.rfft2(img_buffer[:n], workers=n_threads)
+                if spectra is not None:
+                    spectra[index: index + n] = f_img
+                yield index, chunk, f_img
+
+    def accumulate(self, file_index, start=0, stop=None, fill_spectra=False, n_threads=None):
+        """Accumulate the enumerator and denominator of a range of frames of a file.
 
-    def coadd_fft(self):
-        """Co-add the Fourier transforms of the image and PSF frames.
+        Args:
+            file_index (int):
+                Index of the file in the in_files attribute.
+            start (int, optional):
+                Index of the first frame. Default is 0.
+            stop (int, optional):
+                Index after the last frame. Defaults to the number of frames of the file.
+            fill_spectra (bool, optional):
+                Write the image transforms into the entry of the file in the spectra cache, which has been created by
+                coadd_fft() before. Default is False.
+            n_threads (int, optional):
+                Number of threads for the FFTs. Defaults to the n_threads attribute.
 
         Returns:
-            fourier_image (np.ndarray, dtype=np.comlex128):
-                Fourier-transformed object reconstruction.
+            enumerator (np.ndarray, dtype=np.complex128):
+                Sum of the products of the image transforms with the conjugated PSF transforms.
+            denominator (np.ndarray, dtype=np.float64):
+                Sum of the PSF power spectra.
         """
+        if n_threads is None:
+            n_threads = self.n_threads
+        enumerator = np.zeros(self.f_shape, dtype=np.complex128)
+        denominator = np.zeros(self.f_shape, dtype=np.float64)
+
+        # The PSFs are placed at the same position within their buffer for all frames, such that the padding remains
+        # zero across chunks
+        psf_buffer = np.zeros((self.chunk_size,) + self.shape, dtype=np.float32)
+        psf_slices = tuple(slice(lower, extent - upper) for (lower, upper), extent in zip(self.psf_pad_vector,
+                                                                                          self.shape))
+        origin = self.roi.offset if self.roi is not None else None
+        spectra = self.spectra_cache.open_memmap(self.get_spectra_key(file_index)) if fill_spectra else None
+
+        # Open the PSF cube, or the image cube for extracting the PSFs, in case its transforms are restored from the
+        # cache and the frames are not read otherwise
+        if self.psf_extractor is None:
+            cube = CubeReader(self.psf_files[file_index], time_binning=self.time_binning)
+        else:
+            cube = CubeReader(self.in_files[file_index], in_dir=self.in_dir, time_binning=self.time_binning,
+                              roi=self.roi)
+
+        with cube:
+            for index, frames, f_img in self.iter_image_spectra(file_index, start=start, stop=stop, spectra=spectra,
+                                                                n_threads=n_threads):
+                n = len(f_img)
+
+                # Read the PSFs, or extract them from the frames
+                if self.psf_extractor is None:
+                    if index + n > len(cube):
+                        raise ValueError(f"The PSF file {self.psf_files[file_index]} contains fewer frames "
+                                         f"({len(cube)}) than the image file {self.in_files[file_index]}!")
+                    psfs = cube[index: index + n]
+                else:
+                    if frames is None:
+                        frames = self.shift_frames(file_index, index, cube[index: index + n])
+                    psfs = self.psf_extractor(file_index, frames, start=index, n_frames=len(cube), origin=origin)
+
+                # Transform the PSFs and accumulate the enumerator and denominator
+                psf_buffer[(slice(None, n),) + psf_slices] = psfs
+                f_psf = fft.rfft2(psf_buffer[:n], workers=n_threads)
+                denominator += np.sum(np.square(np.abs(f_psf)), axis=0, dtype=np.float64)
+                enumerator += np.sum(np.multiply(f_img, np.conjugate(f_psf, out=f_psf), out=f_img), axis=0,
+                                     dtype=np.complex128)
+
+        if spectra is not None:
+            spectra.flush()
+        return enumerator, denominator
 
-        # Padding and Fourier transforming the images
-        logger.info("Padding the images and PSFs...")
-
-        for file_index in trange(len(self.in_files), desc="Processing files"):
-
-            # Open PSF and image files
-            psf_cube = fits.getdata(self.psf_files[file_index])
-            image_cube = fits.getdata(os.path.join(self.in_dir, self.in_files[file_index]))
-            n_frames = image_cube.shape[0]
-
-            for frame_index in trange(n_frames, desc="Fourier transforming frames"):
+    def coadd_fft(self):
+        """Co-add the Fourier transforms of the image and PSF frames.
 
-                # Padding and transforming the image
-                img = pad_array(array=image_cube[frame_index],
-                                pad_vector=self.pad_vectors[file_index],
-                                mode=self.mode,
-                                reference_image_pad_vector=self.reference_image_pad_vector)
-                f_img = fftshift(fft2(img))
+        Chunks of image and PSF frames are placed into zero-padded buffers of the image shape and transformed at once.
+        The products with the conjugated PSF transforms and the PSF power spectra are summed into the enumerator and
+        denominator, which are divided in place in the end. With a spectra cache, only the PSFs need to be transformed
+        when the image spectra have been cached before, for instance in a previous holography iteration. With a PSF
+        extractor, the PSFs are extracted from the same chunks of frames, such that every cube is read only once.
 
-                # Padding and Fourier transforming PSF
-                psf = psf_cube[frame_index]
-                psf = np.pad(psf, self.psf_pad_vector, mode='constant',)
-                f_psf = fftshift(fft2(psf))
+        The frames are split into tasks of whole files or of task_size frames, which are accumulated by n_jobs worker
+        processes. The partial sums are added in the order of the tasks, such that the result does not depend on the
+        number of workers.
 
-                # Co-adding for the average
-                self.enumerator += np.multiply(f_img, np.conjugate(f_psf))
-                self.denominator += np.abs(np.square(f_psf))
+        Returns:
+            fourier_image (np.ndarray, dtype=np.complex128):
+                Fourier-transformed object reconstruction, on the half-plane of the real-valued FFT.
+        """
 
-        # Compute the object:
-        # Note that by this division implicitly does averaging. By this implicit summing up of enumerator and
-        # denominator, this computation is cheaper in terms of memory usage
-        self.fourier_image = np.divide(self.enumerator, self.denominator)
+        logger.info("Padding and Fourier transforming the images and PSFs...")
+        self.enumerator, self.denominator, self.fourier_image = None, None, None
+
+        # Prepare the spectra cache entries and PSF files, which the tasks fill in parallel, and split the files into
+        # tasks. PSF files are written by a single task per file
+        save_psfs = self.psf_extractor is not None and self.psf_extractor.save_dir is not None
+        spectra_keys = []
+        tasks = []
+        for file_index in range(len(self.in_files)):
+            n_frames = -(-CubeInfo(self.in_files[file_index], in_dir=self.in_dir).n_frames // self.time_binning)
+
+            fill_spectra = False
+            if self.spectra_cache is not None:
+                key = self.get_spectra_key(file_index)
+                if key not in self.spectra_cache:
+                    self.spectra_cache.create_memmap(key, shape=(n_frames,) + self.f_shape, dtype=np.complex64)
+                    spectra_keys.append(key)
+                    fill_spectra = True
+            if save_psfs:
+                self.psf_extractor.create_psf_file(file_index, n_frames=n_frames)
+
+            task_size = self.task_size if self.task_size is not None and not save_psfs else max(n_frames, 1)
+            for start in range(0, n_frames, task_size):
+                tasks.append((file_index, start, min(start + task_size, n_frames), fill_spectra))
+
+        # Accumulate the tasks, dividing the FFT threads among the workers
+        n_jobs = min(self.n_jobs, max(len(tasks), 1))
+        accumulate = partial(_accumulate_task, fourier_object=self, n_threads=max(self.n_threads // n_jobs, 1))
+        self.enumerator, self.denominator = parallel_reduce(accumulate, tasks, reduce=_add_accumulators, n_jobs=n_jobs)
+
+        # Mark the spectra as complete only after all frames have been transformed
+        for key in spectra_keys:
+            self.spectra_cache.complete(key, evict=False)
+        if spectra_keys:
+            self.spectra_cache.evict(keep=spectra_keys)
+
+        # Compute the object: Note that this division implicitly does averaging. By this implicit summing up of
+        # enumerator and denominator, this computation is cheaper in terms of memory usage
+        self.fourier_image = np.divide(self.enumerator, self.denominator, out=self.enumerator)
 
         return self.fourier_image
 
@@ -159,7 +407,7 @@ class FourierObject(object):
         """
 
         # Assert image shape
-        if self.fourier_image.shape[0] != self.fourier_image.shape[1]:
+        if self.shape[0] != self.shape[1]:
             logger.warning("The apodization is applied to a non-quadratic input image. This may cause some "
                            "unpredictable results!")
 
@@ -170,7 +418,7 @@ class FourierObject(object):
 
         # Interpret function input and compute apodization PSF
         psf_model = PSFModel(type=type, radius=radius)
-        apodization_psf = psf_model(self.fourier_image.shape)
+        apodization_psf = psf_model(self.shape)
 
         # Crop corners of the PSF
         if crop:
@@ -181,8 +429,8 @@ class FourierObject(object):
         # Normalize to unity
         apodization_psf /= np.sum(apodization_psf)
 
-        # Transform into Fourier space
-        apodization_otf = otf(apodization_psf)
+        # Transform into Fourier space, on the same half-plane as the Fourier object
+        apodization_otf = fft.rfft2(apodization_psf, workers=self.n_threads)
         self.fourier_image = np.multiply(self.fourier_image, apodization_otf)
 
         return self.fourier_image
@@ -199,9 +447,24 @@ class FourierObject(object):
                 Image-plane image.
         """
         logger.info("Inverse Fourier transformation of the object...")
-        image = ifft2(self.fourier_image)
+        image = fft.irfft2(self.fourier_image, s=self.shape, workers=self.n_threads)
         image = np.abs(image)
         if total_flux is not None:
             image_scale = total_flux / np.sum(image)
             image = np.multiply(image, image_scale)
         return image
+
+
+def _accumulate_task(task, fourier_object, n_threads):
+    """Accumulate a task of coadd_fft(), given as a tuple of the file index, the frame range and the fill_spectra flag.
+    This is defined at module level to be picklable for worker processes."""
+    file_index, start, stop, fill_spectra = task
+    return fourier_object.accumulate(file_index, start=start, stop=stop, fill_spectra=fill_spectra,
+                                     n_threads=n_threads)
+
+
+def _add_accumulators(accumulators, other):
+    """Add the enumerator and denominator of a task in place."""
+    for accumulator, summand in zip(accumulators, other):
+        accumulator += summand
+    return accumulators
@@ -0,0 +1,108 @@
+import numpy as np
+
+from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
+from specklepy.io.cubereader import iter_chunks
+from specklepy.logging import logger
+
+
+class FrameSelection(object):
+
+    """Lucky-imaging selection of the best frames of a cube.
+
+    The frames are scored by a cheap quality metric, evaluated within a Box, and only the best fraction of frames is
+    selected. The metrics are computed for whole chunks of frames at once:
+    - `peak`: Intensity of the emission peak.
+    - `peak_flux_ratio`: Intensity of the emission peak relative to the total flux, serving as a Strehl ratio proxy.
+    - `sharpness`: Sum of squared intensities relative to the squared total flux.
+    """
+
+    supported_methods = ['peak', 'peak_flux_ratio', 'sharpness']
+
+    def __init__(self, method='peak_flux_ratio', fraction=1.0, box=None):
+        """Create a FrameSelection instance.
+
+        Args:
+            method (str, optional):
+                Name of the quality metric, see class doc string for the options. Default is 'peak_flux_ratio'.
+            fraction (float, optional):
+                Fraction of frames to select, in the interval (0, 1]. Default is 1.0.
+            box (Box object, optional):
+                Constraining the evaluation of the metric to the specified box. Evaluating the full frames if not
+                provided.
+        """
+
+        # Check input parameters
+        if not isinstance(method, str):
+            raise SpecklepyTypeError('FrameSelection', argname='method', argtype=type(method), expected='str')
+        if method not in self.supported_methods:
+            raise SpecklepyValueError('FrameSelection', argname='method', argvalue=method,
+                                      expected=f"in {self.supported_methods}")
+        if not isinstance(fraction, (int, float)):
+            raise SpecklepyTypeError('FrameSelection', argname='fraction', argtype=type(fraction), expected='float')
+        if fraction <= 0 or fraction > 1:
+            raise SpecklepyValueError('FrameSelection', argname='fraction', argvalue=fraction,
+                                      expected='in the interval (0, 1]')
+
+        # Store attributes
+        self.method = method
+        self.fraction = float(fraction)
+        self.box = box
+
+    def __call__(self, cube, chunk_size=None):
+        """Select the best frames of a cube.
+
+        Args:
+            cube (np.ndarray or CubeReader, ndim=3):
+                Data cube with the time axis along the zero-th axis.
+            chunk_size (int, optional):
+                Number of frames that are scored at once.
+
+        Returns:
+            frame_indizes (np.ndarray, dtype=int):
+                Indizes of the selected frames in ascending order.
+        """
+        scores = self.get_scores(cube, chunk_size=chunk_size)
+        n_selected = self.get_n_selected(len(scores))
+        frame_indizes = np.sort(np.argsort(-scores, kind='stable')[:n_selected])
+        logger.info(f"Selected {n_selected} of {len(scores)} frames by {self.method!r} scores")
+        return frame_indizes
+
+    @property
+    def cards(self):
+        """Header cards describing the selection."""
+        cards = {'SELECTION METHOD': self.method, 'SELECTION FRACTION': self.fraction}
+        if self.box is not None:
+            cards['SELECTION BOX'] = str(self.box)
+        return cards
+
+    def get_n_selected(self, n_frames):
+        """Number of frames selected from a cube of n_frames frames."""
+        return max(int(np.ceil(self.fraction * n_frames)), 1)
+
+    def get_scores(self, cube, chunk_size=None):
+        """Compute the quality scores of all frames in a cube.
+
+        Args:
+            cube (np.ndarray or CubeReader, ndim=3):
+                Data cube with the time axis along the zero-th axis.
+            chunk_size (int, optional):
+                Number of frames that are scored at once.
+
+        Returns:
+            scores (np.ndarray):
+                Array of scores, with higher values for better frames.
+        """
+        scores = np.zeros(len(cube))
+        for start, chunk in iter_chunks(cube, chunk_size=chunk_size):
+            if self.box is not None:
+                chunk = self.box(chunk)
+            chunk = chunk.reshape((chunk.shape[0], -1))
+            if self.method == 'peak':
+                chunk_scores = np.max(chunk, axis=1)
+            elif self.method == 'peak_flux_ratio':
+                chunk_scores = np.max(chunk, axis=1) / np.sum(chunk, axis=1)
+            else:
+                chunk = chunk.astype(float)
+                chunk_scores = np.sum(np.square(chunk), axis=1) / np.square(np.sum(chunk, axis=1))
+            scores[start: start + len(chunk_scores)] = chunk_scores
+        return scores
@@ -0,0 +1,134 @@
+import numpy as np
+
+from scipy import fft
+
+from specklepy.core.alignment import add_shifted, get_correlation_shifts
+from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
+from specklepy.io.cubereader import iter_chunks
+from specklepy.logging import logger
+from specklepy.utils.parallel import get_n_jobs
+
+
+class FrameTracker(object):
+
+    """Tracking of the drift of the frames within a cube by their correlation with a running reference.
+
+    Frames drift within a cube due to telescope tracking errors. The emission peaks used by the SSA algorithm follow
+    this drift, but may jump between bright sources of similar intensity. The tracker instead correlates every frame
+    with a reference image. Chunks of frames are Fourier transformed at once along their last two axes and correlated
+    with the transformed reference. The reference starts from the mean of the first chunk and is replaced by the sum
+    of the aligned frames, which grows with every chunk such that the signal-to-noise ratio of the reference improves
+    while tracking the cube.
+    """
+
+    def __init__(self, box=None, chunk_size=64, n_threads=None, upsample_factor=None):
+        """Create a FrameTracker instance.
+
+        Args:
+            box (Box object, optional):
+                Constraining the correlation to the specified box. Correlating the full frames if not provided.
+            chunk_size (int, optional):
+                Number of frames that are transformed at once, if not provided by the call. Default is 64.
+            n_threads (int, optional):
+                Number of threads for the FFTs. None or negative values use all CPUs. Default is None.
+            upsample_factor (int, optional):
+                If provided, the shifts are refined to a precision of 1/upsample_factor pixels, see
+                specklepy.core.alignment.refine_shift(). Default is None, which returns integer shifts.
+        """
+
+        # Check input parameters
+        if not isinstance(chunk_size, int) or chunk_size < 1:
+            raise SpecklepyValueError('FrameTracker', argname='chunk_size', argvalue=chunk_size,
+                                      expected='positive int')
+        if upsample_factor is not None and (not isinstance(upsample_factor, int) or upsample_factor < 1):
+            raise SpecklepyValueError('FrameTracker', argname='upsample_factor', argvalue=upsample_factor,
+                                      expected='positive int')
+
+        # Store attributes
+        self.box = box
+        self.chunk_size = chunk_size
+        self.n_threads = get_n_jobs(n_threads)
+        self.upsample_factor = upsample_factor
+
+    def __call__(self, cube, chunk_size=None, frame_indizes=None, reference_image=None):
+        """Estimate the shifts of the frames of a cube.
+
+        Args:
+            cube (np.ndarray or CubeReader, ndim=3):
+                Data cube with the time axis along the zero-th axis.
+            chunk_size (int, optional):
+                Number of frames that are transformed at once. Defaults to the chunk_size attribute.
+            frame_indizes (array_like, optional):
+                Indizes of the frames to track. All frames are tracked if not provided.
+            reference_image (np.ndarray, ndim=2, optional):
+                Initial reference image. The shifts are then relative to this image. Otherwise the reference starts
+                from the mean of the first chunk and the shifts are centered on their mean.
+
+        Returns:
+            shifts (np.ndarray):
+                Array of shape (n_frames, 2) with the shift of every frame, which is zero for frames that are not
+                tracked. The shifts are integers if the upsample_factor attribute is None.
+        """
+
+        if cube.ndim != 3:
+            raise SpecklepyValueError('FrameTracker', argname='cube.ndim', argvalue=cube.ndim, expected='3')
+        if reference_image is not None and not isinstance(reference_image, np.ndarray):
+            raise SpecklepyTypeError('FrameTracker', argname='reference_image', argtype=type(reference_image),
+                                     expected='np.ndarray')
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        if frame_indizes is None:
+            selected = np.ones(len(cube), dtype=bool)
+        else:
+            selected = np.zeros(len(cube), dtype=bool)
+            selected[frame_indizes] = True
+
+        if reference_image is not None:
+            reference = np.array(self.box(reference_image) if self.box is not None else reference_image, dtype=float)
+        else:
+            reference = None
+
+        shifts = np.zeros((len(cube), 2))
+        for start, chunk in iter_chunks(cube, chunk_size=chunk_size):
+            indizes = np.flatnonzero(selected[start: start + len(chunk)])
+            if len(indizes) == 0:
+                continue
+            frames = chunk[indizes]
+            if self.box is not None:
+                frames = self.box(frames)
+            frames = np.asarray(frames, dtype=np.float32)
+
+            # Start from the mean of the first chunk, which is replaced by the aligned frames below
+            initial = reference is None
+            if initial:
+                reference = np.mean(frames, axis=0, dtype=float)
+
+            # Correlate the chunk with the running reference in single precision
+            f_reference = fft.rfft2(reference.astype(np.float32), workers=self.n_threads)
+            chunk_shifts = get_correlation_shifts(frames, f_reference, n_threads=self.n_threads,
+                                                  upsample_factor=self.upsample_factor)
+            shifts[start + indizes] = chunk_shifts
+
+            # Update the reference with the aligned frames
+            if initial:
+                reference[:] = 0
+            for frame, shift in zip(frames, chunk_shifts):
+                add_shifted(reference, frame, offset=shift)
+
+        if reference_image is None and np.any(selected):
+            shifts[selected] -= np.round(np.mean(shifts[selected], axis=0))
+        logger.debug(f"Tracked {np.sum(selected)} frames with shifts in the range {np.min(shifts, axis=0)} to "
+                     f"{np.max(shifts, axis=0)}")
+
+        if self.upsample_factor is None:
+            return shifts.astype(int)
+        return shifts
+
+    @property
+    def cards(self):
+        """Header cards describing the tracking."""
+        cards = {'FRAME TRACKING': 'correlation'}
+        if self.box is not None:
+            cards['TRACKING BOX'] = str(self.box)
+        return cards
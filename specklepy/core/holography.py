@@ -1,17 +1,20 @@
 import numpy as np
+import os
 
 from astropy.io import fits
 
-from specklepy.core.aperture import Aperture
 from specklepy.core.fourierobject import FourierObject
-from specklepy.core.psfextraction import ReferenceStars
+from specklepy.core.psfextraction import PSFExtractor, ReferenceStars, threshold_psfs
 from specklepy.core.reconstruction import Reconstruction
 from specklepy.core.sourceextraction import extract_sources
+from specklepy.io.cache import FileCache
+from specklepy.io.cubereader import CubeInfo
 from specklepy.io.filearchive import FileArchive
 from specklepy.io.reconstructionfile import ReconstructionFile
 from specklepy.exceptions import SpecklepyValueError
 from specklepy.logging import logger
 from specklepy.plotting.plots import imshow
+from specklepy.utils.roi import ROI
 
 
 def holography(params, mode='same', debug=False):
@@ -60,22 +63,62 @@ def holography(params, mode='same', debug=False):
     if params['APODIZATION']['radius'] is None or not isinstance(params['APODIZATION']['radius'], (int, float)):
         logger.error(f"Apodization radius has not been set or of wrong type ({params['APODIZATION']['radius']})")
 
+    # Initialize the cache for intermediate products
+    if params['OPTIONS'].get('cache', False):
+        cache = FileCache(os.path.join(tmp_dir, 'cache'), max_size=params['OPTIONS'].get('cacheSize'))
+    else:
+        cache = None
+
+    # The image-frame spectra do not change between the iterations, in which only the PSFs are updated
+    if not params['OPTIONS'].get('cacheSpectra', False):
+        spectra_cache = None
+    elif cache is not None:
+        spectra_cache = cache
+    else:
+        logger.info("Caching the image-frame spectra in a separate cache, since the general cache is disabled")
+        spectra_cache = FileCache(os.path.join(tmp_dir, 'spectra'), max_size=params['OPTIONS'].get('cacheSize'))
+
+    # Initialize the region of interest, to which all stages are restricted
+    if params['OPTIONS'].get('roi') is not None:
+        roi = ROI(params['OPTIONS']['roi'])
+    elif params['OPTIONS'].get('roiSourceFile') is not None:
+        margin = params['OPTIONS'].get('roiMargin')
+        roi = ROI.from_sources(params['OPTIONS']['roiSourceFile'],
+                               margin=margin if margin is not None else params['PSFEXTRACTION']['psfRadius'],
+                               frame_shape=CubeInfo(in_files[0], in_dir=in_dir).frame_shape)
+    else:
+        roi = None
+
     # Initialize the outfile
-    out_file = ReconstructionFile(filename=params['PATHS']['outFile'], files=in_files,
-                                  cards={"RECONSTRUCTION": "Holography"}, in_dir=in_dir)
+    cards = {"RECONSTRUCTION": "Holography"}
+    if roi is not None:
+        cards.update(roi.cards)
+    out_file = ReconstructionFile(filename=params['PATHS']['outFile'], files=in_files, cards=cards, in_dir=in_dir)
 
     # Initialize reconstruction
     reconstruction = Reconstruction(in_files=in_files, mode=mode, alignment_method='ssa',
                                     reference_image=params['PATHS']['alignmentReferenceFile'],
                                     in_dir=in_dir, tmp_dir=tmp_dir, out_file=params['PATHS']['outFile'],
                                     var_ext=params['OPTIONS']['varianceExtensionName'],
-                                    box_indexes=params['OPTIONS']['box_indexes'], debug=debug)
+                                    box_indexes=params['OPTIONS']['box_indexes'], cache=cache,
+                                    time_binning=params['OPTIONS'].get('timeBinning'), roi=roi, debug=debug)
 
     # (i-ii) Align cubes
     # shifts = get_shifts(files=in_files, reference_file=params['PATHS']['alignmentReferenceFile'],
     #                     lazy_mode=True, return_image_shape=False, in_dir=in_dir, debug=debug)
     shifts = reconstruction.shifts
 
+    # Reference star positions are measured in the reconstructed image, which starts at the largest shift in 'valid'
+    # mode, such that the PSF apertures are placed relative to that origin
+    if mode == 'valid':
+        psf_shifts = np.array(shifts) - np.max(shifts, axis=0)
+    else:
+        psf_shifts = shifts
+
+    # The PSFs are extracted from the full frames, such that the apertures are mapped back to detector coordinates
+    if roi is not None:
+        psf_shifts = np.array(psf_shifts) - np.array(roi.offset)
+
     # (iii) Compute SSA reconstruction
     # image = ssa(in_files, mode=mode, outfile=out_file, in_dir=in_dir, tmp_dir=tmp_dir,
     #             variance_extension_name=params['OPTIONS']['varianceExtensionName'])
@@ -99,48 +142,36 @@ def holography(params, mode='same', debug=False):
         print("\tPlease copy your desired reference stars from the all stars file into the reference star file!")
         input("\tWhen you are done, hit a ENTER.")
 
-        # (vi) PSF extraction
-        ref_stars = ReferenceStars(psf_radius=params['PSFEXTRACTION']['psfRadius'],
-                                   reference_source_file=params['PATHS']['refSourceFile'], in_files=in_files,
-                                   save_dir=tmp_dir, in_dir=in_dir,
-                                   field_segmentation=params['PSFEXTRACTION']['fieldSegmentation'])
-        if params['PSFEXTRACTION']['mode'].lower() == 'epsf':
-            psf_files = ref_stars.extract_epsfs(file_shifts=shifts, debug=debug)
-        elif params['PSFEXTRACTION']['mode'].lower() in ['mean', 'median', 'weighted_mean']:
-            psf_files = ref_stars.extract_psfs(file_shifts=shifts, mode=params['PSFEXTRACTION']['mode'].lower(),
-                                               debug=debug)
+        # (vi-vii) In streaming mode, the PSFs are extracted and noise-thresholded while co-adding the Fourier
+        # transforms in step (ix), such that every cube is read only once per iteration
+        if params['PSFEXTRACTION'].get('streaming', False):
+            if params['PSFEXTRACTION']['mode'].lower() not in ['mean', 'median', 'weighted_mean']:
+                raise RuntimeError(f"PSF extraction mode '{params['PSFEXTRACTION']['mode']}' is not supported in "
+                                   f"streaming mode!")
+            ref_stars = ReferenceStars(psf_radius=params['PSFEXTRACTION']['psfRadius'],
+                                       reference_source_file=params['PATHS']['refSourceFile'], in_files=in_files,
+                                       save_dir=tmp_dir, in_dir=in_dir,
+                                       field_segmentation=params['PSFEXTRACTION']['fieldSegmentation'])
+            psf_extractor = PSFExtractor(ref_stars, file_shifts=psf_shifts,
+                                         mode=params['PSFEXTRACTION']['mode'].lower(),
+                                         noise_threshold=params['PSFEXTRACTION']['noiseThreshold'],
+                                         noise_reference_margin=params['PSFEXTRACTION']['noiseReferenceMargin'],
+                                         save_dir=tmp_dir if params['PSFEXTRACTION'].get('savePSFs', False) else None)
+            psf_files = None
         else:
-            raise RuntimeError(f"PSF extraction mode '{params['PSFEXTRACTION']['mode']}' is not understood!")
-        logger.info("Saved the extracted PSFs...")
-
-        # (vii) Noise thresholding
-        psf_noise_mask = None
-        for file in psf_files:
-            with fits.open(file, mode='update') as hdu_list:
-                n_frames = hdu_list[0].header['NAXIS3']
-                if psf_noise_mask is None:
-                    psf_noise_mask = get_noise_mask(hdu_list[0].data[0],
-                                                    noise_reference_margin=
-                                                    params['PSFEXTRACTION']['noiseReferenceMargin'])
-                for index in range(n_frames):
-                    reference = np.ma.masked_array(hdu_list[0].data[index], mask=psf_noise_mask)
-                    background = np.mean(reference)
-                    noise = np.std(reference)
-                    update = np.maximum(hdu_list[0].data[index] - background -
-                                        params['PSFEXTRACTION']['noiseThreshold'] * noise, 0.0)
-                    if np.sum(update) == 0.0:
-                        raise ValueError("After background subtraction and noise thresholding, no signal is leftover. "
-                                         "Please reduce the noiseThreshold!")
-                    update = update / np.sum(update)  # Flux sum of order unity
-                    hdu_list[0].data[index] = update
-                    hdu_list.flush()
+            psf_extractor = None
+            psf_files = extract_psf_files(params, in_files=in_files, in_dir=in_dir, tmp_dir=tmp_dir,
+                                          psf_shifts=psf_shifts, cache=cache, debug=debug)
 
         # (viii) Subtraction of secondary sources within the reference apertures
         # TODO: Implement Secondary source subtraction
         pass
 
         # (ix) Estimate object, following Eq. 1 (Schoedel et al., 2013)
-        f_object = FourierObject(in_files, psf_files, shifts=shifts, mode=mode, in_dir=in_dir)
+        f_object = FourierObject(in_files, psf_files, shifts=shifts, mode=mode, in_dir=in_dir,
+                                 time_binning=params['OPTIONS'].get('timeBinning'), roi=roi,
+                                 spectra_cache=spectra_cache, psf_extractor=psf_extractor,
+                                 n_jobs=params['OPTIONS'].get('nJobs', 1))
         f_object.coadd_fft()
 
         # (x) Apodization
@@ -170,22 +201,63 @@ def holography(params, mode='same', debug=False):
     return image
 
 
-def get_noise_mask(frame, noise_reference_margin):
-    """Create an annulus-like mask within a given aperture for measuring noise
-    and (sky) background.
+def extract_psf_files(params, in_files, in_dir, tmp_dir, psf_shifts, cache=None, debug=False):
+    """Extract the PSFs into PSF files and noise-threshold them, steps (vi) and (vii) of holography().
 
     Args:
-        frame (np.ndarray):
-            Image frame within which the mask is derived.
-        noise_reference_margin (int):
-            Width of the reference annulus in pixels.
+        params (dict):
+            Dictionary of the holography parameters.
+        in_files (list):
+            List of input files.
+        in_dir (str):
+            Path to the input files.
+        tmp_dir (str):
+            Directory where the PSF files are stored.
+        psf_shifts (list):
+            Shifts of the files, relative to which the reference star positions are measured.
+        cache (FileCache, optional):
+            If provided, the PSF files are restored from this cache if neither the files nor the reference stars
+            changed.
+        debug (bool, optional):
+            Show debugging information. Default is False.
 
     Returns:
-        annulus_mask (np.ndarray, dtype=bool):
-            Mask array, derived from the frame.
+        psf_files (list):
+            List of paths of the PSF files.
     """
-    center = int((frame.shape[0] - 1) / 2)
-    radius = center - noise_reference_margin
-    tmp = Aperture(center, center, radius, data=frame, crop=False)
-    annulus_mask = np.logical_not(tmp.data.mask)
-    return annulus_mask
+
+    # (vi) PSF extraction, or restoring the PSFs from the cache if neither the files nor the reference stars
+    # changed. The PSF files are modified by the noise thresholding below, such that the cache keeps the
+    # unmodified copies
+    if cache is not None:
+        psf_key = cache.get_key(files=[os.path.join(in_dir, file) for file in in_files] +
+                                [params['PATHS']['refSourceFile']], product='psfs', shifts=psf_shifts,
+                                **params['PSFEXTRACTION'])
+        psf_files = cache.restore_files(psf_key, out_dir=tmp_dir)
+    else:
+        psf_files = None
+    if psf_files is None:
+        ref_stars = ReferenceStars(psf_radius=params['PSFEXTRACTION']['psfRadius'],
+                                   reference_source_file=params['PATHS']['refSourceFile'], in_files=in_files,
+                                   save_dir=tmp_dir, in_dir=in_dir,
+                                   field_segmentation=params['PSFEXTRACTION']['fieldSegmentation'])
+        if params['PSFEXTRACTION']['mode'].lower() == 'epsf':
+            psf_files = ref_stars.extract_epsfs(file_shifts=psf_shifts, debug=debug)
+        elif params['PSFEXTRACTION']['mode'].lower() in ['mean', 'median', 'weighted_mean']:
+            psf_files = ref_stars.extract_psfs(file_shifts=psf_shifts, mode=params['PSFEXTRACTION']['mode'].lower(),
+                                               debug=debug)
+        else:
+            raise RuntimeError(f"PSF extraction mode '{params['PSFEXTRACTION']['mode']}' is not understood!")
+        logger.info("Saved the extracted PSFs...")
+        if cache is not None:
+            cache.store_files(psf_key, psf_files)
+
+    # (vii) Noise thresholding
+    for file in psf_files:
+        with fits.open(file, mode='update') as hdu_list:
+            hdu_list[0].data[:] = threshold_psfs(hdu_list[0].data,
+                                                 noise_threshold=params['PSFEXTRACTION']['noiseThreshold'],
+                                                 noise_reference_margin=params['PSFEXTRACTION']['noiseReferenceMargin'])
+            hdu_list.flush()
+
+    return psf_files
@@ -7,7 +7,9 @@ from astropy.io import fits
 
 from specklepy.core.aperture import Aperture
 from specklepy.core.segmentation import Segmentation
+from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
 from specklepy.logging import logger
+from specklepy.io.cubereader import CubeInfo
 from specklepy.io.psffile import PSFFile
 from specklepy.io.table import read_table
 from specklepy.utils.combine import weighted_mean
@@ -48,7 +50,7 @@ class ReferenceStars(object):
             self.in_dir = in_dir
 
         if field_segmentation:
-            example_image_shape = fits.getdata(self.in_files[0])[0].shape
+            example_image_shape = CubeInfo(self.in_files[0], in_dir=self.in_dir).frame_shape
             segmentation = Segmentation(*field_segmentation, image_shape=example_image_shape)
             star_positions = []
             for row in self.star_table:
@@ -75,6 +77,96 @@ class ReferenceStars(object):
                                       data=os.path.join(self.in_dir, filename), mask='rectangular', crop=True))
         return apertures
 
+    def get_aperture_positions(self, shift=None, origin=None):
+        """Positions of the reference stars within the frames of a file.
+
+        Args:
+            shift (tuple, optional):
+                Shift of the file with respect to the reference file, as in init_apertures().
+            origin (tuple, optional):
+                Position of the first pixel of the frames in the coordinates of the file, for instance the offset of
+                a region of interest.
+
+        Returns:
+            positions (np.ndarray):
+                Array of shape (n_stars, 2) with the positions along the zero-th and first frame axis.
+        """
+        if shift is None:
+            shift = (0, 0)
+        if origin is None:
+            origin = (0, 0)
+        return np.array([(star['y'] - shift[0] - origin[0], star['x'] - shift[1] - origin[1])
+                         for star in self.star_table], dtype=float)
+
+    def get_aperture_vars(self, filename, shift=None):
+        """Variances of the reference apertures along the time axis of a file, for the 'weighted_mean' mode."""
+        return [aperture.vars for aperture in self.init_apertures(filename, shift=shift)]
+
+    def extract_psf_frames(self, frames, shift=None, origin=None, mode='median', align=True, vars=None):
+        """Extract the PSFs from a chunk of frames in memory.
+
+        This follows extract_psfs(), but operates on all frames of the chunk at once and returns the PSFs instead of
+        writing them to a file.
+
+        Args:
+            frames (np.ndarray, ndim=3):
+                Chunk of frames with the time axis along the zero-th axis.
+            shift (tuple, optional):
+                Shift of the file with respect to the reference file. Default is None.
+            origin (tuple, optional):
+                Position of the first pixel of the frames in the coordinates of the file, for instance the offset of
+                a region of interest. Default is None.
+            mode (str, optional):
+                Combination mode for PSFs from different apertures, see extract_psfs().
+            align (bool, optional):
+                Execute sub-pixel alignments of apertures. Default is True.
+            vars (list, optional):
+                Variances of the apertures, as obtained from get_aperture_vars(). Required in 'weighted_mean' mode.
+
+        Returns:
+            psfs (np.ndarray, ndim=3):
+                PSF frames of shape (n_frames, box_size, box_size).
+        """
+
+        if mode not in ['median', 'mean', 'weighted_mean']:
+            raise ValueError('ReferenceStars received unknown mode for extract method ({}).'.format(mode))
+        if mode == 'weighted_mean' and vars is None:
+            raise SpecklepyValueError('extract_psf_frames()', argname='vars', argvalue=vars,
+                                      expected="provided in 'weighted_mean' mode")
+
+        positions = self.get_aperture_positions(shift=shift, origin=origin)
+        psfs = np.empty((len(positions), len(frames), self.box_size, self.box_size))
+        psf_vars = np.ones(psfs.shape)
+        for aperture_index, position in enumerate(positions):
+
+            # Cut the aperture around the closest pixel
+            center = np.rint(position).astype(int)
+            offset = position - center
+            lower = center - self.radius
+            upper = center + self.radius + 1
+            if np.any(lower < 0) or np.any(upper > frames.shape[-2:]):
+                raise SpecklepyValueError('extract_psf_frames()', argname='position', argvalue=tuple(position),
+                                          expected=f"aperture within the frames of shape {frames.shape[-2:]}")
+            flux = np.array(frames[:, lower[0]: upper[0], lower[1]: upper[1]], dtype=float)
+
+            if align:
+                for frame_index, frame in enumerate(flux):
+                    flux[frame_index] = ndimage.shift(frame, shift=offset)
+
+            # Normalization of each psf to make median estimate sensible
+            norm = np.sum(flux, axis=(-2, -1))[:, np.newaxis, np.newaxis]
+            psfs[aperture_index] = flux / norm
+            if vars is not None:
+                var = ndimage.shift(vars[aperture_index], shift=offset) if align else vars[aperture_index]
+                psf_vars[aperture_index] = var / norm
+
+        if mode == 'median':
+            return np.median(psfs, axis=0)
+        elif mode == 'mean':
+            return np.mean(psfs, axis=0)
+        else:
+            return weighted_mean(psfs, axis=0, vars=psf_vars)[0]
+
     def extract_psfs(self, file_shifts=None, mode='median', align=True, debug=False):
         """Extract the PSF of the list of ReferenceStars frame by frame.
 
@@ -240,3 +332,172 @@ class ReferenceStars(object):
                 psf_file.update_frame(frame_index, epsf)
 
         return psf_files
+
+
+class PSFExtractor(object):
+
+    """Extraction of PSFs from chunks of frames, which are passed in by the caller.
+
+    Instead of reading every cube for writing PSF files, which are then thresholded and read again, the PSFs are
+    extracted from the chunks of frames that a consumer like the FourierObject reads anyway. The PSFs are
+    noise-thresholded in memory and only written to PSF files if requested.
+    """
+
+    def __init__(self, reference_stars, file_shifts=None, mode='median', align=True, noise_threshold=None,
+                 noise_reference_margin=3, save_dir=None):
+        """Create a PSFExtractor instance.
+
+        Args:
+            reference_stars (ReferenceStars):
+                Reference stars, whose apertures are combined into the PSFs.
+            file_shifts (list, optional):
+                List of shifts of the files with respect to the reference file, see ReferenceStars.extract_psfs().
+            mode (str, optional):
+                Combination mode for PSFs from different apertures, see ReferenceStars.extract_psfs(). In
+                'weighted_mean' mode, the variances of the apertures are read from the files in advance.
+            align (bool, optional):
+                Execute sub-pixel alignments of apertures. Default is True.
+            noise_threshold (float, optional):
+                If provided, the PSFs are thresholded by this multiple of the noise, see threshold_psfs().
+            noise_reference_margin (int, optional):
+                Width of the noise reference annulus in pixels, see threshold_psfs(). Default is 3.
+            save_dir (str, optional):
+                If provided, the PSFs are also written to PSF files in this directory. Default is None.
+        """
+
+        # Check input parameters
+        if not isinstance(reference_stars, ReferenceStars):
+            raise SpecklepyTypeError('PSFExtractor', argname='reference_stars', argtype=type(reference_stars),
+                                     expected='ReferenceStars')
+        if mode not in ['median', 'mean', 'weighted_mean']:
+            raise SpecklepyValueError('PSFExtractor', argname='mode', argvalue=mode,
+                                      expected="either 'median', 'mean', or 'weighted_mean'")
+        if file_shifts is not None and len(file_shifts) != len(reference_stars.in_files):
+            raise SpecklepyValueError('PSFExtractor', argname='len(file_shifts)', argvalue=len(file_shifts),
+                                      expected=f"{len(reference_stars.in_files)} (number of input files)")
+
+        # Store attributes
+        self.reference_stars = reference_stars
+        self.file_shifts = file_shifts
+        self.mode = mode
+        self.align = align
+        self.noise_threshold = noise_threshold
+        self.noise_reference_margin = noise_reference_margin
+        self.save_dir = save_dir
+        self.psf_files = [None] * len(reference_stars.in_files)
+        self._vars = {}
+
+    @property
+    def frame_shape(self):
+        return self.reference_stars.box_size, self.reference_stars.box_size
+
+    def create_psf_file(self, file_index, n_frames=None):
+        """Create the PSF file of a file in the save_dir, which is then filled by the calls of the instance.
+
+        Args:
+            file_index (int):
+                Index of the file in the in_files attribute of the reference stars.
+            n_frames (int, optional):
+                Number of frames of the file. Defaults to the number of frames in the header of the file.
+
+        Returns:
+            psf_file (str):
+                Path to the PSF file.
+        """
+        psf_file = PSFFile(self.reference_stars.in_files[file_index], out_dir=self.save_dir,
+                           frame_shape=self.frame_shape, in_dir=self.reference_stars.in_dir, n_frames=n_frames,
+                           header_card_prefix="HIERARCH SPECKLEPY ")
+        self.psf_files[file_index] = psf_file.file_path
+        return psf_file.file_path
+
+    def __call__(self, file_index, frames, start=0, n_frames=None, origin=None):
+        """Extract the PSFs of a chunk of frames of a file.
+
+        Args:
+            file_index (int):
+                Index of the file in the in_files attribute of the reference stars.
+            frames (np.ndarray, ndim=3):
+                Chunk of frames of the file.
+            start (int, optional):
+                Index of the first frame of the chunk, for writing the PSFs to the PSF file. Default is 0.
+            n_frames (int, optional):
+                Total number of frames of the file, for creating the PSF file. Defaults to the number of frames in the
+                header of the file.
+            origin (tuple, optional):
+                Position of the first pixel of the frames in the coordinates of the file, for instance the offset of
+                a region of interest. Default is None.
+
+        Returns:
+            psfs (np.ndarray, ndim=3):
+                PSF frames of the chunk.
+        """
+
+        file = self.reference_stars.in_files[file_index]
+        shift = self.file_shifts[file_index] if self.file_shifts is not None else None
+        if self.mode == 'weighted_mean' and file_index not in self._vars:
+            self._vars[file_index] = self.reference_stars.get_aperture_vars(file, shift=shift)
+
+        psfs = self.reference_stars.extract_psf_frames(frames, shift=shift, origin=origin, mode=self.mode,
+                                                       align=self.align, vars=self._vars.get(file_index))
+        if self.noise_threshold is not None:
+            psfs = threshold_psfs(psfs, noise_threshold=self.noise_threshold,
+                                  noise_reference_margin=self.noise_reference_margin)
+
+        # Write the PSFs to file only if requested
+        if self.save_dir is not None:
+            if self.psf_files[file_index] is None:
+                self.create_psf_file(file_index, n_frames=n_frames)
+            with fits.open(self.psf_files[file_index], mode='update') as hdu_list:
+                hdu_list[0].data[start: start + len(psfs)] = psfs
+
+        return psfs
+
+
+def get_noise_mask(frame, noise_reference_margin):
+    """Create an annulus-like mask within a given aperture for measuring noise
+    and (sky) background.
+
+    Args:
+        frame (np.ndarray):
+            Image frame within which the mask is derived.
+        noise_reference_margin (int):
+            Width of the reference annulus in pixels.
+
+    Returns:
+        annulus_mask (np.ndarray, dtype=bool):
+            Mask array, derived from the frame.
+    """
+    center = int((frame.shape[0] - 1) / 2)
+    radius = center - noise_reference_margin
+    tmp = Aperture(center, center, radius, data=frame, crop=False)
+    annulus_mask = np.logical_not(tmp.data.mask)
+    return annulus_mask
+
+
+def threshold_psfs(psfs, noise_threshold, noise_reference_margin):
+    """Subtract the background and a multiple of the noise from PSF frames and normalize them to unit flux.
+
+    The background and noise are measured frame by frame in the reference annulus of get_noise_mask().
+
+    Args:
+        psfs (np.ndarray, ndim=3):
+            PSF frames with the time axis along the zero-th axis.
+        noise_threshold (float):
+            Multiple of the noise that is subtracted on top of the background.
+        noise_reference_margin (int):
+            Width of the reference annulus in pixels.
+
+    Returns:
+        thresholded (np.ndarray, ndim=3):
+            Thresholded PSF frames with a flux sum of order unity.
+    """
+    noise_mask = get_noise_mask(psfs[0], noise_reference_margin=noise_reference_margin)
+    reference = psfs[:, np.logical_not(noise_mask)]
+    background = np.mean(reference, axis=-1)
+    noise = np.std(reference, axis=-1)
+    thresholded = np.maximum(psfs - (background + noise_threshold * noise)[:, np.newaxis, np.newaxis], 0.0)
+    flux = np.sum(thresholded, axis=(-2, -1))
+    if np.any(flux == 0.0):
+        raise ValueError("After background subtraction and noise thresholding, no signal is leftover. "
+                         "Please reduce the noiseThreshold!")
+    return thresholded / flux[:, np.newaxis, np.newaxis]
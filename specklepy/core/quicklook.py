@@ -0,0 +1,243 @@
+import numpy as np
+import os
+import time
+
+from astropy.io import fits
+
+from specklepy.core import alignment
+from specklepy.core.ssa import get_peak_indizes
+from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
+from specklepy.logging import logger
+
+
+class GrowingCubeReader(object):
+
+    """Reader for FITS cubes that are still being written by an acquisition system.
+
+    The number of available frames is derived from the file size, as the NAXIS3 card may not be up to date while the
+    acquisition is running. If NAXIS3 is set to a positive value, it limits the number of available frames, which
+    avoids interpreting the padding at the end of a complete file as frames.
+    """
+
+    dtypes = {8: '>u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8'}
+
+    def __init__(self, file):
+        """Create a GrowingCubeReader instance.
+
+        Args:
+            file (str):
+                Path to the FITS file.
+        """
+        if not isinstance(file, str):
+            raise SpecklepyTypeError('GrowingCubeReader', argname='file', argtype=type(file), expected='str')
+        self.file = file
+        self.header = None
+        self.data_offset = None
+        self.read_header()
+
+        self.frame_shape = (self.header['NAXIS2'], self.header['NAXIS1'])
+        self.dtype = np.dtype(self.dtypes[self.header['BITPIX']])
+        self.frame_bytes = self.dtype.itemsize * self.frame_shape[0] * self.frame_shape[1]
+        self.bscale = self.header.get('BSCALE', 1)
+        self.bzero = self.header.get('BZERO', 0)
+
+    def read_header(self):
+        """Read the primary header and the offset of the data block."""
+        with open(self.file, 'rb') as f:
+            self.header = fits.Header.fromfile(f)
+            self.data_offset = f.tell()
+        return self.header
+
+    @property
+    def n_available(self):
+        """Number of frames that are completely written to the file."""
+        n_frames = max(os.path.getsize(self.file) - self.data_offset, 0) // self.frame_bytes
+        if self.header['NAXIS'] == 3:
+            naxis3 = self.read_header()['NAXIS3']
+            if naxis3 > 0:
+                n_frames = min(n_frames, naxis3)
+        return n_frames
+
+    def read(self, start, stop, out=None):
+        """Read the frames with indizes start to stop.
+
+        Args:
+            start (int):
+                Index of the first frame.
+            stop (int):
+                Index after the last frame.
+            out (np.ndarray, optional):
+                Array to write the frames into, of shape (stop - start, *frame_shape).
+
+        Returns:
+            frames (np.ndarray):
+                Array of the frames.
+        """
+        n_frames = stop - start
+        with open(self.file, 'rb') as f:
+            f.seek(self.data_offset + start * self.frame_bytes)
+            buffer = f.read(n_frames * self.frame_bytes)
+        frames = np.frombuffer(buffer, dtype=self.dtype).reshape((n_frames,) + self.frame_shape)
+        if out is None:
+            out = np.empty(frames.shape)
+        np.multiply(frames, self.bscale, out=out)
+        out += self.bzero
+        return out
+
+
+class RingBuffer(object):
+
+    """Fixed-size buffer of frames, which is allocated once and re-used."""
+
+    def __init__(self, capacity, frame_shape):
+        """Create a RingBuffer instance.
+
+        Args:
+            capacity (int):
+                Maximum number of frames in the buffer.
+            frame_shape (tuple):
+                Shape of the frames.
+        """
+        if not isinstance(capacity, int) or capacity < 1:
+            raise SpecklepyValueError('RingBuffer', argname='capacity', argvalue=capacity, expected='positive int')
+        self.capacity = capacity
+        self.frames = np.zeros((capacity,) + tuple(frame_shape))
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def is_full(self):
+        return self.size == self.capacity
+
+    @property
+    def free(self):
+        """Number of free slots, that can be filled contiguously at the end of the buffer."""
+        return min(self.capacity - self.size, self.capacity - self.stop)
+
+    @property
+    def stop(self):
+        return (self.start + self.size) % self.capacity if self.size < self.capacity else self.start
+
+    def reserve(self, n_frames):
+        """Reserve up to n_frames contiguous slots and return them for being filled in-place."""
+        n_frames = min(n_frames, self.free)
+        slots = self.frames[self.stop: self.stop + n_frames]
+        self.size += n_frames
+        return slots
+
+    def pop(self, n_frames=None):
+        """Remove frames from the beginning of the buffer and return a view of the contiguous part of them."""
+        if n_frames is None:
+            n_frames = self.size
+        n_frames = min(n_frames, self.size, self.capacity - self.start)
+        frames = self.frames[self.start: self.start + n_frames]
+        self.start = (self.start + n_frames) % self.capacity
+        self.size -= n_frames
+        return frames
+
+
+class QuickLook(object):
+
+    """Running SSA reconstruction of a growing data cube.
+
+    Frames are read into a ring buffer while the acquisition is running. Each time `update_every` frames are buffered,
+    their emission peaks are searched at once and the frames are shifted onto the peak of the first frame and added to
+    the running SSA image, which is written to a preview file.
+    """
+
+    def __init__(self, file, out_file, update_every=10, box=None):
+        """Create a QuickLook instance.
+
+        Args:
+            file (str):
+                Path to the growing FITS cube.
+            out_file (str):
+                Path of the preview file, which is replaced atomically after each update.
+            update_every (int, optional):
+                Number of frames between the updates of the preview. This is also the capacity of the ring buffer.
+                Default is 10.
+            box (Box object, optional):
+                Constraining the search for the intensity peak to the specified box.
+        """
+        if not isinstance(out_file, str):
+            raise SpecklepyTypeError('QuickLook', argname='out_file', argtype=type(out_file), expected='str')
+
+        self.reader = GrowingCubeReader(file)
+        self.out_file = out_file
+        self.box = box
+        self.buffer = RingBuffer(capacity=update_every, frame_shape=self.reader.frame_shape)
+        self.image = np.zeros(self.reader.frame_shape)
+        self.anchor = None
+        self.n_read = 0
+        self.n_coadded = 0
+
+    def poll(self):
+        """Read new frames into the buffer and process the buffer each time it is full.
+
+        Returns:
+            n_new (int):
+                Number of new frames that have been read.
+        """
+        n_available = self.reader.n_available
+        n_new = n_available - self.n_read
+        while self.n_read < n_available:
+            slots = self.buffer.reserve(n_available - self.n_read)
+            self.reader.read(self.n_read, self.n_read + len(slots), out=slots)
+            self.n_read += len(slots)
+            if self.buffer.is_full:
+                self.process()
+                self.write_preview()
+        return n_new
+
+    def process(self):
+        """Shift and add the buffered frames to the running SSA image."""
+        while len(self.buffer) > 0:
+            frames = self.buffer.pop()
+            peak_indizes = get_peak_indizes(frames, box=self.box)
+            if self.anchor is None:
+                self.anchor = peak_indizes[0]
+            for frame, peak_index in zip(frames, peak_indizes):
+                alignment.add_shifted(self.image, frame, offset=self.anchor - peak_index)
+            self.n_coadded += len(frames)
+        logger.info(f"Co-added {self.n_coadded} frames into the quicklook image")
+
+    def write_preview(self):
+        """Write the running SSA image to the preview file atomically."""
+        hdu = fits.PrimaryHDU(self.image)
+        hdu.header.set('HIERARCH SPECKLEPY RECONSTRUCTION', 'SSA quicklook')
+        hdu.header.set('HIERARCH SPECKLEPY FILE 0', os.path.basename(self.reader.file))
+        hdu.header.set('HIERARCH SPECKLEPY FILE 0 FRAMES', self.n_coadded)
+        tmp_file = self.out_file + '.tmp'
+        hdu.writeto(tmp_file, overwrite=True)
+        os.replace(tmp_file, self.out_file)
+
+    def follow(self, poll_interval=1.0, timeout=30.0):
+        """Poll the cube until no new frames have arrived for `timeout` seconds.
+
+        Args:
+            poll_interval (float, optional):
+                Time between polls in seconds. Default is 1.0.
+            timeout (float, optional):
+                Time without new frames in seconds, after which the acquisition is considered finished. Default is
+                30.0.
+
+        Returns:
+            image (np.ndarray):
+                The final SSA quicklook image.
+        """
+        logger.info(f"Following cube {self.reader.file}...")
+        last_update = time.time()
+        while time.time() - last_update < timeout:
+            if self.poll() > 0:
+                last_update = time.time()
+            else:
+                time.sleep(poll_interval)
+
+        # Process the remaining frames
+        self.process()
+        self.write_preview()
+        logger.info(f"No new frames for {timeout} seconds, stopped following {self.reader.file}")
+        return self.image
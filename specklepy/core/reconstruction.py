@@ -1,3 +1,4 @@
+from functools import partial
 from IPython import embed
 import numpy as np
 import os
@@ -5,12 +6,15 @@ import os
 from astropy.io import fits
 
 from specklepy.core import alignment
-from specklepy.core.ssa import coadd_frames
+from specklepy.core.ssa import coadd_file
 from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
+from specklepy.io.cubereader import CubeInfo, CubeReader, check_time_binning
 from specklepy.io.outfile import Outfile
 from specklepy.io.reconstructionfile import ReconstructionFile
 from specklepy.logging import logger
 from specklepy.utils.box import Box
+from specklepy.utils.parallel import parallel_map
+from specklepy.utils.tiledcanvas import TiledCanvas
 
 
 class Reconstruction(object):
@@ -24,7 +28,8 @@ class Reconstruction(object):
     supported_modes = ['full', 'same', 'valid']
 
     def __init__(self, in_files, mode='same', reference_image=None, out_file=None, in_dir=None, tmp_dir=None,
-                 alignment_method='collapse', var_ext=None, box_indexes=None, debug=False):
+                 alignment_method='collapse', var_ext=None, box_indexes=None, chunk_size=None, n_jobs=1,
+                 max_dense_pixels=None, cache=None, time_binning=None, roi=None, debug=False):
         """Create a Reconstruction instance.
 
         Args:
@@ -48,6 +53,24 @@ class Reconstruction(object):
                 Path to the `in_files`.
             tmp_dir (str, optional):
                 Path to the directory for storing temporary products.
+            chunk_size (int, optional):
+                If provided, the input cubes are streamed from memory-mapped files in chunks of this number of frames
+                when creating the long exposures, instead of reading the full cubes into memory.
+            n_jobs (int, optional):
+                Number of worker processes for creating the long exposures in parallel. None or negative values use all
+                CPUs. Default is 1.
+            max_dense_pixels (int, optional):
+                In `full` mode, the image is accumulated on a sparse TiledCanvas and written as tile extensions if it
+                covers more than this number of pixels. Defaults to TiledCanvas.max_dense_pixels.
+            cache (FileCache, optional):
+                If provided, the long exposures and shifts are restored from this cache if the input files and
+                parameters did not change, and stored to it otherwise.
+            time_binning (int, optional):
+                If provided, this number of consecutive frames is co-added while reading the cubes for the SSA long
+                exposures. Default is None.
+            roi (ROI, optional):
+                If provided, the input cubes are cropped to this region of interest while creating the long exposures,
+                and the reconstruction covers only this region. Default is None.
             debug (bool, optional):
                 Show debugging information.
         """
@@ -73,16 +96,21 @@ class Reconstruction(object):
         self.tmp_dir = tmp_dir if tmp_dir is not None else ''
         self.var_ext = var_ext  # if var_ext is not None else 'VAR'
         self.box = Box(box_indexes) if box_indexes is not None else None
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.max_dense_pixels = max_dense_pixels
+        self.cache = cache
+        self.time_binning = check_time_binning(time_binning, 'Reconstruction')
+        self.roi = roi
 
         # Retrieve name of reference file
         self.reference_file = self.identify_reference_file()
 
-        # Derive shape of individual input frames
+        # Derive shape of individual input frames from the header
         single_cube_mode = len(self.in_files) == 1
-        example_frame = fits.getdata(os.path.join(in_dir, self.in_files[0]))
-        if example_frame.ndim == 3:
-            example_frame = example_frame[0]
-        self.frame_shape = example_frame.shape
+        self.frame_shape = CubeInfo(self.in_files[0], in_dir=self.in_dir).frame_shape
+        if self.roi is not None:
+            self.frame_shape = self.roi.get_shape(self.frame_shape)
 
         # Initialize image
         if single_cube_mode:
@@ -95,9 +123,23 @@ class Reconstruction(object):
             # Identify reference tmp file
             self.reference_tmp_file = self.identify_reference_long_exposure_file()
 
-            # Estimate relative shifts
-            self.shifts = alignment.get_shifts(files=self.long_exp_files, reference_file=self.reference_tmp_file,
-                                               lazy_mode=True, return_image_shape=False, in_dir=tmp_dir, debug=debug)
+            # Estimate relative shifts, or restore them from the cache
+            if self.cache is not None:
+                key = self.cache.get_key(files=[os.path.join(self.in_dir, file) for file in self.in_files],
+                                         product='shifts', alignment_method=alignment_method, box=self.box,
+                                         time_binning=self.time_binning, roi=self.roi,
+                                         reference_file=self.reference_tmp_file)
+                cached = self.cache.load_arrays(key)
+            else:
+                cached = None
+            if cached is not None:
+                self.shifts = [tuple(shift) for shift in cached['shifts'].tolist()]
+            else:
+                self.shifts = alignment.get_shifts(files=self.long_exp_files, reference_file=self.reference_tmp_file,
+                                                   lazy_mode=True, return_image_shape=False, in_dir=tmp_dir,
+                                                   debug=debug)
+                if self.cache is not None:
+                    self.cache.store_arrays(key, shifts=np.array(self.shifts))
 
             # Derive corresponding padding vectors
             self.pad_vectors, self.reference_pad_vector = \
@@ -107,13 +149,26 @@ class Reconstruction(object):
             self.image = self.initialize_image()
 
         # Initialize the variance map
-        self.var = np.zeros(self.image.shape) if self.var_ext is not None else None
-
-        # Initialize output file and create an extension for the variance
-        self.out_file = ReconstructionFile(files=self.in_files, filename=self.out_file, shape=self.image.shape,
-                                      in_dir=in_dir, cards={"RECONSTRUCTION": "SSA"})
-        if self.var is not None:
-            self.out_file.new_extension(name=self.var_ext, data=self.var)
+        if self.var_ext is None:
+            self.var = None
+        elif isinstance(self.image, TiledCanvas):
+            self.var = TiledCanvas(tile_shape=self.image.tile_shape)
+        else:
+            self.var = np.zeros(self.image.shape)
+
+        # Initialize output file and create an extension for the variance. Canvases are written only after co-adding,
+        # when their extent is known
+        cards = {"RECONSTRUCTION": "SSA"}
+        if self.roi is not None:
+            cards.update(self.roi.cards)
+        if isinstance(self.image, TiledCanvas):
+            self.out_file = ReconstructionFile(files=self.in_files, filename=self.out_file, shape=self.frame_shape,
+                                               in_dir=in_dir, cards=cards)
+        else:
+            self.out_file = ReconstructionFile(files=self.in_files, filename=self.out_file, shape=self.image.shape,
+                                               in_dir=in_dir, cards=cards)
+            if self.var is not None:
+                self.out_file.new_extension(name=self.var_ext, data=self.var)
 
     def identify_reference_file(self):
 
@@ -149,51 +204,67 @@ class Reconstruction(object):
     def create_long_exposures(self, alignment_method):
         """Compute long exposures from the input data cubes."""
 
-        # Initialize list of long exposure files
-        long_exposure_files = []
+        # Check the alignment method before starting the computations
+        if alignment_method == 'collapse':
+            prefix = 'int_'
+        elif alignment_method == 'ssa':
+            prefix = 'ssa_'
+        else:
+            raise SpecklepyValueError('Reconstruction', 'alignment_method', alignment_method,
+                                      expected="either 'collapse' or 'ssa'")
+
+        # Restore the long exposures of unchanged cubes from the cache
+        paths = [os.path.join(self.in_dir, file) for file in self.in_files]
+        long_exposure_files = [prefix + os.path.basename(file) for file in self.in_files]
+        if self.cache is not None:
+            keys = [self.cache.get_key(files=[path], product='long_exposure', alignment_method=alignment_method,
+                                       box=self.box, time_binning=self.time_binning, roi=self.roi)
+                    for path in paths]
+            missing = [index for index, key in enumerate(keys)
+                       if self.cache.restore_files(key, out_dir=self.tmp_dir) is None]
+        else:
+            missing = list(range(len(self.in_files)))
 
-        # Iterate over input data cubes
-        for file in self.in_files:
+        # Compute collapsed or SSA'ed images from the remaining cubes
+        long_exposures = parallel_map(partial(create_long_exposure, alignment_method=alignment_method, box=self.box,
+                                              chunk_size=self.chunk_size, time_binning=self.time_binning,
+                                              roi=self.roi),
+                                      [paths[index] for index in missing], n_jobs=self.n_jobs)
 
-            # Read data from file
-            cube = fits.getdata(os.path.join(self.in_dir, file))
-            image = None
-            image_var = None
-
-            # Compute collapsed or SSA'ed images from the cube
-            if alignment_method == 'collapse':
-                image = np.sum(cube, axis=0)
-                tmp_file = 'int_' + os.path.basename(file)
-            elif alignment_method == 'ssa':
-                image, image_var = coadd_frames(cube=cube, box=self.box)
-                tmp_file = 'ssa_' + os.path.basename(file)
-            else:
-                raise SpecklepyValueError('Reconstruction', 'alignment_method', alignment_method,
-                                          expected="either 'collapse' or 'ssa'")
+        # Iterate over computed long exposures
+        for index, (image, image_var) in zip(missing, long_exposures):
+            tmp_file = long_exposure_files[index]
 
             # Store data to a new Outfile instance
             tmp_path = os.path.join(self.tmp_dir, tmp_file)
-            logger.info(f"Saving temporary reconstruction of cube {file} to {tmp_path}")
+            logger.info(f"Saving temporary reconstruction of cube {paths[index]} to {tmp_path}")
             tmp_file_object = Outfile(tmp_path, data=image, verbose=True)
             if image_var is not None:
                 tmp_file_object.new_extension(name=self.var_ext, data=image_var)
 
-            # Add the recently created file to the list
-            long_exposure_files.append(tmp_file)
+            # Keep a copy in the cache for later runs
+            if self.cache is not None:
+                self.cache.store_files(keys[index], [tmp_path])
 
         return long_exposure_files
 
     def initialize_image(self):
-        """Initialize the reconstruction image."""
+        """Initialize the reconstruction image.
+
+        In `full` mode, the image is a sparse TiledCanvas, which allocates only the tiles that receive data instead
+        of the bounding box of all shifts.
+        """
+
+        # The full field is accumulated on a sparse canvas
+        if self.mode == 'full':
+            return TiledCanvas()
 
         # Initialize image along the input frame shape
         image = np.zeros(self.frame_shape)
 
-        # Crop or expand according to the reconstruction mode
+        # Crop according to the reconstruction mode
         if self.mode == 'same':
             pass
-        elif self.mode == 'full':
-            image = np.pad(image, self.reference_pad_vector, mode='constant')
         elif self.mode == 'valid':
             # Estimate minimum overlap
             _shifts = np.array(self.shifts)
@@ -217,15 +288,71 @@ class Reconstruction(object):
                     tmp_image_var = None
 
             # Co-add reconstructions and var images
+            if isinstance(self.image, TiledCanvas):
+                self.image.add(tmp_image, offset=self.shifts[index])
+                if tmp_image_var is not None:
+                    self.var.add(tmp_image_var, offset=self.shifts[index], squared=True)
+                continue
             self.image += alignment.pad_array(tmp_image, self.pad_vectors[index], mode=self.mode,
                                                   reference_image_pad_vector=self.reference_pad_vector)
             if tmp_image_var is not None:
                 self.var += alignment.pad_array(tmp_image_var, self.pad_vectors[index], mode=self.mode,
                                                           reference_image_pad_vector=self.reference_pad_vector)
 
-        # Update out_file
+        # Update out_file, with canvases written as dense images or as tiles if they are too large
+        if isinstance(self.image, TiledCanvas):
+            image = self.image.write(self.out_file, max_dense_pixels=self.max_dense_pixels)
+            if self.var is not None and len(self.var) > 0:
+                var = self.var.write(self.out_file, name=self.var_ext, max_dense_pixels=self.max_dense_pixels)
+            else:
+                var = None
+            return image, var
+
         self.out_file.data = self.image
         if self.var_ext is not None and self.var is not None:
             self.out_file.update_extension(ext_name=self.var_ext, data=self.var)
 
         return self.image, self.var
+
+
+def create_long_exposure(file, alignment_method, box=None, chunk_size=None, time_binning=None, roi=None):
+    """Compute a long exposure from a data cube.
+
+    Args:
+        file (str):
+            Path to the FITS file containing the cube.
+        alignment_method (str):
+            Either 'collapse' for summing the frames or 'ssa' for the SSA reconstruction of the cube.
+        box (Box object, optional):
+            Constraining the search for the intensity peak in 'ssa' mode.
+        chunk_size (int, optional):
+            If provided, the cube is streamed from the memory-mapped file in chunks of this number of frames.
+        time_binning (int, optional):
+            If provided, this number of consecutive frames is co-added before the SSA reconstruction. This does not
+            affect the collapsed long exposure.
+        roi (ROI, optional):
+            If provided, the cube is cropped to this region of interest while reading.
+
+    Returns:
+        image (np.ndarray):
+            Long exposure image.
+        image_var (np.ndarray or None):
+            Variance of the long exposure, if available.
+    """
+
+    if alignment_method == 'collapse':
+        if chunk_size is None:
+            with fits.open(file) as hdu_list:
+                cube = hdu_list[0].data
+                image = np.sum(roi(cube) if roi is not None else cube, axis=0)
+        else:
+            with CubeReader(file, chunk_size=chunk_size, roi=roi) as cube:
+                image = np.zeros(cube.frame_shape)
+                for _, chunk in cube.iter_chunks():
+                    image += np.sum(chunk, axis=0)
+        return image, None
+    elif alignment_method == 'ssa':
+        return coadd_file(file, box=box, var_ext=None, chunk_size=chunk_size, time_binning=time_binning, roi=roi)
+    else:
+        raise SpecklepyValueError('create_long_exposure()', 'alignment_method', alignment_method,
+                                  expected="either 'collapse' or 'ssa'")
@@ -1,19 +1,32 @@
+from functools import partial
 import numpy as np
 import os
 
 from astropy.io import fits
+from scipy import fft
 
 from specklepy.core import alignment
+from specklepy.core.bootstrap import get_bootstrap_error, get_sample_draw_vectors
+from specklepy.core.frameselection import FrameSelection
+from specklepy.core.frametracking import FrameTracker
+from specklepy.core.ssastate import SSAState
 from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
+from specklepy.io.cubereader import CubeInfo, CubeReader, bin_frames, check_time_binning, iter_chunks
 from specklepy.io.outfile import Outfile
 from specklepy.io.reconstructionfile import ReconstructionFile
 from specklepy.logging import logger
 from specklepy.utils.box import Box
+from specklepy.utils.parallel import parallel_map
+from specklepy.utils.roi import ROI
+from specklepy.utils.tiledcanvas import TiledCanvas
 from specklepy.plotting.plots import imshow
 
 
 def ssa(files, mode='same', reference_file=None, outfile=None, in_dir=None, tmp_dir=None, lazy_mode=True, box_indexes=None,
-        debug=False, **kwargs):
+        chunk_size=None, n_jobs=1, write_tmp_files=False, selection_method=None, selection_fraction=1.0,
+        incremental=False, n_bootstrap=None, bootstrap_seed=None, oversampling=None, max_dense_pixels=None,
+        upsample_factor=None, alignment_mode='correlation', header_cards=None, frame_tracking=False, cache=None,
+        time_binning=None, roi=None, debug=False, **kwargs):
     """Compute the SSA reconstruction of a list of files.
 
     The simple shift-and-add (SSA) algorithm makes use of the structure of typical speckle patterns, i.e.
@@ -40,18 +53,84 @@ def ssa(files, mode='same', reference_file=None, outfile=None, in_dir=None, tmp_
         in_dir (str, optional):
             Path to the files. `None` is substituted by an empty string.
         tmp_dir (str, optional):
-            Path of a directory in which the temporary results are stored in.
+            Path of a directory in which the temporary results are stored in, if requested by `write_tmp_files` or in
+            debug mode.
         lazy_mode (bool, optional):
             Set to False, to enforce the alignment of a single file with respect to the reference file. Default is True.
         box_indexes (list, optional):
             Constraining the search for the intensity peak to the specified box. Searching the full frames if not
-            provided.
+            provided. The indexes refer to the frames after cropping them to the `roi`, if provided.
+        chunk_size (int, optional):
+            If provided, the cubes are streamed from memory-mapped files in chunks of this number of frames, instead of
+            reading the full cubes into memory. Default is None.
+        n_jobs (int, optional):
+            Number of worker processes for reconstructing the individual cubes in parallel. None or negative values use
+            all CPUs. Default is 1.
+        write_tmp_files (bool, optional):
+            The interim reconstructions of the individual cubes are kept in memory and passed to the alignment
+            directly. Set to True to store them additionally to `tmp_dir`, which is always done in debug mode. Default
+            is False.
+        selection_method (str, optional):
+            If provided, only the best frames of each cube are co-added, scored by this metric. See
+            specklepy.core.frameselection.FrameSelection for the options. The selection is recorded in the header of
+            the outfile. Default is None.
+        selection_fraction (float, optional):
+            Fraction of frames to select from each cube, if a selection_method is provided. Default is 1.0.
+        incremental (bool, optional):
+            Set to True to store the accumulator state next to the outfile and to extend the state of a previous
+            reconstruction, if available. Cubes that have been co-added before are skipped. Not available in 'valid'
+            mode and with some options, see SSAState.check_options(). Default is False.
+        n_bootstrap (int, optional):
+            If provided, this number of bootstrap resamplings of the frames of each cube is co-added along with the
+            reconstruction, and their standard deviation is stored as bootstrap error map in the outfile. Not available
+            in incremental mode. Default is None.
+        bootstrap_seed (int, optional):
+            Seed for drawing the bootstrap samples, for reproducible error maps. Default is None.
+        oversampling (int, optional):
+            If provided, the frames of each cube are aligned on their sub-pixel peaks and co-added onto a grid that is
+            finer by this factor, with bilinear weights. The reconstruction is then oversampled as well. Cannot be
+            combined with n_bootstrap. Default is None.
+        max_dense_pixels (int, optional):
+            In 'full' mode, the aligned reconstructions and bootstrap samples are accumulated on sparse TiledCanvas
+            instances. If the covered field exceeds this number of pixels, the reconstruction and its variance and
+            bootstrap error maps are written to the outfile as tile extensions and returned as TiledCanvas instead of
+            dense arrays. Defaults to TiledCanvas.max_dense_pixels.
+        upsample_factor (int, optional):
+            If provided, the shifts between the cubes are estimated with a precision of 1/upsample_factor pixels and
+            the interim reconstructions are placed with bilinear weights. Not available in incremental mode. Default
+            is None.
+        alignment_mode (str, optional):
+            Mode for estimating the shifts between the cubes, passed to specklepy.core.alignment.get_shifts. Use
+            'pyramid' for large frames with small shifts and 'global' for wide dither patterns. Default is
+            'correlation'.
+        header_cards (dict or str, optional):
+            Mapping of the telescope offset keys to header cards or name of an instrument in config/instruments.cfg.
+            If provided, the shifts are searched only around the predictions from the header offsets of the files. See
+            specklepy.core.alignment.get_shifts for details. Default is None.
+        frame_tracking (bool, optional):
+            Set to True to align the frames within each cube by their correlation with a running reference, instead
+            of their emission peaks. See specklepy.core.frametracking.FrameTracker for details. Default is False.
+        cache (FileCache, optional):
+            If provided, the interim reconstructions of the cubes and the shifts between them are restored from this
+            cache if the input files and parameters did not change, and stored to it otherwise. Bootstrap samples are
+            only cached if a bootstrap_seed is provided. Default is None.
+        time_binning (int, optional):
+            If provided, this number of consecutive frames is co-added while reading the cubes, before the frame
+            selection, tracking and SSA co-addition. Variances are summed accordingly. Default is None.
+        roi (ROI, optional):
+            Region of interest, to which the cubes and the reference image are cropped while reading, such that all
+            later stages only process this region. The offset of the region is stored in the header of the outfile.
+            Default is None.
         debug (bool, optional):
             Show debugging information. Default is False.
 
     Returns:
         reconstruction (np.ndarray):
             The image reconstruction. The size depends on the mode argument.
+        reconstruction_var (np.ndarray):
+            The variance map of the reconstruction, if the files contain variance extensions.
+        bootstrap_error (np.ndarray):
+            The bootstrap error map of the reconstruction, if n_bootstrap is provided.
     """
 
     logger.info("Starting SSA reconstruction...")
@@ -74,23 +153,48 @@ def ssa(files, mode='same', reference_file=None, outfile=None, in_dir=None, tmp_
         reference_file = files[reference_file]
     elif not isinstance(reference_file, str):
         raise SpecklepyTypeError('ssa()', argname='reference_file', argtype=type(reference_file), expected='str or int')
-
-    if outfile is None:
-        pass
-    elif isinstance(outfile, str):
-        outfile = ReconstructionFile(files=files, filename=outfile, cards={"RECONSTRUCTION": "SSA"})
-    elif isinstance(outfile, ReconstructionFile):
-        pass
-    else:
+    reference_index = list(files).index(reference_file) if reference_file in files else None
+
+    if not isinstance(incremental, bool):
+        raise SpecklepyTypeError('ssa()', argname='incremental', argtype=type(incremental), expected='bool')
+    if incremental:
+        SSAState.check_options('ssa()', mode=mode, outfile=outfile, n_bootstrap=n_bootstrap,
+                               upsample_factor=upsample_factor, header_cards=header_cards)
+
+    if n_bootstrap is not None:
+        if not isinstance(n_bootstrap, int) or n_bootstrap < 2:
+            raise SpecklepyValueError('ssa()', argname='n_bootstrap', argvalue=n_bootstrap, expected='int >= 2')
+
+    if oversampling is not None:
+        if not isinstance(oversampling, int) or oversampling < 1:
+            raise SpecklepyValueError('ssa()', argname='oversampling', argvalue=oversampling, expected='positive int')
+        if n_bootstrap is not None:
+            raise SpecklepyValueError('ssa()', argname='n_bootstrap', argvalue=n_bootstrap,
+                                      expected='None in combination with oversampling')
+        if reference_index is None:
+            raise SpecklepyValueError('ssa()', argname='reference_file', argvalue=reference_file,
+                                      expected='one of the files in combination with oversampling')
+        if frame_tracking:
+            raise SpecklepyValueError('ssa()', argname='frame_tracking', argvalue=frame_tracking,
+                                      expected='False in combination with oversampling')
+
+    time_binning = check_time_binning(time_binning, 'ssa()')
+
+    if isinstance(outfile, str):
+        if not incremental:
+            # The file list of the outfile is only known after loading the state in incremental mode
+            outfile = ReconstructionFile(files=files, filename=outfile, cards={"RECONSTRUCTION": "SSA"})
+    elif outfile is not None and not isinstance(outfile, ReconstructionFile):
         raise SpecklepyTypeError('ssa()', argname='outfile', argtype=type(outfile), expected='str')
 
     if in_dir is None:
         in_dir = ''
     reference_file = os.path.join(in_dir, reference_file)
 
-    if tmp_dir is not None:
-        if isinstance(tmp_dir, str) and not os.path.isdir(tmp_dir):
-            os.makedirs(tmp_dir)
+    if tmp_dir is None:
+        tmp_dir = ''
+    elif isinstance(tmp_dir, str) and not os.path.isdir(tmp_dir) and (debug or write_tmp_files):
+        os.makedirs(tmp_dir)
 
     if not isinstance(lazy_mode, bool):
         raise SpecklepyTypeError('ssa()', argname='lazy_mode', argtype=type(lazy_mode), expected='bool')
@@ -100,10 +204,27 @@ def ssa(files, mode='same', reference_file=None, outfile=None, in_dir=None, tmp_
     else:
         box = None
 
+    if chunk_size is not None and (not isinstance(chunk_size, int) or chunk_size < 1):
+        raise SpecklepyValueError('ssa()', argname='chunk_size', argvalue=chunk_size, expected='positive int')
+
+    if roi is not None and not isinstance(roi, ROI):
+        raise SpecklepyTypeError('ssa()', argname='roi', argtype=type(roi), expected='ROI')
+
+    if selection_method is not None:
+        frame_selection = FrameSelection(method=selection_method, fraction=selection_fraction, box=box)
+    else:
+        frame_selection = None
+
+    if frame_tracking:
+        frame_tracker = FrameTracker(box=box)
+    else:
+        frame_tracker = None
+
     if 'variance_extension_name' in kwargs.keys():
         var_ext = kwargs['variance_extension_name']
     else:
         var_ext = 'VAR'
+    bootstrap_ext = kwargs.get('bootstrap_extension_name', 'BOOTSTRAP')
 
     if debug:
         logger.setLevel('DEBUG')
@@ -111,123 +232,412 @@ def ssa(files, mode='same', reference_file=None, outfile=None, in_dir=None, tmp_
         logger.info("Set logging level to DEBUG")
 
     # Align reconstructions if multiple files are provided
-    if lazy_mode and len(files) == 1:
+    if lazy_mode and len(files) == 1 and not incremental:
 
         # Do not align just a single file
-        with fits.open(os.path.join(in_dir, files[0])) as hdu_list:
-            cube = hdu_list[0].data
-            if var_ext in hdu_list:
-                var_cube = hdu_list[var_ext].data
-            else:
-                var_cube = None
-            reconstruction, reconstruction_var = coadd_frames(cube, var_cube=var_cube, box=box)
+        coadded = coadd_file(os.path.join(in_dir, files[0]), box=box, var_ext=var_ext, chunk_size=chunk_size,
+                             frame_selection=frame_selection, frame_tracker=frame_tracker, n_bootstrap=n_bootstrap,
+                             seed=bootstrap_seed, oversampling=oversampling, time_binning=time_binning, roi=roi)
+        reconstruction, reconstruction_var = coadded[:2]
+        bootstrap_reconstructions = coadded[2] if n_bootstrap is not None else None
 
     else:
 
-        # Compute temporary reconstructions of the individual cubes
-        tmp_files = []
-        for index, file in enumerate(files):
-            with fits.open(os.path.join(in_dir, file)) as hdu_list:
-                cube = hdu_list[0].data
-                if var_ext in hdu_list:
-                    var_cube = hdu_list[var_ext].data
-                    logger.debug(f"Found variance extension {var_ext} in file {file}")
-                else:
-                    logger.debug(f"Did not find variance extension {var_ext} in file {file}")
-                    var_cube = None
-                tmp, tmp_var = coadd_frames(cube, var_cube=var_cube, box=box)
+        # Load the state of a previous reconstruction and skip the files that have been co-added already
+        state = None
+        if incremental:
+            grid = {'oversampling': oversampling, 'roi': roi, 'time_binning': time_binning}
+            state_file = SSAState.get_state_file(outfile if isinstance(outfile, str) else outfile.file_path)
+            if os.path.isfile(state_file):
+                state = SSAState.load(state_file)
+                if state.mode != mode:
+                    raise SpecklepyValueError('ssa()', argname='mode', argvalue=mode,
+                                              expected=f"{state.mode!r} as in the stored state")
+                state.check_grid('ssa()', **grid)
+                logger.info(f"Skipping {len(state.files)} files that have been co-added before")
+                files = [file for file in files if file not in state.files]
+
+        # Restore the temporary reconstructions of unchanged cubes from the cache. Random bootstrap samples are not
+        # reproducible and thus not cached
+        seeds = np.random.SeedSequence(bootstrap_seed).spawn(len(files))
+        paths = [os.path.join(in_dir, file) for file in files]
+        tmp_reconstructions = [None] * len(files)
+        if cache is not None:
+            params = {'box': box, 'var_ext': var_ext, 'selection_method': selection_method,
+                      'selection_fraction': selection_fraction, 'frame_tracking': frame_tracking,
+                      'n_bootstrap': n_bootstrap, 'oversampling': oversampling, 'time_binning': time_binning,
+                      'roi': roi}
+            keys = [cache.get_key(files=[path], product='ssa', seed=(seed.entropy, seed.spawn_key), **params)
+                    if n_bootstrap is not None else cache.get_key(files=[path], product='ssa', **params)
+                    for path, seed in zip(paths, seeds)]
+            if n_bootstrap is None or bootstrap_seed is not None:
+                for index, key in enumerate(keys):
+                    arrays = cache.load_arrays(key)
+                    if arrays is not None:
+                        tmp_reconstructions[index] = (arrays['image'], arrays.get('var'), arrays.get('bootstrap'))
+        missing = [index for index, tmp in enumerate(tmp_reconstructions) if tmp is None]
+
+        # Compute temporary reconstructions of the remaining cubes, with independent bootstrap seeds per cube
+        computed = parallel_map(partial(_coadd_file_with_seed, box=box, var_ext=var_ext, chunk_size=chunk_size,
+                                        frame_selection=frame_selection, frame_tracker=frame_tracker,
+                                        n_bootstrap=n_bootstrap, oversampling=oversampling,
+                                        time_binning=time_binning, roi=roi),
+                                [(paths[index], seeds[index]) for index in missing], n_jobs=n_jobs)
+        for index, tmp in zip(missing, computed):
+            tmp_reconstructions[index] = tmp
+            if cache is not None and (n_bootstrap is None or bootstrap_seed is not None):
+                arrays = {'image': tmp[0], 'var': tmp[1], 'bootstrap': tmp[2] if n_bootstrap is not None else None}
+                cache.store_arrays(keys[index], **{name: array for name, array in arrays.items() if array is not None})
+        del computed
+        tmp_images = [tmp[0] for tmp in tmp_reconstructions]
+        tmp_vars = [tmp[1] for tmp in tmp_reconstructions]
+        tmp_bootstraps = [tmp[2] if n_bootstrap is not None else None for tmp in tmp_reconstructions]
+        del tmp_reconstructions
 
+        for index, file in enumerate(files):
             if debug:
-                imshow(box(tmp), norm='log')
+                imshow(box(tmp_images[index]), norm='log')
 
-            tmp_file = os.path.basename(file).replace(".fits", "_ssa.fits")
-            tmp_file = os.path.join(tmp_dir, tmp_file)
-            logger.info("Saving interim SSA reconstruction of cube to {}".format(tmp_file))
-            tmp_file_object = Outfile(tmp_file, data=tmp, verbose=True)
+            # Store temporary reconstructions only if requested
+            if debug or write_tmp_files:
+                tmp_file = os.path.basename(file).replace(".fits", "_ssa.fits")
+                tmp_file = os.path.join(tmp_dir, tmp_file)
+                logger.info("Saving interim SSA reconstruction of cube to {}".format(tmp_file))
+                tmp_file_object = Outfile(tmp_file, data=tmp_images[index], verbose=True)
 
-            # Store variance of temporary reconstruction
-            if tmp_var is not None:
-                tmp_file_object.new_extension(var_ext, data=tmp_var)
-                del tmp_var
-            tmp_files.append(tmp_file)
+                # Store variance of temporary reconstruction
+                if tmp_vars[index] is not None:
+                    tmp_file_object.new_extension(var_ext, data=tmp_vars[index])
 
         # Align tmp reconstructions and add up
-        file_shifts, image_shape = alignment.get_shifts(tmp_files, reference_file=reference_file,
-                                                        return_image_shape=True, lazy_mode=True)
-        pad_vectors, ref_pad_vector = alignment.get_pad_vectors(file_shifts, cube_mode=(len(image_shape) == 3),
-                                                                return_reference_image_pad_vector=True)
-
-        # Iterate over file-wise reconstructions
-        reconstruction = None
-        reconstruction_var = None
-        for index, file in enumerate(tmp_files):
-
-            # Read data
-            with fits.open(file) as hdu_list:
-                tmp_image = hdu_list[0].data
-                if var_ext in hdu_list:
-                    tmp_image_var = hdu_list[var_ext].data
+        if incremental:
+            if state is None:
+                if reference_index is not None:
+                    reference_image = tmp_images[reference_index]
+                else:
+                    reference_image = alignment.load_image(reference_file)
+                    if roi is not None:
+                        reference_image = roi(reference_image)
+                state = SSAState(mode=mode, f_reference_image=fft.rfft2(reference_image),
+                                 image=np.zeros(reference_image.shape), grid=grid)
+            else:
+                reference_index = None
+
+            # Align and add the new tmp reconstructions to the state
+            for index, file in enumerate(files):
+                if index == reference_index:
+                    shift = (0, 0)
                 else:
-                    tmp_image_var = None
-
-            # Initialize or co-add reconstructions and var images
-            if reconstruction is None:
-                reconstruction = alignment.pad_array(tmp_image, pad_vectors[index], mode=mode,
-                                                     reference_image_pad_vector=ref_pad_vector)
-                if tmp_image_var is not None:
-                    reconstruction_var = alignment.pad_array(tmp_image_var, pad_vectors[index], mode=mode,
-                                                             reference_image_pad_vector=ref_pad_vector)
+                    shift = state.get_shift(tmp_images[index])
+                logger.info(f"Identified a shift of {shift} for file {file}")
+                state.add(tmp_images[index], shift=shift, var=tmp_vars[index], file=file)
+            state.save(state_file)
+            files = state.files
+            reconstruction = state.image
+            reconstruction_var = state.var
+        else:
+            if reference_index is not None:
+                reference = reference_index
+            elif roi is not None:
+                reference = roi(alignment.load_image(reference_file))
+            else:
+                reference = reference_file
+            if header_cards is not None:
+                predicted_shifts = alignment.get_predicted_shifts(
+                    files, files[reference_index] if reference_index is not None else reference_file,
+                    alignment.get_header_cards(header_cards), in_dir=in_dir)
+
+                # The header offsets are given in detector pixels, whereas oversampled reconstructions are finer
+                if oversampling is not None:
+                    predicted_shifts = [None if shift is None else tuple(oversampling * x for x in shift)
+                                        for shift in predicted_shifts]
+            else:
+                predicted_shifts = None
+            if cache is not None:
+                params.pop('n_bootstrap')
+                shifts_key = cache.get_key(files=paths + [reference_file], product='ssa_shifts',
+                                           reference=reference_index if reference_index is not None else reference_file,
+                                           alignment_mode=alignment_mode, upsample_factor=upsample_factor,
+                                           header_cards=header_cards, **params)
+                cached = cache.load_arrays(shifts_key)
+            else:
+                cached = None
+            if cached is not None:
+                file_shifts = [tuple(shift) for shift in cached['shifts'].tolist()]
+                image_shape = tuple(cached['image_shape'].tolist())
+            else:
+                file_shifts, image_shape = alignment.get_shifts(tmp_images, reference_file=reference,
+                                                                return_image_shape=True, lazy_mode=True,
+                                                                mode=alignment_mode, upsample_factor=upsample_factor,
+                                                                predicted_shifts=predicted_shifts)
+                if cache is not None:
+                    cache.store_arrays(shifts_key, shifts=np.array(file_shifts), image_shape=np.array(image_shape))
+
+            # Iterate over file-wise reconstructions
+            if mode == 'full':
+                # Accumulate the 'full' field on sparse canvases, which allocate only the tiles that receive data
+                reconstruction = TiledCanvas()
+                reconstruction_var = None
+                for index, tmp_image in enumerate(tmp_images):
+                    reconstruction.add(tmp_image, offset=file_shifts[index])
+                    if tmp_vars[index] is not None:
+                        if reconstruction_var is None:
+                            reconstruction_var = TiledCanvas()
+                        reconstruction_var.add(tmp_vars[index], offset=file_shifts[index], squared=True)
+            elif mode == 'same':
+                # Place the reconstructions at their shifts within the field of the reference image
+                reconstruction = np.zeros(image_shape)
+                reconstruction_var = None
+                for index, tmp_image in enumerate(tmp_images):
+                    alignment.add_shifted(reconstruction, tmp_image, offset=file_shifts[index])
+                    if tmp_vars[index] is not None:
+                        if reconstruction_var is None:
+                            reconstruction_var = np.zeros(image_shape)
+                        alignment.add_shifted(reconstruction_var, tmp_vars[index], offset=file_shifts[index],
+                                              squared=True)
             else:
-                reconstruction += alignment.pad_array(tmp_image, pad_vectors[index], mode=mode,
-                                                      reference_image_pad_vector=ref_pad_vector)
-                if tmp_image_var is not None:
-                    reconstruction_var += alignment.pad_array(tmp_image_var, pad_vectors[index], mode=mode,
-                                                              reference_image_pad_vector=ref_pad_vector)
+                # Allocate only the 'valid' field, which starts at the largest shift, and place the reconstructions
+                # relative to it, such that pixels outside the common overlap are never co-added
+                offsets = np.array(file_shifts) - np.max(file_shifts, axis=0)
+                valid_shape = tuple(np.array(image_shape[-2:]) - np.ceil(np.ptp(file_shifts, axis=0)).astype(int))
+                reconstruction = np.zeros(valid_shape)
+                reconstruction_var = None
+                for index, tmp_image in enumerate(tmp_images):
+                    alignment.add_shifted(reconstruction, tmp_image, offset=offsets[index])
+                    if tmp_vars[index] is not None:
+                        if reconstruction_var is None:
+                            reconstruction_var = np.zeros(valid_shape)
+                        alignment.add_shifted(reconstruction_var, tmp_vars[index], offset=offsets[index], squared=True)
+
+            # Align the bootstrap reconstructions with the same shifts
+            if n_bootstrap is None:
+                bootstrap_reconstructions = None
+            elif mode == 'full':
+                # Accumulate every bootstrap sample on its own canvas, such that the 'full' field remains sparse
+                bootstrap_reconstructions = [TiledCanvas() for _ in range(n_bootstrap)]
+                for index, tmp_bootstrap in enumerate(tmp_bootstraps):
+                    for canvas, sample in zip(bootstrap_reconstructions, tmp_bootstrap):
+                        canvas.add(sample, offset=file_shifts[index])
+            else:
+                bootstrap_reconstructions = np.zeros((n_bootstrap,) + reconstruction.shape)
+                offsets = np.array(file_shifts)
+                if mode == 'valid':
+                    offsets = offsets - np.max(offsets, axis=0)
+                for index, tmp_bootstrap in enumerate(tmp_bootstraps):
+                    alignment.add_shifted(bootstrap_reconstructions, tmp_bootstrap, offset=offsets[index])
     logger.info("Reconstruction finished...")
 
+    # Estimate the uncertainty from the spread of the bootstrap reconstructions
+    if n_bootstrap is not None and isinstance(bootstrap_reconstructions, list):
+        bootstrap_error = TiledCanvas.combine(bootstrap_reconstructions, get_bootstrap_error)
+        del bootstrap_reconstructions
+    elif n_bootstrap is not None:
+        bootstrap_error = get_bootstrap_error(bootstrap_reconstructions)
+        del bootstrap_reconstructions
+    else:
+        bootstrap_error = None
+
     # Save the result to an Outfile
+    if isinstance(outfile, str):
+        outfile = ReconstructionFile(files=files, filename=outfile, in_dir=in_dir, cards={"RECONSTRUCTION": "SSA"})
     if outfile is not None:
-        outfile.data = reconstruction
-        if reconstruction_var is not None:
-            outfile.new_extension(name=var_ext, data=reconstruction_var)
-
-    # Return reconstruction (and the variance map if computed)
+        if isinstance(reconstruction, TiledCanvas):
+            # Write the canvases as dense images or as tiles, if they are too large
+            reconstruction = reconstruction.write(outfile, max_dense_pixels=max_dense_pixels)
+            if reconstruction_var is not None:
+                reconstruction_var = reconstruction_var.write(outfile, name=var_ext, max_dense_pixels=max_dense_pixels)
+        else:
+            outfile.data = reconstruction
+            if reconstruction_var is not None:
+                outfile.new_extension(name=var_ext, data=reconstruction_var)
+        if isinstance(bootstrap_error, TiledCanvas):
+            bootstrap_error = bootstrap_error.write(outfile, name=bootstrap_ext, max_dense_pixels=max_dense_pixels)
+        elif bootstrap_error is not None:
+            outfile.new_extension(name=bootstrap_ext, data=bootstrap_error)
+            outfile.update_header({'BOOTSTRAP SAMPLES': n_bootstrap})
+        if oversampling is not None:
+            outfile.update_header({'OVERSAMPLING': oversampling})
+
+        # Record the frame selection for reproducibility
+        if frame_selection is not None:
+            cards = frame_selection.cards
+            for index, file in enumerate(files):
+                n_frames = -(-CubeInfo(file, in_dir=in_dir).n_frames // time_binning)
+                cards[f"FILE {index} SELECTED"] = frame_selection.get_n_selected(n_frames)
+            outfile.update_header(cards)
+        if frame_tracker is not None:
+            outfile.update_header(frame_tracker.cards)
+        if time_binning > 1:
+            outfile.update_header({'TIME BINNING': time_binning})
+        if roi is not None:
+            outfile.update_header(roi.cards)
+
+    # Assemble the canvases, if they have not been written to an outfile and are not too large
+    if isinstance(reconstruction, TiledCanvas):
+        if max_dense_pixels is None:
+            max_dense_pixels = TiledCanvas.max_dense_pixels
+        if reconstruction.size <= max_dense_pixels:
+            reconstruction = reconstruction.to_array()
+            if reconstruction_var is not None:
+                reconstruction_var = reconstruction_var.to_array()
+            if bootstrap_error is not None:
+                bootstrap_error = bootstrap_error.to_array()
+
+    # Return reconstruction (and the variance and bootstrap error maps if computed)
+    if bootstrap_error is not None:
+        return reconstruction, reconstruction_var, bootstrap_error
     if reconstruction_var is not None:
         return reconstruction, reconstruction_var
     return reconstruction
 
 
-def coadd_frames(cube, var_cube=None, box=None):
+def _coadd_file_with_seed(file_and_seed, **kwargs):
+    """Unpack a (file, seed) tuple for coadd_file(), to map over files with individual seeds."""
+    file, seed = file_and_seed
+    return coadd_file(file, seed=seed, **kwargs)
+
+
+def coadd_file(file, box=None, var_ext='VAR', chunk_size=None, frame_selection=None, frame_tracker=None,
+               n_bootstrap=None, seed=None, oversampling=None, time_binning=None, roi=None):
+    """Compute the SSA reconstruction of the cube in a FITS file.
+
+    Args:
+        file (str):
+            Path to the FITS file.
+        box (Box object, optional):
+            Constraining the search for the intensity peak to the specified box. Passed to coadd_frames().
+        var_ext (str, optional):
+            Name of the variance extension, which is co-added with the same shifts, if present in the file. Variances
+            are ignored if set to None.
+        chunk_size (int, optional):
+            If provided, the cube and variance cube are streamed from the memory-mapped file in chunks of this number of
+            frames. Otherwise the full cube is read at once.
+        frame_selection (FrameSelection, optional):
+            If provided, only the frames selected by this instance are co-added.
+        frame_tracker (FrameTracker, optional):
+            If provided, the frames are aligned by the shifts from this instance instead of their emission peaks.
+        n_bootstrap (int, optional):
+            If provided, this number of bootstrap resamplings of the (selected) frames is co-added as well.
+        seed (int or np.random.SeedSequence, optional):
+            Seed for drawing the bootstrap samples.
+        oversampling (int, optional):
+            If provided, the frames are aligned with sub-pixel precision onto a grid that is finer by this factor, see
+            coadd_frames_oversampled(). Cannot be combined with n_bootstrap.
+        time_binning (int, optional):
+            If provided, this number of consecutive frames and variance frames is co-added before all other stages.
+        roi (ROI, optional):
+            If provided, the frames and variance frames are cropped to this region of interest while reading.
+
+    Returns:
+        coadded (np.ndarray, ndim=2):
+            SSA-integrated frames of the cube.
+        var_coadded (np.ndarray, ndim=2):
+            SSA-integrated variances or None, if the file does not contain a variance extension.
+        bootstrap_coadded (np.ndarray, ndim=3):
+            SSA-integrated bootstrap samples, only returned if n_bootstrap is provided.
+    """
+
+    with fits.open(file) as hdu_list:
+        has_var_ext = var_ext is not None and var_ext in hdu_list
+        if has_var_ext:
+            logger.debug(f"Found variance extension {var_ext} in file {file}")
+        else:
+            logger.debug(f"Did not find variance extension {var_ext} in file {file}")
+
+        # Read the full cubes at once
+        if chunk_size is None:
+            cube, var_cube = hdu_list[0].data, hdu_list[var_ext].data if has_var_ext else None
+            if roi is not None:
+                cube = roi(cube)
+                var_cube = roi(var_cube) if has_var_ext else None
+            cube = bin_frames(cube, time_binning)
+            var_cube = bin_frames(var_cube, time_binning) if has_var_ext else None
+            return _coadd_cube(cube, var_cube=var_cube, box=box, frame_selection=frame_selection,
+                               frame_tracker=frame_tracker, n_bootstrap=n_bootstrap, seed=seed,
+                               oversampling=oversampling)
+
+    # Stream the cubes in chunks
+    with CubeReader(file, chunk_size=chunk_size, time_binning=time_binning, roi=roi) as cube:
+        if has_var_ext:
+            with CubeReader(file, extension=var_ext, chunk_size=chunk_size, time_binning=time_binning,
+                            roi=roi) as var_cube:
+                return _coadd_cube(cube, var_cube=var_cube, box=box, frame_selection=frame_selection,
+                                   frame_tracker=frame_tracker, n_bootstrap=n_bootstrap, seed=seed,
+                                   oversampling=oversampling)
+        else:
+            return _coadd_cube(cube, box=box, frame_selection=frame_selection, frame_tracker=frame_tracker,
+                               n_bootstrap=n_bootstrap, seed=seed, oversampling=oversampling)
+
+
+def _coadd_cube(cube, var_cube=None, box=None, frame_selection=None, frame_tracker=None, n_bootstrap=None, seed=None,
+                oversampling=None):
+    """Select and track frames, draw bootstrap samples and pass a cube to coadd_frames() or
+    coadd_frames_oversampled()."""
+    frame_indizes = frame_selection(cube) if frame_selection is not None else None
+    shifts = frame_tracker(cube, frame_indizes=frame_indizes) if frame_tracker is not None else None
+    if oversampling is not None:
+        return coadd_frames_oversampled(cube, var_cube=var_cube, oversampling=oversampling, box=box,
+                                        frame_indizes=frame_indizes)
+    if n_bootstrap is None:
+        sample_draw_vectors = None
+    else:
+        n_frames = len(frame_indizes) if frame_indizes is not None else len(cube)
+        sample_draw_vectors = get_sample_draw_vectors(n_bootstrap, n_frames, seed=seed)
+    return coadd_frames(cube, var_cube=var_cube, box=box, frame_indizes=frame_indizes,
+                        sample_draw_vectors=sample_draw_vectors, shifts=shifts)
+
+
+def coadd_frames(cube, var_cube=None, box=None, chunk_size=None, frame_indizes=None, sample_draw_vectors=None,
+                 shifts=None):
     """Compute the simple shift-and-add (SSA) reconstruction of a data cube.
 
     This function uses the SSA algorithm to coadd frames of a cube. If provided, this function coadds the variances
     within a var cube considering the exact same shifts.
 
     Args:
-        cube (np.ndarray, ndim=3):
-            Data cube which is integrated along the zero-th axis.
-        var_cube (np.ndarray, ndim=3, optional):
+        cube (np.ndarray or CubeReader, ndim=3):
+            Data cube which is integrated along the zero-th axis. CubeReader instances are streamed in chunks, such
+            that the memory footprint is independent of the number of frames.
+        var_cube (np.ndarray or CubeReader, ndim=3, optional):
             Data cube of variances which is integrated along the zero-th axis with the same shifts as the cube.
         box (Box object, optional):
             Constraining the search for the intensity peak to the specified box. Searching the full frames if not
             provided.
+        chunk_size (int, optional):
+            Number of frames that are processed at once. Arrays are processed at once and CubeReader instances in
+            chunks of their default size, if not provided.
+        frame_indizes (array_like, optional):
+            Indizes of the frames to co-add, for instance from a FrameSelection. The remaining frames are neither
+            searched for peaks nor shifted. All frames are co-added if not provided.
+        sample_draw_vectors (np.ndarray, optional):
+            Bootstrap weights of shape (n_draws, n_frames), with n_frames the number of selected frames, see
+            specklepy.core.bootstrap.get_sample_draw_vectors. If provided, the shifted frames of each chunk are
+            multiplied with the weight matrix, such that all bootstrap samples are co-added within a single pass over
+            the cube.
+        shifts (array_like, optional):
+            Shifts of all frames of the cube, for instance from a FrameTracker. If provided, these are used instead of
+            the shifts from the emission peaks.
 
     Returns:
         coadded (np.ndarray, ndim=2):
             SSA-integrated frames of the input cube.
         var_coadded (np.ndarray, ndim=2):
             SSA-integrated variances of the input cube or the variance map itself if provided as a 2D cube.
+        bootstrap_coadded (np.ndarray, ndim=3):
+            SSA-integrated bootstrap samples of shape (n_draws, *coadded.shape), only returned if sample_draw_vectors
+            are provided.
     """
 
-    if not isinstance(cube, np.ndarray):
-        raise SpecklepyTypeError('coadd_frames()', argname='cube', argtype=type(cube), expected='np.ndarray')
-    if cube.ndim is not 3:
+    if not isinstance(cube, (np.ndarray, CubeReader)):
+        raise SpecklepyTypeError('coadd_frames()', argname='cube', argtype=type(cube),
+                                 expected='np.ndarray or CubeReader')
+    if cube.ndim != 3:
         raise SpecklepyValueError('coadd_frames()', argname='cube.ndim', argvalue=cube.ndim, expected='3')
 
     if var_cube is not None:
-        if not isinstance(var_cube, np.ndarray):
+        if not isinstance(var_cube, (np.ndarray, CubeReader)):
             raise SpecklepyTypeError('coadd_frames()', argname='var_cube', argtype=type(var_cube),
-                                     expected='np.ndarray')
+                                     expected='np.ndarray or CubeReader')
         if var_cube.ndim == cube.ndim and var_cube.shape != cube.shape:
             raise SpecklepyValueError('coadd_frames()', argname='var_cube.shape', argvalue=str(var_cube.shape),
                                       expected=str(cube.shape))
@@ -236,41 +646,324 @@ def coadd_frames(cube, var_cube=None, box=None):
                 raise SpecklepyValueError('coadd_frames()', argname='var_cube.shape', argvalue=str(var_cube.shape),
                                           expected=str(cube.shape))
 
-    # Compute shifts
-    peak_indizes = np.zeros((cube.shape[0], 2), dtype=int)
-    for index, frame in enumerate(cube):
-        if box is not None:
-            frame = box(frame)
-        peak_indizes[index] = np.array(np.unravel_index(np.argmax(frame, axis=None), frame.shape), dtype=int)
+    # Identify the frames to co-add
+    selected = np.zeros(len(cube), dtype=bool)
+    if frame_indizes is None:
+        selected[:] = True
+    else:
+        selected[frame_indizes] = True
 
-    # Compute shifts from indizes
-    peak_indizes = peak_indizes.transpose()
-    xmean, ymean = np.mean(np.array(peak_indizes), axis=1)
-    xmean = int(xmean)
-    ymean = int(ymean)
-    shifts = np.array([xmean - peak_indizes[0], ymean - peak_indizes[1]])
-    shifts = shifts.transpose()
+    if shifts is not None:
+        shifts = np.asarray(shifts)
+        if shifts.shape != (len(cube), 2):
+            raise SpecklepyValueError('coadd_frames()', argname='shifts.shape', argvalue=str(shifts.shape),
+                                      expected=f"({len(cube)}, 2)")
+    else:
+        # Compute shifts
+        peak_indizes = get_peak_indizes(cube, box=box, chunk_size=chunk_size, frame_indizes=frame_indizes)
+
+        # Compute shifts from indizes
+        peak_indizes = peak_indizes.transpose()
+        xmean, ymean = np.mean(np.array(peak_indizes), axis=1)
+        xmean = int(xmean)
+        ymean = int(ymean)
+        shifts = np.zeros((len(cube), 2), dtype=int)
+        shifts[selected] = np.array([xmean - peak_indizes[0], ymean - peak_indizes[1]]).transpose()
 
     # Shift frames and add to coadded
-    coadded = np.zeros(cube[0].shape)
-    pad_vectors, ref_pad_vector = alignment.get_pad_vectors(shifts, cube_mode=False,
-                                                            return_reference_image_pad_vector=True)
-    for index, frame in enumerate(cube):
-        coadded += alignment.pad_array(frame, pad_vectors[index], mode='same',
-                                       reference_image_pad_vector=ref_pad_vector)
+    coadded = np.zeros(cube.shape[-2:])
+    if sample_draw_vectors is None:
+        for start, chunk in iter_chunks(cube, chunk_size=chunk_size):
+            for index, frame in enumerate(chunk):
+                if selected[start + index]:
+                    alignment.add_shifted(coadded, frame, offset=shifts[start + index])
+    else:
+        sample_draw_vectors = np.asarray(sample_draw_vectors)
+        if sample_draw_vectors.ndim != 2 or sample_draw_vectors.shape[1] != np.sum(selected):
+            raise SpecklepyValueError('coadd_frames()', argname='sample_draw_vectors.shape',
+                                      argvalue=str(sample_draw_vectors.shape),
+                                      expected=f"(n_draws, {np.sum(selected)})")
+
+        # Expand the weights to all frames, where frames that are not selected have zero weight
+        weights = np.zeros((sample_draw_vectors.shape[0], len(cube)))
+        weights[:, selected] = sample_draw_vectors
+        bootstrap_coadded = np.zeros((len(weights), coadded.size))
+
+        # Shift the frames of a chunk once and co-add them to all bootstrap samples by a single matrix product
+        if chunk_size is None and isinstance(cube, np.ndarray):
+            chunk_size = 100
+        shifted = None
+        for start, chunk in iter_chunks(cube, chunk_size=chunk_size):
+            if shifted is None or len(shifted) != len(chunk):
+                shifted = np.zeros((len(chunk),) + coadded.shape)
+            else:
+                shifted.fill(0)
+            for index, frame in enumerate(chunk):
+                if selected[start + index]:
+                    alignment.add_shifted(shifted[index], frame, offset=shifts[start + index])
+                    coadded += shifted[index]
+            bootstrap_coadded += weights[:, start: start + len(chunk)] @ shifted.reshape((len(chunk), -1))
+        bootstrap_coadded = bootstrap_coadded.reshape((len(weights),) + coadded.shape)
 
     # Coadd variance cube (if not an image itself)
     if var_cube is not None:
         if var_cube.ndim == 3:
             var_coadded = np.zeros(coadded.shape)
-            for index, frame in enumerate(var_cube):
-                var_coadded += alignment.pad_array(frame, pad_vectors[index], mode='same',
-                                                   reference_image_pad_vector=ref_pad_vector)
+            for start, chunk in iter_chunks(var_cube, chunk_size=chunk_size):
+                for index, frame in enumerate(chunk):
+                    if selected[start + index]:
+                        alignment.add_shifted(var_coadded, frame, offset=shifts[start + index], squared=True)
         elif var_cube.ndim == 2:
-            var_coadded = var_cube
+            var_coadded = var_cube[:]
         else:
             raise RuntimeError(f"var_cube has unexpected shape: {var_cube.shape}")
     else:
         var_coadded = None
 
+    if sample_draw_vectors is not None:
+        return coadded, var_coadded, bootstrap_coadded
+    return coadded, var_coadded
+
+
+def get_peak_indizes(cube, box=None, chunk_size=None, frame_indizes=None):
+    """Identify the coordinates of the intensity peak in every frame of a cube.
+
+    The peaks are searched in batches of frames, by computing the argmax along the flattened frame axes of a chunk.
+
+    Args:
+        cube (np.ndarray or CubeReader, ndim=3):
+            Data cube with the time axis along the zero-th axis.
+        box (Box object, optional):
+            Constraining the search for the intensity peak to the specified box. Searching the full frames if not
+            provided.
+        chunk_size (int, optional):
+            Number of frames that are searched at once. Arrays are searched at once and CubeReader instances in chunks
+            of their default size, if not provided.
+        frame_indizes (array_like, optional):
+            Indizes of the frames to search. All frames are searched if not provided.
+
+    Returns:
+        peak_indizes (np.ndarray, dtype=int):
+            Array of shape (n_frames, 2), containing the peak coordinates of each (selected) frame.
+    """
+
+    if chunk_size is not None and (not isinstance(chunk_size, (int, np.integer)) or chunk_size < 1):
+        raise SpecklepyValueError('get_peak_indizes()', argname='chunk_size', argvalue=chunk_size,
+                                  expected='positive int')
+
+    if frame_indizes is None:
+        selected = np.ones(len(cube), dtype=bool)
+    else:
+        selected = np.zeros(len(cube), dtype=bool)
+        selected[frame_indizes] = True
+
+    peak_indizes = np.zeros((np.sum(selected), 2), dtype=int)
+    position = 0
+    for start, chunk in iter_chunks(cube, chunk_size=chunk_size):
+        if frame_indizes is not None:
+            chunk = chunk[selected[start: start + chunk.shape[0]]]
+            if chunk.shape[0] == 0:
+                continue
+        if box is not None:
+            chunk = box(chunk)
+        frame_shape = chunk.shape[1:]
+        flat_indizes = np.argmax(chunk.reshape((chunk.shape[0], -1)), axis=1)
+        peak_indizes[position: position + chunk.shape[0]] = np.array(np.unravel_index(flat_indizes,
+                                                                                      frame_shape)).transpose()
+        position += chunk.shape[0]
+
+    return peak_indizes
+
+
+def get_subpixel_peaks(cube, box=None, chunk_size=None, frame_indizes=None, method='parabolic'):
+    """Estimate the sub-pixel coordinates of the intensity peak in every frame of a cube.
+
+    The integer peaks are searched as in get_peak_indizes() and refined for all frames of a chunk at once, by fitting
+    the neighbouring pixels along both axes.
+
+    Args:
+        cube (np.ndarray or CubeReader, ndim=3):
+            Data cube with the time axis along the zero-th axis.
+        box (Box object, optional):
+            Constraining the search for the intensity peak to the specified box. Searching the full frames if not
+            provided.
+        chunk_size (int, optional):
+            Number of frames that are searched at once.
+        frame_indizes (array_like, optional):
+            Indizes of the frames to search. All frames are searched if not provided.
+        method (str, optional):
+            Method for the refinement, either 'parabolic' for fitting a parabola through the peak and its direct
+            neighbours along each axis, or 'centroid' for the centroid of the 3x3 pixels around the peak. Default is
+            'parabolic'.
+
+    Returns:
+        peaks (np.ndarray, dtype=float):
+            Array of shape (n_frames, 2), containing the sub-pixel peak coordinates of each (selected) frame.
+    """
+
+    if method not in ['parabolic', 'centroid']:
+        raise SpecklepyValueError('get_subpixel_peaks()', argname='method', argvalue=method,
+                                  expected="'parabolic' or 'centroid'")
+
+    if frame_indizes is None:
+        selected = np.ones(len(cube), dtype=bool)
+    else:
+        selected = np.zeros(len(cube), dtype=bool)
+        selected[frame_indizes] = True
+
+    peaks = np.zeros((np.sum(selected), 2))
+    position = 0
+    for start, chunk in iter_chunks(cube, chunk_size=chunk_size):
+        if frame_indizes is not None:
+            chunk = chunk[selected[start: start + chunk.shape[0]]]
+            if chunk.shape[0] == 0:
+                continue
+        if box is not None:
+            chunk = box(chunk)
+        n_frames, height, width = chunk.shape
+        flat_indizes = np.argmax(chunk.reshape((n_frames, -1)), axis=1)
+        y, x = np.unravel_index(flat_indizes, (height, width))
+        frames = np.arange(n_frames)
+
+        # Gather the 3x3 neighbourhoods of the peaks, with the indizes clipped to the frame borders
+        dy = np.arange(-1, 2).reshape((1, 3, 1))
+        dx = np.arange(-1, 2).reshape((1, 1, 3))
+        window = chunk[frames.reshape((-1, 1, 1)),
+                       np.clip(y.reshape((-1, 1, 1)) + dy, 0, height - 1),
+                       np.clip(x.reshape((-1, 1, 1)) + dx, 0, width - 1)].astype(float)
+
+        if method == 'parabolic':
+            deltas = []
+            for lower, center, upper in [(window[:, 0, 1], window[:, 1, 1], window[:, 2, 1]),
+                                         (window[:, 1, 0], window[:, 1, 1], window[:, 1, 2])]:
+                curvature = lower - 2 * center + upper
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    delta = np.where(curvature < 0, 0.5 * (lower - upper) / curvature, 0.)
+                deltas.append(np.clip(delta, -0.5, 0.5))
+            delta_y, delta_x = deltas
+        else:
+            window -= np.min(window, axis=(1, 2), keepdims=True)
+            total = np.sum(window, axis=(1, 2))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                delta_y = np.where(total > 0, np.sum(window * dy, axis=(1, 2)) / total, 0.)
+                delta_x = np.where(total > 0, np.sum(window * dx, axis=(1, 2)) / total, 0.)
+
+        # Do not extrapolate beyond the frame borders
+        delta_y[(y == 0) | (y == height - 1)] = 0
+        delta_x[(x == 0) | (x == width - 1)] = 0
+
+        peaks[position: position + n_frames, 0] = y + delta_y
+        peaks[position: position + n_frames, 1] = x + delta_x
+        position += n_frames
+
+    return peaks
+
+
+def get_bilinear_splat(shift, oversampling):
+    """Compute the strided slices and weights for splatting a shifted frame onto an oversampled grid.
+
+    The center of pixel i of a frame with sub-pixel shift s is placed at the fine grid coordinate
+    k * (i + s) + (k - 1) / 2, with the oversampling factor k. Since k * i is an integer, the fractional part and
+    thus the bilinear weights are identical for all pixels of a frame. Every one of the four bilinear neighbours
+    hence receives the full frame with a single weight on the strided fine grid `fine[r_y::k, r_x::k]`, placed at an
+    integer offset.
+
+    Args:
+        shift (array_like):
+            Sub-pixel shift of the frame along both axes.
+        oversampling (int):
+            Oversampling factor k of the fine grid.
+
+    Returns:
+        splat (list):
+            List of (residues, offset, weight) tuples, where `residues` are the start indizes of the strided view,
+            `offset` is the integer offset of the frame within that view and `weight` is the bilinear weight.
+    """
+    position = oversampling * np.asarray(shift, dtype=float) + (oversampling - 1) / 2
+    lower = np.floor(position).astype(int)
+    fraction = position - lower
+
+    splat = []
+    for corner_y in (0, 1):
+        for corner_x in (0, 1):
+            corner = lower + (corner_y, corner_x)
+            weight = (fraction[0] if corner_y else 1 - fraction[0]) * (fraction[1] if corner_x else 1 - fraction[1])
+            if weight > 0:
+                offset, residues = np.divmod(corner, oversampling)
+                splat.append((residues, offset, weight))
+    return splat
+
+
+def coadd_frames_oversampled(cube, var_cube=None, oversampling=2, box=None, chunk_size=None, frame_indizes=None,
+                             peak_method='parabolic'):
+    """Compute an oversampled SSA reconstruction of a data cube, aligning the frames with sub-pixel precision.
+
+    In contrast to coadd_frames(), the emission peaks are estimated with sub-pixel precision and every frame is
+    distributed with bilinear weights onto a grid that is finer by the oversampling factor, similar to drizzling. The
+    variances are distributed with the squared weights.
+
+    Args:
+        cube (np.ndarray or CubeReader, ndim=3):
+            Data cube which is integrated along the zero-th axis.
+        var_cube (np.ndarray or CubeReader, ndim=3, optional):
+            Data cube of variances which is integrated along the zero-th axis with the same shifts as the cube.
+        oversampling (int, optional):
+            Oversampling factor of the output grid. Default is 2.
+        box (Box object, optional):
+            Constraining the search for the intensity peak to the specified box.
+        chunk_size (int, optional):
+            Number of frames that are processed at once.
+        frame_indizes (array_like, optional):
+            Indizes of the frames to co-add. All frames are co-added if not provided.
+        peak_method (str, optional):
+            Method for estimating the sub-pixel peaks, see get_subpixel_peaks(). Default is 'parabolic'.
+
+    Returns:
+        coadded (np.ndarray, ndim=2):
+            Oversampled SSA-integrated frames of the input cube.
+        var_coadded (np.ndarray, ndim=2):
+            Oversampled SSA-integrated variances of the input cube or None, if no var_cube is provided.
+    """
+
+    if not isinstance(cube, (np.ndarray, CubeReader)):
+        raise SpecklepyTypeError('coadd_frames_oversampled()', argname='cube', argtype=type(cube),
+                                 expected='np.ndarray or CubeReader')
+    if cube.ndim != 3:
+        raise SpecklepyValueError('coadd_frames_oversampled()', argname='cube.ndim', argvalue=cube.ndim, expected='3')
+    if not isinstance(oversampling, (int, np.integer)) or oversampling < 1:
+        raise SpecklepyValueError('coadd_frames_oversampled()', argname='oversampling', argvalue=oversampling,
+                                  expected='positive int')
+    if var_cube is not None and var_cube.shape != cube.shape:
+        raise SpecklepyValueError('coadd_frames_oversampled()', argname='var_cube.shape',
+                                  argvalue=str(var_cube.shape), expected=str(cube.shape))
+
+    # Identify the frames to co-add
+    selected = np.zeros(len(cube), dtype=bool)
+    if frame_indizes is None:
+        selected[:] = True
+    else:
+        selected[frame_indizes] = True
+
+    # Compute sub-pixel shifts relative to the mean peak position
+    peaks = get_subpixel_peaks(cube, box=box, chunk_size=chunk_size, frame_indizes=frame_indizes, method=peak_method)
+    shifts = np.zeros((len(cube), 2))
+    shifts[selected] = np.mean(peaks, axis=0) - peaks
+    splats = [get_bilinear_splat(shift, oversampling) if selected[index] else None
+              for index, shift in enumerate(shifts)]
+
+    # Splat the frames onto the fine grid
+    fine_shape = tuple(oversampling * np.array(cube.shape[-2:]))
+    coadded = np.zeros(fine_shape)
+    var_coadded = np.zeros(fine_shape) if var_cube is not None else None
+    for target, squared, source in [(coadded, False, cube), (var_coadded, True, var_cube)]:
+        if target is None:
+            continue
+        for start, chunk in iter_chunks(source, chunk_size=chunk_size):
+            for index, frame in enumerate(chunk):
+                if not selected[start + index]:
+                    continue
+                for residues, offset, weight in splats[start + index]:
+                    view = target[residues[0]::oversampling, residues[1]::oversampling]
+                    alignment.add_shifted(view, (weight ** 2 if squared else weight) * frame, offset=offset)
+
     return coadded, var_coadded
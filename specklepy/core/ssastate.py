@@ -0,0 +1,181 @@
+import json
+import numpy as np
+import os
+
+from specklepy.core import alignment
+from specklepy.exceptions import SpecklepyValueError
+from specklepy.logging import logger
+
+
+class SSAState(object):
+
+    """Accumulator state of an SSA reconstruction, which can be extended by further cubes.
+
+    The state holds the un-normalized sum of the aligned interim reconstructions and their variances, the Fourier
+    transformed reference image for aligning further cubes, the bounds of the shifts, the parameters that define the
+    pixel grid and the list of files that have been co-added already. It is stored next to the reconstruction file, such that a later run only needs to align and
+    add new cubes.
+    """
+
+    supported_modes = ['same', 'full']
+
+    # Options of ssa() that cannot be applied to a stored state, which is aligned with integer shifts from its Fourier
+    # transformed reference image and does not keep bootstrap samples
+    unsupported_options = ['n_bootstrap', 'upsample_factor', 'header_cards']
+
+    def __init__(self, mode, f_reference_image, image, var=None, shift_bounds=None, files=None, grid=None):
+        """Create a SSAState instance.
+
+        Args:
+            mode (str):
+                Reconstruction mode, either 'same' or 'full'.
+            f_reference_image (np.ndarray):
+                Fourier transform of the reference image, relative to which the shifts are computed. Either the
+                real-input transform from scipy.fft.rfft2 or the full transform from np.fft.fft2.
+            image (np.ndarray):
+                Un-normalized sum of the aligned images, for instance zeros of the reference image shape for a new
+                state. This is required, since the shape of the real-input transform of the reference image does not
+                match the image shape.
+            var (np.ndarray, optional):
+                Sum of the aligned variance maps.
+            shift_bounds (array_like, optional):
+                Minimum and maximum shifts along both axes, as [[x_min, y_min], [x_max, y_max]]. Default is zeros.
+            files (list, optional):
+                List of files that have been co-added already.
+            grid (dict, optional):
+                Parameters that define the pixel grid of the images, such as the oversampling, the region of interest
+                and the time binning. Further cubes can only be added with the same parameters, which are compared by
+                their string representation. Default is an empty dict.
+        """
+
+        if mode not in self.supported_modes:
+            raise SpecklepyValueError('SSAState', argname='mode', argvalue=mode, expected=f"in {self.supported_modes}")
+
+        self.mode = mode
+        self.f_reference_image = f_reference_image
+        self.image = image
+        self.var = var
+        self.shift_bounds = np.zeros((2, 2), dtype=int) if shift_bounds is None else np.array(shift_bounds, dtype=int)
+        self.files = [] if files is None else list(files)
+        self.grid = {} if grid is None else {name: str(value) for name, value in grid.items()}
+
+    @classmethod
+    def check_options(cls, func, mode, outfile, **options):
+        """Check that the options of a reconstruction are available in incremental mode.
+
+        Args:
+            func (str):
+                Name of the calling function, for the error messages.
+            mode (str):
+                Reconstruction mode, which needs to be in the supported_modes attribute.
+            outfile (str or ReconstructionFile):
+                Outfile of the reconstruction, next to which the state is stored.
+            **options:
+                Further options of the reconstruction. Those in the unsupported_options attribute need to be None.
+
+        Raises:
+            SpecklepyValueError:
+                If any of the options is not available in incremental mode.
+        """
+        if mode not in cls.supported_modes:
+            raise SpecklepyValueError(func, argname='mode', argvalue=mode,
+                                      expected=f"in {cls.supported_modes} in incremental mode")
+        if outfile is None:
+            raise SpecklepyValueError(func, argname='outfile', argvalue=outfile,
+                                      expected='provided in incremental mode')
+        for name in cls.unsupported_options:
+            if options.get(name) is not None:
+                raise SpecklepyValueError(func, argname=name, argvalue=options[name],
+                                          expected='None in incremental mode')
+
+    def check_grid(self, func, **grid):
+        """Check that the pixel grid parameters of a reconstruction match those of the state.
+
+        Raises:
+            SpecklepyValueError:
+                If any of the parameters differs from the value stored in the state.
+        """
+        for name, value in grid.items():
+            if self.grid.get(name) != str(value):
+                raise SpecklepyValueError(func, argname=name, argvalue=value,
+                                          expected=f"{self.grid.get(name)} as in the stored state")
+
+    @staticmethod
+    def get_state_file(file_path):
+        """Derive the name of the state file that belongs to a reconstruction file."""
+        root, ext = os.path.splitext(file_path)
+        return root + '_state.npz'
+
+    @classmethod
+    def load(cls, file):
+        """Load a SSAState instance from a state file."""
+        logger.info(f"Loading SSA state from {file}")
+        with np.load(file) as state:
+            var = state['var'] if 'var' in state else None
+            return cls(mode=str(state['mode']), f_reference_image=state['f_reference_image'], image=state['image'],
+                       var=var, shift_bounds=state['shift_bounds'], files=state['files'].tolist(),
+                       grid=json.loads(str(state['grid'])))
+
+    def save(self, file):
+        """Save the state to a file."""
+        logger.info(f"Saving SSA state to {file}")
+        arrays = {'mode': self.mode, 'f_reference_image': self.f_reference_image, 'image': self.image,
+                  'shift_bounds': self.shift_bounds, 'files': np.array(self.files, dtype=str),
+                  'grid': json.dumps(self.grid)}
+        if self.var is not None:
+            arrays['var'] = self.var
+        with open(file, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @property
+    def reference_shape(self):
+        """Shape of the reference image, that is the canvas shape without the expansion by the shifts."""
+        return tuple(np.array(self.image.shape) - self.shift_bounds[1] + self.shift_bounds[0])
+
+    def get_shift(self, image):
+        """Estimate the shift of an image relative to the reference image."""
+        return alignment.get_shift(image, reference_image=self.f_reference_image, is_fourier_transformed=True)
+
+    def add(self, image, shift, var=None, file=None):
+        """Co-add an image with the given shift, growing the canvas in 'full' mode if necessary.
+
+        Args:
+            image (np.ndarray):
+                Image to co-add.
+            shift (tuple):
+                Shift of the image relative to the reference image.
+            var (np.ndarray, optional):
+                Variance map of the image.
+            file (str, optional):
+                Name of the file, that the image was derived from.
+        """
+
+        if self.mode == 'full':
+            self._expand(shift)
+            offset = np.array(shift) - self.shift_bounds[0]
+        else:
+            offset = shift
+
+        alignment.add_shifted(self.image, image, offset=offset)
+        if var is not None:
+            if self.var is None:
+                self.var = np.zeros(self.image.shape)
+            alignment.add_shifted(self.var, var, offset=offset, squared=True)
+
+        if file is not None:
+            self.files.append(file)
+
+    def _expand(self, shift):
+        """Expand the canvas to cover an image with the given shift."""
+        lower = np.minimum(self.shift_bounds[0], shift)
+        upper = np.maximum(self.shift_bounds[1], shift)
+        if np.array_equal(lower, self.shift_bounds[0]) and np.array_equal(upper, self.shift_bounds[1]):
+            return
+
+        logger.info(f"Expanding the SSA canvas to shift bounds {lower.tolist()} and {upper.tolist()}")
+        shape = tuple(np.array(self.reference_shape) + upper - lower)
+        offset = self.shift_bounds[0] - lower
+        self.image = alignment.add_shifted(np.zeros(shape), self.image, offset=offset)
+        if self.var is not None:
+            self.var = alignment.add_shifted(np.zeros(shape), self.var, offset=offset)
+        self.shift_bounds = np.array([lower, upper])
@@ -60,6 +60,59 @@ class GeneralArgParser(object):
         parser_ssa.add_argument('-b', '--box_indexes', type=int, nargs=4, default=None,
                                 help='Coordinates of a box constraining the search of the emission peak for frame '
                                      'alignment. Provide as a list [x_min, x_max, y_min, y_max].')
+        parser_ssa.add_argument('-c', '--chunk_size', type=int, default=None,
+                                help='Stream the cubes from memory-mapped files in chunks of this number of frames, '
+                                     'instead of reading the full cubes into memory.')
+        parser_ssa.add_argument('-j', '--jobs', type=int, default=1,
+                                help='Number of worker processes for reconstructing the cubes in parallel. Use -1 for '
+                                     'all CPUs.')
+        parser_ssa.add_argument('-s', '--selection', type=str, default=None,
+                                choices=['peak', 'peak_flux_ratio', 'sharpness'],
+                                help='Co-add only the best frames of each cube, scored by this metric.')
+        parser_ssa.add_argument('-f', '--fraction', type=float, default=1.0,
+                                help='Fraction of the best frames to co-add, if a selection metric is provided.')
+        parser_ssa.add_argument('-i', '--incremental', action='store_true',
+                                help='Store the accumulator state next to the output file and add only cubes that are '
+                                     'not part of a previous reconstruction.')
+        parser_ssa.add_argument('--bootstrap', type=int, default=None,
+                                help='Number of bootstrap resamplings of the frames for estimating an error map.')
+        parser_ssa.add_argument('--seed', type=int, default=None,
+                                help='Seed for drawing the bootstrap samples.')
+        parser_ssa.add_argument('--oversampling', type=int, default=None,
+                                help='Align the frames on sub-pixel peaks and co-add them onto a grid that is finer by '
+                                     'this factor.')
+        parser_ssa.add_argument('-u', '--upsample', type=int, default=None,
+                                help='Estimate the shifts between the cubes with a precision of 1/UPSAMPLE pixels.')
+        parser_ssa.add_argument('-a', '--alignment', type=str, default='correlation',
+                                choices=['correlation', 'peak', 'pyramid', 'global'],
+                                help='Mode for estimating the shifts between the cubes. The pyramid mode is faster for '
+                                     'large frames with small shifts. The global mode correlates neighbouring cubes '
+                                     'and is more robust for wide dither patterns.')
+        parser_ssa.add_argument('--offsets', type=str, default=None,
+                                help='Name of the instrument in config/instruments.cfg, whose telescope offset header '
+                                     'cards predict the shifts between the cubes. The correlation is then searched '
+                                     'only around the predictions.')
+        parser_ssa.add_argument('--tracking', action='store_true',
+                                help='Align the frames within each cube by their correlation with a running reference '
+                                     'instead of their emission peaks. This is more robust against bright companions.')
+        parser_ssa.add_argument('--binning', type=int, default=None,
+                                help='Co-add this number of consecutive frames while reading the cubes, for cubes that '
+                                     'are oversampled in time relative to the speckle coherence time.')
+        parser_ssa.add_argument('--roi', type=int, nargs=4, default=None,
+                                help='Crop the cubes to this region of interest [x_min, x_max, y_min, y_max] while '
+                                     'reading, such that all later stages scale with the region instead of the '
+                                     'detector. The box indexes then refer to the cropped frames.')
+        parser_ssa.add_argument('--cache', action='store_true',
+                                help='Reuse the reconstructions of unchanged cubes and the shifts between them from a '
+                                     'cache in the tmp directory.')
+        parser_ssa.add_argument('--follow', action='store_true',
+                                help='Quicklook mode: Follow the first file while frames are appended and update a '
+                                     'running SSA image in the output file.')
+        parser_ssa.add_argument('--update_every', type=int, default=10,
+                                help='Number of frames between updates of the quicklook image (with --follow).')
+        parser_ssa.add_argument('--timeout', type=float, default=30.,
+                                help='Stop following the file after this number of seconds without new frames (with '
+                                     '--follow).')
         parser_ssa.add_argument('-o', '--outfile', type=str, default='ssa.fits', help='Name of the output file.')
         parser_ssa.add_argument('-t', '--tmpdir', type=str, default='tmp/', help='Path for saving temporary files.')
         parser_ssa.add_argument('-d', '--debug', action='store_true', help='show debugging information.')
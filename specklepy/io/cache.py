@@ -0,0 +1,252 @@
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+
+from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
+from specklepy.logging import logger
+
+
+class FileCache(object):
+
+    """Content-addressed cache for intermediate products of reconstructions.
+
+    Every entry is a directory in the cache directory, named by a hash of the identity of the input files and of the
+    parameters that the product depends on. The identity of a file is its absolute path, size and modification time,
+    or a checksum of its content. Entries are only valid after they have been completed, such that interrupted runs do
+    not leave corrupted products behind. When the cache grows beyond its maximum size, the least recently used entries
+    are evicted.
+    """
+
+    default_max_size = 10 * 2 ** 30
+    complete_marker = '.complete'
+    arrays_file = 'arrays.npz'
+    memmap_file = 'memmap.npy'
+
+    def __init__(self, cache_dir, max_size=None, checksum=False):
+        """Create a FileCache instance.
+
+        Args:
+            cache_dir (str):
+                Path to the cache directory, which is created if it does not exist.
+            max_size (int, optional):
+                Maximum size of the cache in bytes. Defaults to the default_max_size attribute of 10 GiB.
+            checksum (bool, optional):
+                Identify input files by a checksum of their content instead of their size and modification time.
+                Default is False.
+        """
+
+        # Check input parameters
+        if not isinstance(cache_dir, str):
+            raise SpecklepyTypeError('FileCache', argname='cache_dir', argtype=type(cache_dir), expected='str')
+        if max_size is None:
+            max_size = self.default_max_size
+        elif not isinstance(max_size, (int, float)) or max_size < 0:
+            raise SpecklepyValueError('FileCache', argname='max_size', argvalue=max_size,
+                                      expected='non-negative number')
+
+        # Store attributes
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.checksum = checksum
+        if not os.path.isdir(self.cache_dir):
+            logger.info(f"Creating cache directory {self.cache_dir}")
+            os.makedirs(self.cache_dir)
+
+    def __contains__(self, key):
+        return os.path.isfile(os.path.join(self.get_entry_dir(key), self.complete_marker))
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get_file_identity(self, file):
+        """Identify a file by its absolute path and either its size and modification time or a checksum."""
+        path = os.path.abspath(file)
+        if self.checksum:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(2 ** 20), b''):
+                    digest.update(block)
+            return [path, digest.hexdigest()]
+        stat = os.stat(path)
+        return [path, stat.st_size, stat.st_mtime_ns]
+
+    def get_key(self, files=None, **params):
+        """Compute the key of a product from its input files and parameters.
+
+        Args:
+            files (list, optional):
+                Paths of the input files.
+            **params:
+                Parameters that the product depends on. Values are hashed by their string representation.
+
+        Returns:
+            key (str):
+                Hexadecimal hash of the file identities and parameters.
+        """
+        files = [] if files is None else files
+        identity = {'files': [self.get_file_identity(file) for file in files],
+                    'params': {name: str(value) for name, value in sorted(params.items())}}
+        return hashlib.sha256(json.dumps(identity).encode()).hexdigest()
+
+    def touch(self, key):
+        """Mark an entry as recently used."""
+        os.utime(os.path.join(self.get_entry_dir(key), self.complete_marker))
+
+    def store_files(self, key, files):
+        """Copy files into a new entry of the cache.
+
+        Args:
+            key (str):
+                Key of the entry.
+            files (list):
+                Paths of the files to store. The files are stored by their base names.
+        """
+        entry_dir = self._new_entry(key)
+        names = [os.path.basename(file) for file in files]
+        for file, name in zip(files, names):
+            shutil.copy2(file, os.path.join(entry_dir, name))
+        self.complete(key, names=names)
+
+    def restore_files(self, key, out_dir):
+        """Copy the files of an entry into a directory.
+
+        Args:
+            key (str):
+                Key of the entry.
+            out_dir (str):
+                Directory to copy the files into.
+
+        Returns:
+            files (list or None):
+                Paths of the restored files, in the order in which they were stored, or None if the key is not in the
+                cache.
+        """
+        if key not in self:
+            return None
+        logger.info(f"Restoring cached files of entry {key[:12]} to {out_dir}")
+        self.touch(key)
+        if out_dir and not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        entry_dir = self.get_entry_dir(key)
+        with open(os.path.join(entry_dir, self.complete_marker)) as f:
+            names = json.load(f)
+        return [shutil.copy2(os.path.join(entry_dir, name), os.path.join(out_dir, name)) for name in names]
+
+    def store_arrays(self, key, **arrays):
+        """Store arrays in a new entry of the cache."""
+        entry_dir = self._new_entry(key)
+        with open(os.path.join(entry_dir, self.arrays_file), 'wb') as f:
+            np.savez(f, **arrays)
+        self.complete(key)
+
+    def load_arrays(self, key):
+        """Load the arrays of an entry.
+
+        Returns:
+            arrays (dict or None):
+                Dictionary of the arrays, or None if the key is not in the cache.
+        """
+        if key not in self:
+            return None
+        logger.info(f"Loading cached arrays of entry {key[:12]}")
+        self.touch(key)
+        with np.load(os.path.join(self.get_entry_dir(key), self.arrays_file)) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+
+    def create_memmap(self, key, shape, dtype):
+        """Create a new entry with a memory-mapped array, which is filled by the caller.
+
+        The entry remains incomplete until complete() is called, such that partially filled arrays are never loaded.
+
+        Args:
+            key (str):
+                Key of the entry.
+            shape (tuple):
+                Shape of the array.
+            dtype (np.dtype or str):
+                Data type of the array.
+
+        Returns:
+            memmap (np.memmap):
+                Writable memory-mapped array in the cache directory.
+        """
+        entry_dir = self._new_entry(key)
+        return np.lib.format.open_memmap(os.path.join(entry_dir, self.memmap_file), mode='w+', dtype=dtype,
+                                         shape=shape)
+
+    def load_memmap(self, key):
+        """Load the memory-mapped array of an entry read-only.
+
+        Returns:
+            memmap (np.memmap or None):
+                Memory-mapped array, or None if the key is not in the cache.
+        """
+        if key not in self:
+            return None
+        logger.info(f"Loading cached memory-mapped array of entry {key[:12]}")
+        self.touch(key)
+        return np.load(os.path.join(self.get_entry_dir(key), self.memmap_file), mmap_mode='r')
+
+    def open_memmap(self, key):
+        """Open the memory-mapped array of an entry for writing, for instance from worker processes that fill disjoint
+        parts of an array created by create_memmap()."""
+        return np.load(os.path.join(self.get_entry_dir(key), self.memmap_file), mmap_mode='r+')
+
+    def _new_entry(self, key):
+        """Create an empty, incomplete entry, replacing an existing one."""
+        entry_dir = self.get_entry_dir(key)
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.makedirs(entry_dir)
+        return entry_dir
+
+    def complete(self, key, names=None, evict=True):
+        """Mark an entry as complete, with the list of its file names, and evict old entries if the cache exceeds its
+        maximum size. Eviction may be deferred, when completing several entries at once, by passing evict=False."""
+        with open(os.path.join(self.get_entry_dir(key), self.complete_marker), 'w') as f:
+            json.dump(names if names is not None else [], f)
+        if evict:
+            self.evict(keep=key)
+
+    @property
+    def entries(self):
+        """Dictionary of the sizes and last access times of the entries, keyed by their keys."""
+        entries = {}
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self.get_entry_dir(key)
+            if not os.path.isdir(entry_dir):
+                continue
+            sizes = [os.path.getsize(os.path.join(entry_dir, file)) for file in os.listdir(entry_dir)]
+            marker = os.path.join(entry_dir, self.complete_marker)
+            accessed = os.path.getmtime(marker) if os.path.isfile(marker) else -np.inf
+            entries[key] = (sum(sizes), accessed)
+        return entries
+
+    @property
+    def size(self):
+        """Total size of the cache in bytes."""
+        return sum(size for size, _ in self.entries.values())
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache does not exceed its maximum size.
+
+        Incomplete entries are removed first.
+
+        Args:
+            keep (str or list, optional):
+                Key or list of keys of entries that shall not be evicted, for instance the ones that have just been
+                stored.
+        """
+        keep = [keep] if isinstance(keep, str) else keep or []
+        entries = self.entries
+        total = sum(size for size, _ in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k][1]):
+            if total <= self.max_size:
+                break
+            if key in keep:
+                continue
+            logger.info(f"Evicting cache entry {key[:12]} of {entries[key][0]} bytes")
+            shutil.rmtree(self.get_entry_dir(key))
+            total -= entries[key][0]
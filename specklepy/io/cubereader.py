@@ -0,0 +1,295 @@
+import numpy as np
+import os
+
+from astropy.io import fits
+
+from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
+from specklepy.logging import logger
+
+
+class CubeReader(object):
+
+    """Chunked access to the frames of a FITS data cube.
+
+    The file is opened memory-mapped and frames are only read from disk on request, through the `section` attribute of
+    the HDU. This keeps the memory footprint of a reader at the size of the requested frames, independent of the number
+    of frames in the cube. Instances can be sliced along the time axis like a numpy array.
+
+    Optionally, every `time_binning` consecutive frames are co-added while reading, such that the reader appears as a
+    cube with correspondingly fewer frames to downstream stages. The last bin may contain fewer frames. Similarly, the
+    frames can be cropped to a region of interest, such that only the pixels within the region are read from disk.
+    """
+
+    def __init__(self, file, extension=0, in_dir=None, chunk_size=None, time_binning=None, roi=None):
+        """Create a CubeReader instance.
+
+        Args:
+            file (str):
+                Name of the FITS file.
+            extension (int or str, optional):
+                Index or name of the extension containing the cube. Default is 0.
+            in_dir (str, optional):
+                Path to the file.
+            chunk_size (int, optional):
+                Default number of (binned) frames per chunk when iterating over the cube. Default is 100.
+            time_binning (int, optional):
+                Number of consecutive frames that are co-added into one frame while reading. Default is None, which
+                does not bin the frames.
+            roi (ROI, optional):
+                Region of interest, to which the frames are cropped while reading. Default is None, which reads the
+                full frames.
+        """
+
+        # Check input parameters
+        if not isinstance(file, str):
+            raise SpecklepyTypeError('CubeReader', argname='file', argtype=type(file), expected='str')
+        if chunk_size is None:
+            chunk_size = 100
+        elif not isinstance(chunk_size, (int, np.integer)) or chunk_size < 1:
+            raise SpecklepyValueError('CubeReader', argname='chunk_size', argvalue=chunk_size, expected='positive int')
+        time_binning = check_time_binning(time_binning, 'CubeReader')
+
+        # Store attributes
+        self.file = file if in_dir is None else os.path.join(in_dir, file)
+        self.extension = extension
+        self.chunk_size = chunk_size
+        self.time_binning = time_binning
+        self.roi = roi
+
+        # Open the file without reading the data
+        self.hdu_list = fits.open(self.file, memmap=True)
+        self.hdu = self.hdu_list[extension]
+        self.raw_shape = get_shape(self.hdu.header)
+        self.shape = self.raw_shape
+        if time_binning > 1 and len(self.raw_shape) == 3:
+            self.shape = (-(-self.raw_shape[0] // time_binning),) + self.shape[1:]
+        if roi is not None:
+            self.shape = self.shape[:-2] + roi.get_shape(self.raw_shape[-2:])
+        logger.debug(f"Opened cube {self.file}[{extension}] of shape {self.shape} for chunked reading")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        if self.shape == self.raw_shape:
+            return self.hdu.section[item]
+        if self.ndim == 2:
+            return self.hdu.section[self.roi.slices][item]
+
+        # Map the binned frames to ranges of raw frames
+        item, rest = (item[0], item[1:]) if isinstance(item, tuple) else (item, ())
+        indizes = np.arange(len(self))[item]
+        if indizes.ndim == 0:
+            binned = self._read_bins(int(indizes), int(indizes) + 1)[0]
+        elif len(indizes) > 0 and np.all(np.diff(indizes) == 1):
+            binned = self._read_bins(indizes[0], indizes[-1] + 1)
+        else:
+            binned = np.array([self._read_bins(index, index + 1)[0] for index in indizes]).reshape(
+                (len(indizes),) + self.frame_shape)
+        if len(rest) == 0:
+            return binned
+        return binned[rest] if indizes.ndim == 0 else binned[(slice(None),) + rest]
+
+    def _read_bins(self, start, stop):
+        """Read and co-add the raw frames of the bins from start to stop, within the region of interest."""
+        frames = slice(start * self.time_binning, min(stop * self.time_binning, self.raw_shape[0]))
+        if self.roi is not None:
+            frames = self.hdu.section[(frames,) + self.roi.slices]
+        else:
+            frames = self.hdu.section[frames]
+        return bin_frames(frames, self.time_binning)
+
+    def __iter__(self):
+        for start, chunk in self.iter_chunks():
+            for frame in chunk:
+                yield frame
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def n_frames(self):
+        return self.shape[0]
+
+    @property
+    def frame_shape(self):
+        return self.shape[-2:]
+
+    def iter_chunks(self, chunk_size=None):
+        """Iterate over the cube in chunks of frames.
+
+        Args:
+            chunk_size (int, optional):
+                Number of frames per chunk. Defaults to the `chunk_size` attribute of the instance.
+
+        Yields:
+            start (int):
+                Index of the first frame in the chunk.
+            chunk (np.ndarray):
+                Frames of the chunk.
+        """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        for start in range(0, self.n_frames, chunk_size):
+            yield start, self[start: start + chunk_size]
+
+    def close(self):
+        self.hdu_list.close()
+
+
+class CubeInfo(object):
+
+    """Metadata of a FITS image or data cube, probed from the header without reading the pixel data.
+
+    The shape is derived from the NAXISn cards and the data type from the BITPIX card, taking into account the scaling
+    by the BZERO and BSCALE cards. This allows to set up reconstructions from the metadata of large cubes before any
+    frame is read from disk.
+    """
+
+    def __init__(self, file, extension=0, in_dir=None):
+        """Create a CubeInfo instance.
+
+        Args:
+            file (str):
+                Name of the FITS file.
+            extension (int or str, optional):
+                Index or name of the extension containing the image or cube. Default is 0.
+            in_dir (str, optional):
+                Path to the file.
+        """
+
+        # Check input parameters
+        if not isinstance(file, str):
+            raise SpecklepyTypeError('CubeInfo', argname='file', argtype=type(file), expected='str')
+
+        # Read only the header
+        self.file = file if in_dir is None else os.path.join(in_dir, file)
+        self.extension = extension
+        header = fits.getheader(self.file, extension)
+        self.shape = get_shape(header)
+        self.dtype = get_dtype(header)
+        if self.ndim not in [2, 3]:
+            raise SpecklepyValueError('CubeInfo', argname='ndim', argvalue=self.ndim, expected='2 or 3')
+
+    def __len__(self):
+        return self.n_frames
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def n_frames(self):
+        """Number of frames, which is 1 for a single image."""
+        return self.shape[0] if self.ndim == 3 else 1
+
+    @property
+    def frame_shape(self):
+        return self.shape[-2:]
+
+    @property
+    def nbytes(self):
+        """Size of the data in bytes, once read into memory."""
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+
+def check_time_binning(time_binning, func):
+    """Check a time binning parameter and substitute None by 1."""
+    if time_binning is None:
+        return 1
+    if not isinstance(time_binning, (int, np.integer)) or time_binning < 1:
+        raise SpecklepyValueError(func, argname='time_binning', argvalue=time_binning, expected='positive int')
+    return int(time_binning)
+
+
+def bin_frames(cube, time_binning=None):
+    """Co-add every `time_binning` consecutive frames of a cube.
+
+    The frames are summed, such that variance cubes are binned by the same function. Integer data are promoted to a
+    floating point type to avoid overflows.
+
+    Args:
+        cube (np.ndarray):
+            Data cube with the time axis along the zero-th axis. Images with two axes are returned unchanged.
+        time_binning (int, optional):
+            Number of frames per bin. The last bin may contain fewer frames. Default is None, which returns the cube
+            unchanged.
+
+    Returns:
+        binned (np.ndarray):
+            Cube of the binned frames.
+    """
+    time_binning = check_time_binning(time_binning, 'bin_frames()')
+    if time_binning == 1 or cube.ndim != 3:
+        return cube
+    dtype = np.promote_types(cube.dtype, np.float32)
+    return np.add.reduceat(cube, np.arange(0, len(cube), time_binning), axis=0, dtype=dtype)
+
+
+def get_shape(header):
+    """Derive the shape of the data of a FITS HDU from the NAXISn cards of its header.
+
+    Args:
+        header (fits.Header):
+            Header of the HDU.
+
+    Returns:
+        shape (tuple):
+            Shape of the data in numpy order, i.e. with NAXIS1 along the last axis.
+    """
+    return tuple(header[f"NAXIS{axis}"] for axis in range(header['NAXIS'], 0, -1))
+
+
+def get_dtype(header):
+    """Derive the data type of a FITS HDU from the BITPIX, BZERO and BSCALE cards of its header.
+
+    The data type follows the conventions of astropy for scaled data: Integers with a BZERO of 2**(BITPIX-1) are
+    unsigned and other scaled integers become floats.
+
+    Args:
+        header (fits.Header):
+            Header of the HDU.
+
+    Returns:
+        dtype (np.dtype):
+            Data type of the data, as it is returned by astropy.
+    """
+    bitpix = header['BITPIX']
+    if bitpix < 0:
+        return np.dtype(f"float{-bitpix}")
+    bzero = header.get('BZERO', 0)
+    bscale = header.get('BSCALE', 1)
+    if bscale == 1 and bzero == 0:
+        return np.dtype('uint8' if bitpix == 8 else f"int{bitpix}")
+    if bscale == 1 and bitpix > 8 and bzero == 2 ** (bitpix - 1):
+        return np.dtype(f"uint{bitpix}")
+    return np.dtype('float32' if bitpix <= 16 else 'float64')
+
+
+def iter_chunks(cube, chunk_size=None):
+    """Iterate over a cube in chunks of frames.
+
+    Args:
+        cube (np.ndarray or CubeReader):
+            Data cube with the time axis along the zero-th axis.
+        chunk_size (int, optional):
+            Number of frames per chunk. Arrays are returned as a single chunk and CubeReader instances in chunks of
+            their default size, if not provided.
+
+    Yields:
+        start (int):
+            Index of the first frame in the chunk.
+        chunk (np.ndarray):
+            Frames of the chunk.
+    """
+    if chunk_size is None:
+        chunk_size = cube.chunk_size if isinstance(cube, CubeReader) else max(len(cube), 1)
+    for start in range(0, len(cube), chunk_size):
+        yield start, cube[start: start + chunk_size]
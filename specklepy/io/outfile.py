@@ -210,6 +210,22 @@ class Outfile(object):
                 hdu_list.insert(index=index, hdu=hdu)
             hdu_list.flush()
 
+    def update_header(self, cards, extension=None):
+        """Set header cards, preceded by the header card prefix of the instance.
+
+        Args:
+            cards (dict):
+                Dictionary of cards that will be added to the fits header.
+            extension (int or str, optional):
+                Index or name of the extension. Default is the primary HDU.
+        """
+        if extension is None:
+            extension = 0
+        with fits.open(self.file_path, mode='update') as hdu_list:
+            for key in cards:
+                hdu_list[extension].header.set(self.header_card_prefix + key, cards[key])
+            hdu_list.flush()
+
     def update_extension(self, ext_name, data):
         if self.verbose:
             logger.info(f"Updating data in {self.file_path}[{ext_name}]")
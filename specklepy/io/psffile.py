@@ -11,7 +11,7 @@ class PSFFile(Outfile):
 
     """Outfile with some default parameters and init behaviour for PSF files."""
 
-    def __init__(self, in_file, out_dir, frame_shape, in_dir=None, cards=None, header_card_prefix=None):
+    def __init__(self, in_file, out_dir, frame_shape, in_dir=None, cards=None, header_card_prefix=None, n_frames=None):
         """Create a PSFFile instance.
 
         Args:
@@ -26,6 +26,8 @@ class PSFFile(Outfile):
             cards (dict, optional):
                 Dictionary of header cards.
             header_card_prefix (str, optional):
+            n_frames (int, optional):
+                Number of PSF frames. Derived from the header of the parent file if not provided.
         """
 
         # Create PSF directory, if not existing yet
@@ -57,11 +59,13 @@ class PSFFile(Outfile):
         cards["FILE NAME"] = os.path.basename(in_file)
 
         # Derive data shape
-        if in_dir is not None:
-            hdr_input = fits.getheader(os.path.join(in_dir, in_file))
-        else:
-            hdr_input = fits.getheader(in_file)
-        shape = (hdr_input['NAXIS3'], frame_shape[0], frame_shape[1])
+        if n_frames is None:
+            if in_dir is not None:
+                hdr_input = fits.getheader(os.path.join(in_dir, in_file))
+            else:
+                hdr_input = fits.getheader(in_file)
+            n_frames = hdr_input['NAXIS3']
+        shape = (n_frames, frame_shape[0], frame_shape[1])
 
         super().__init__(filename=out_file, path=out_dir, shape=shape, cards=cards,
                          header_card_prefix=header_card_prefix)
@@ -4,15 +4,19 @@ import os
 
 from specklepy.core import analysis
 from specklepy.core.holography import holography
+from specklepy.core.quicklook import QuickLook
 from specklepy.core.sourceextraction import extract_sources
 from specklepy.core.ssa import ssa
 from specklepy.io.argparser import GeneralArgParser
+from specklepy.io.cache import FileCache
 from specklepy.io import config
 from specklepy.logging import logger
 from specklepy.plotting.plot import Plot
 from specklepy.reduction import run
 from specklepy.synthetic.generate_exposure import generate_exposure, get_objects
+from specklepy.utils.box import Box
 from specklepy.utils.resolution import get_resolution_parameters
+from specklepy.utils.roi import ROI
 from specklepy.gui.window import start
 
 
@@ -47,12 +51,25 @@ def main():
             params = config.read(args.parfile)
             run.full_reduction(params, debug=args.debug)
 
+    elif args.command is 'ssa' and args.follow:
+
+        # Update a running SSA reconstruction while the cube is growing
+        box = Box(args.box_indexes) if args.box_indexes is not None else None
+        quicklook = QuickLook(args.files[0], out_file=args.outfile, update_every=args.update_every, box=box)
+        quicklook.follow(timeout=args.timeout)
+
     elif args.command is 'ssa':
 
         # Prepare path information and execute reconstruction
         if args.tmpdir is not None and not os.path.isdir(args.tmpdir):
             os.mkdir(args.tmpdir)
+        cache = FileCache(os.path.join(args.tmpdir, 'cache')) if args.cache else None
         ssa(args.files, mode=args.mode, tmp_dir=args.tmpdir, outfile=args.outfile, box_indexes=args.box_indexes,
+            chunk_size=args.chunk_size, n_jobs=args.jobs, selection_method=args.selection,
+            selection_fraction=args.fraction, incremental=args.incremental, n_bootstrap=args.bootstrap,
+            bootstrap_seed=args.seed, oversampling=args.oversampling, upsample_factor=args.upsample,
+            alignment_mode=args.alignment, header_cards=args.offsets, frame_tracking=args.tracking,
+            cache=cache, time_binning=args.binning, roi=ROI(args.roi) if args.roi is not None else None,
             debug=args.debug)
 
     elif args.command is 'holography':
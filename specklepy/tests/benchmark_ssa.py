@@ -0,0 +1,37 @@
+"""Benchmark of the SSA co-addition against the reference implementation, which pads every frame.
+
+Run with `python -m specklepy.tests.benchmark_ssa [n_frames] [frame_size]`. Default is a cube of 200x512x512 frames.
+"""
+
+import sys
+import time
+import numpy as np
+
+from specklepy.core.ssa import coadd_frames
+from specklepy.tests.test_ssa import coadd_frames_padded
+
+
+def best_of(func, *args, repeat=3):
+    """Best wall-clock time of a number of function calls in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(n_frames=200, frame_size=512):
+    rng = np.random.default_rng(seed=1)
+    cube = rng.random((n_frames, frame_size, frame_size), dtype=np.float32)
+    peaks = rng.integers(low=0, high=frame_size, size=(n_frames, 2))
+    cube[np.arange(n_frames), peaks[:, 0], peaks[:, 1]] = 100.
+
+    np.testing.assert_array_equal(coadd_frames(cube)[0], coadd_frames_padded(cube))
+    print(f"Co-adding a cube of shape {cube.shape} ({cube.dtype}), best of 3:")
+    print(f"\tpadded reference: {best_of(coadd_frames_padded, cube):.3f} s")
+    print(f"\tcoadd_frames:     {best_of(coadd_frames, cube):.3f} s")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -1,5 +1,7 @@
 import unittest
+from unittest import mock
 import os
+import tempfile
 import numpy as np
 from astropy.io import fits
 
@@ -42,6 +44,201 @@ class TestAlignment(unittest.TestCase):
             padded = alignment.pad_array(np.ones(self.cube_shape), pad_vector=pad_vector, mode='same', reference_image_pad_vector=ref_pad_vector)
 
 
+class TestAlignmentArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.image = np.zeros((32, 32))
+        self.image[10, 12] = 1.
+        self.images = [self.image, np.roll(self.image, (3, -2), axis=(0, 1)),
+                       np.roll(self.image, (-4, 5), axis=(0, 1))]
+
+    def test_get_shifts_from_arrays(self):
+        self.assertEqual(alignment.get_shifts(self.images), [(0, 0), (-3, 2), (4, -5)])
+        shifts, image_shape = alignment.get_shifts(self.images, reference_file=1, return_image_shape=True)
+        self.assertEqual(shifts, [(3, -2), (0, 0), (7, -7)])
+        self.assertEqual(image_shape, (32, 32))
+        self.assertEqual(alignment.get_shifts([np.stack(self.images)], return_image_shape=True)[1], (32, 32))
+
+    def test_get_shifts_batched(self):
+        # Compare against the correlation with full complex FFTs for random images of odd and even shapes
+        rng = np.random.default_rng(seed=3)
+        for shape in [(32, 32), (27, 40)]:
+            reference = rng.random(shape)
+            images = [np.roll(reference, shift, axis=(0, 1)) + 0.1 * rng.random(shape)
+                      for shift in rng.integers(-6, 7, size=(9, 2))]
+            expected = []
+            for image in images:
+                correlation = np.fft.fftshift(np.fft.ifft2(np.fft.fft2(reference) * np.conjugate(np.fft.fft2(image))))
+                peak = np.unravel_index(np.argmax(correlation), shape)
+                expected.append(tuple(int(x - int(shape[i] / 2)) for i, x in enumerate(peak)))
+            self.assertEqual(alignment.get_shifts(images, reference_file=reference, batch_size=4), expected)
+            self.assertEqual(alignment.get_shifts(images, reference_file=reference, n_threads=1), expected)
+
+            # Full and real-input transforms of the reference are both accepted
+            for f_reference in [np.fft.fft2(reference), np.fft.rfft2(reference)]:
+                self.assertEqual(alignment.get_shift(images[0], f_reference, is_fourier_transformed=True),
+                                 expected[0])
+
+    def test_get_shifts_upsampled(self):
+        y, x = np.mgrid[:64, :63]
+        reference = np.exp(-((y - 30) ** 2 + (x - 28) ** 2) / 8) + 0.5 * np.exp(-((y - 12) ** 2 + (x - 40) ** 2) / 5)
+        images = [reference]
+        for shift in [(2.3, -1.7), (-4.55, 0.25)]:
+            phases = np.exp(-2j * np.pi * (np.fft.fftfreq(64)[:, np.newaxis] * shift[0] +
+                                           np.fft.fftfreq(63)[np.newaxis, :] * shift[1]))
+            images.append(np.real(np.fft.ifft2(np.fft.fft2(reference) * phases)))
+        shifts = alignment.get_shifts(images, upsample_factor=20)
+        np.testing.assert_allclose(shifts, [(0, 0), (-2.3, 1.7), (4.55, -0.25)], atol=1e-9)
+        self.assertEqual(alignment.get_shifts(images), [(0, 0), (-2, 2), (5, 0)])
+        shift = alignment.get_shift(images[1], reference_image=reference, upsample_factor=4)
+        np.testing.assert_allclose(shift, (-2.25, 1.75))
+        with self.assertRaises(ValueError):
+            alignment.get_shifts(images, upsample_factor=0)
+
+    def test_add_shifted_fractional(self):
+        array = np.arange(12.).reshape((3, 4))
+        target = alignment.add_shifted(np.zeros((6, 6)), array, offset=(1.25, 2.5))
+        self.assertAlmostEqual(np.sum(target), np.sum(array[:, :3]) + 0.5 * np.sum(array[:, 3]))
+        expected = np.zeros((6, 6))
+        for offset, weight in [((1, 2), 0.375), ((1, 3), 0.375), ((2, 2), 0.125), ((2, 3), 0.125)]:
+            alignment.add_shifted(expected, weight * array, offset=offset)
+        np.testing.assert_allclose(target, expected)
+        np.testing.assert_array_equal(alignment.add_shifted(np.zeros((6, 6)), array, offset=(1., 2.)),
+                                      alignment.add_shifted(np.zeros((6, 6)), array, offset=(1, 2)))
+
+        # Variances are distributed with the squared weights
+        var = alignment.add_shifted(np.zeros((6, 6)), array, offset=(1.25, 2.5), squared=True)
+        expected = np.zeros((6, 6))
+        for offset, weight in [((1, 2), 0.375), ((1, 3), 0.375), ((2, 2), 0.125), ((2, 3), 0.125)]:
+            alignment.add_shifted(expected, weight ** 2 * array, offset=offset)
+        np.testing.assert_allclose(var, expected)
+
+    def test_pad_array_valid(self):
+        sky = np.random.default_rng(seed=5).random((60, 60))
+        shifts = [(0, 0), (3, -2), (-4, 5)]
+        images = [sky[10 + dy: 50 + dy, 10 + dx: 50 + dx] for dy, dx in shifts]
+        pad_vectors = alignment.get_pad_vectors(shifts)
+        for image, pad_vector in zip(images, pad_vectors):
+            cropped = alignment.pad_array(image, pad_vector, mode='valid')
+            np.testing.assert_array_equal(cropped, sky[13: 46, 15: 48])
+            self.assertTrue(np.shares_memory(cropped, image))
+        pad_vectors = alignment.get_pad_vectors(shifts, cube_mode=True)
+        cropped = alignment.pad_array(np.array([images[1]] * 2), pad_vectors[1], mode='valid')
+        self.assertEqual(cropped.shape, (2, 33, 33))
+
+    def test_get_pyramid(self):
+        pyramid = alignment.get_pyramid(np.ones((300, 257)))
+        self.assertEqual([level.shape for level in pyramid], [(300, 257), (150, 128), (75, 64)])
+        self.assertEqual(len(alignment.get_pyramid(np.ones((300, 257)), n_levels=3)), 4)
+
+    def test_get_shifts_pyramid(self):
+        rng = np.random.default_rng(seed=4)
+        y, x = np.mgrid[:512, :512]
+        reference = rng.random((512, 512))
+        for center_y, center_x, amplitude in rng.random((20, 3)) * [512, 512, 100]:
+            reference += amplitude * np.exp(-((y - center_y) ** 2 + (x - center_x) ** 2) / 20)
+        images = [np.roll(reference, shift, axis=(0, 1)) + rng.random(reference.shape)
+                  for shift in rng.integers(-15, 16, size=(4, 2))]
+        expected = alignment.get_shifts(images, reference_file=reference)
+        self.assertEqual(alignment.get_shifts(images, reference_file=reference, mode='pyramid'), expected)
+        self.assertEqual(alignment.get_shifts(images, reference_file=reference, mode='pyramid', pyramid_levels=2,
+                                              patch_size=None), expected)
+
+    def test_get_shifts_peak(self):
+        self.assertEqual(alignment.get_shifts(self.images, mode='peak'), [(0, 0), (-3, 2), (4, -5)])
+
+    def test_get_shifts_header_offsets(self):
+        rng = np.random.default_rng(seed=5)
+        y, x = np.mgrid[:128, :128]
+        reference = rng.random((128, 128))
+        for center_y, center_x, amplitude in rng.random((10, 3)) * [128, 128, 100]:
+            reference += amplitude * np.exp(-((y - center_y) ** 2 + (x - center_x) ** 2) / 10)
+        rolls = [(0, 0), (6, -4), (-3, 9), (5, 5)]
+        # Offsets (x, y) in pixels, with a rejected prediction for the third file and none for the last
+        offsets = [(0, 0), (-3, 7), (20, 0), None]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            files = []
+            for index, (roll, offset) in enumerate(zip(rolls, offsets)):
+                hdu = fits.PrimaryHDU(np.roll(reference, roll, axis=(0, 1)) + rng.random(reference.shape))
+                if offset is not None:
+                    hdu.header.set('HIERARCH SPECKLEPY OFFSET X', 0.5 * offset[0])
+                    hdu.header.set('HIERARCH SPECKLEPY OFFSET Y', 0.5 * offset[1])
+                    hdu.header.set('PIXSCALE', 0.5)
+                files.append(f"file_{index}.fits")
+                hdu.writeto(os.path.join(tmp_dir, files[-1]))
+
+            cards = {'XOFFSET': 'HIERARCH SPECKLEPY OFFSET X', 'YOFFSET': 'HIERARCH SPECKLEPY OFFSET Y',
+                     'PIXSCALE': 'PIXSCALE'}
+            predicted = alignment.get_predicted_shifts(files, files[0], alignment.get_header_cards(cards),
+                                                       in_dir=tmp_dir)
+            self.assertEqual(predicted, [(0, 0), (-7, 3), (0, -20), None])
+
+            expected = [(0, 0), (-6, 4), (3, -9), (-5, -5)]
+            self.assertEqual(alignment.get_shifts(files, in_dir=tmp_dir), expected)
+            self.assertEqual(alignment.get_shifts(files, in_dir=tmp_dir, header_cards=cards), expected)
+            self.assertEqual(alignment.get_shifts(files, in_dir=tmp_dir, header_cards=cards, patch_size=None),
+                             expected)
+
+            # The instrument config provides offsets in pixels
+            self.assertEqual(alignment.get_predicted_shifts(files, files[0], alignment.get_header_cards('specklepy'),
+                                                            in_dir=tmp_dir)[1], (-4, 2))
+            with self.assertRaises(ValueError):
+                alignment.get_shifts(files, in_dir=tmp_dir, header_cards=cards, mode='pyramid')
+
+    def test_get_shifts_global(self):
+        # Cut a strip of frames from a wide field, such that distant frames do not overlap with the reference frame
+        rng = np.random.default_rng(seed=6)
+        y, x = np.mgrid[:100, :300]
+        sky = rng.random((100, 300))
+        for center_y, center_x, amplitude in rng.random((60, 3)) * [100, 300, 100]:
+            sky += amplitude * np.exp(-((y - center_y) ** 2 + (x - center_x) ** 2) / 5)
+        origins = [(10 + (index % 2) * 3, 18 * index) for index in range(12)]
+        images = [sky[oy: oy + 64, ox: ox + 64] + 0.1 * rng.random((64, 64)) for oy, ox in origins]
+        expected = [(oy - origins[0][0], ox - origins[0][1]) for oy, ox in origins]
+
+        self.assertEqual(alignment.get_shifts(images, mode='global'), expected)
+        with mock.patch.object(alignment, 'load_image', wraps=alignment.load_image) as load_image:
+            alignment.get_global_shifts(images, n_neighbors=2)
+        # Every image is transformed once, after the shape of the reference image
+        self.assertEqual(load_image.call_count, len(images) + 1)
+        predicted = [(shift[0] + 1, shift[1] - 2) for shift in expected]
+        self.assertEqual(alignment.get_shifts(images, mode='global', predicted_shifts=predicted, n_neighbors=2,
+                                              batch_size=5), expected)
+        shifts = alignment.get_shifts(images, mode='global', reference_file=3, upsample_factor=4)
+        self.assertTrue(np.allclose(shifts, np.subtract(expected, expected[3]), atol=0.5))
+
+    def test_get_pair_graph(self):
+        self.assertEqual(alignment.get_pair_graph(4, n_neighbors=2).tolist(), [[0, 1], [1, 2], [2, 3]])
+        positions = [(0, 0), (0, 100), (0, 10), None]
+        self.assertEqual(alignment.get_pair_graph(4, positions=positions, n_neighbors=1).tolist(),
+                         [[0, 2], [1, 2], [2, 3]])
+        self.assertEqual(len(alignment.get_pair_graph(1000, positions=rng_positions(1000), n_neighbors=4)) <= 4000,
+                         True)
+
+    def test_solve_global_shifts(self):
+        pairs = np.array([[0, 1], [1, 2], [0, 2], [3, 4]])
+        pair_shifts = np.array([[1, 2], [2, 2], [3, 4], [1, 1]])
+        shifts, solved = alignment.solve_global_shifts(5, pairs, pair_shifts, np.ones(4))
+        self.assertTrue(np.allclose(shifts[:3], [[0, 0], [1, 2], [3, 4]]))
+        self.assertEqual(solved.tolist(), [True, True, True, False, False])
+
+        # An outlier is rejected, if it is over-determined
+        pairs = np.array([[0, 1], [1, 2], [0, 2], [2, 3], [1, 3], [0, 3]])
+        pair_shifts = np.array([[1, 0], [1, 0], [2, 0], [1, 0], [2, 0], [9, 9]])
+        shifts, solved = alignment.solve_global_shifts(4, pairs, pair_shifts, np.ones(6))
+        self.assertTrue(np.allclose(shifts, [[0, 0], [1, 0], [2, 0], [3, 0]]))
+
+    def test_get_seeded_shift(self):
+        image = np.roll(self.images[0], (2, 2), axis=(0, 1))
+        self.assertEqual(alignment.get_seeded_shift(image, self.image, (-1, -2), search_radius=2), (-2, -2))
+        self.assertIsNone(alignment.get_seeded_shift(image, self.image, (0, 0), search_radius=2))
+        self.assertIsNone(alignment.get_seeded_shift(image, self.image, (40, 0), search_radius=2))
+
+
+def rng_positions(n, seed=7):
+    return [tuple(position) for position in np.random.default_rng(seed).random((n, 2)) * 1000]
+
 
 if __name__ == "__main__":
     unittest.main()
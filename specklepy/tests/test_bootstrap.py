@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 from specklepy.core import bootstrap
 
 
@@ -12,6 +13,14 @@ class TestBootstrap(unittest.TestCase):
         sample_draw_vectors = bootstrap.get_sample_draw_vectors(nDraws=self.nDraws, nFrames=self.nFrames)
         # imshow(sample_draw_vectors)
         self.assertEqual(len(sample_draw_vectors[0]), self.nFrames)
+        np.testing.assert_array_equal(np.sum(sample_draw_vectors, axis=1), self.nFrames)
+
+    def test_get_draw_vectors_seed(self):
+        first = bootstrap.get_sample_draw_vectors(nDraws=self.nDraws, nFrames=self.nFrames, seed=7)
+        second = bootstrap.get_sample_draw_vectors(nDraws=self.nDraws, nFrames=self.nFrames, seed=7)
+        np.testing.assert_array_equal(first, second)
+        uniform = bootstrap.get_sample_draw_vectors(nDraws=self.nDraws, nFrames=self.nFrames, first_uniform=True)
+        np.testing.assert_array_equal(uniform[0], 1)
 
 
 
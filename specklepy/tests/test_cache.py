@@ -0,0 +1,98 @@
+import unittest
+import numpy as np
+import os
+import tempfile
+
+from specklepy.io.cache import FileCache
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        self.files = []
+        for name in ['b.fits', 'a.fits']:
+            file = os.path.join(self.tmp_dir.name, name)
+            with open(file, 'wb') as f:
+                f.write(os.urandom(1000))
+            self.files.append(file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_init(self):
+        cache = FileCache(self.cache_dir)
+        self.assertTrue(os.path.isdir(self.cache_dir))
+        self.assertEqual(cache.size, 0)
+        with self.assertRaises(TypeError):
+            FileCache(0)
+        with self.assertRaises(ValueError):
+            FileCache(self.cache_dir, max_size=-1)
+
+    def test_get_key(self):
+        for checksum in [False, True]:
+            cache = FileCache(self.cache_dir, checksum=checksum)
+            key = cache.get_key(files=self.files, box=None, radius=3)
+            self.assertEqual(key, cache.get_key(files=self.files, radius=3, box=None))
+            self.assertNotEqual(key, cache.get_key(files=self.files, box=None, radius=4))
+            self.assertNotEqual(key, cache.get_key(files=self.files[::-1], box=None, radius=3))
+            with open(self.files[0], 'ab') as f:
+                f.write(b'changed')
+            self.assertNotEqual(key, cache.get_key(files=self.files, box=None, radius=3))
+
+    def test_files(self):
+        cache = FileCache(self.cache_dir)
+        key = cache.get_key(files=self.files, product='test')
+        self.assertIsNone(cache.restore_files(key, out_dir=self.tmp_dir.name))
+        cache.store_files(key, self.files)
+        self.assertIn(key, cache)
+
+        out_dir = os.path.join(self.tmp_dir.name, 'restored')
+        restored = cache.restore_files(key, out_dir=out_dir)
+        self.assertEqual([os.path.basename(file) for file in restored], ['b.fits', 'a.fits'])
+        for file, original in zip(restored, self.files):
+            with open(file, 'rb') as f, open(original, 'rb') as g:
+                self.assertEqual(f.read(), g.read())
+
+        # Incomplete entries are not restored
+        os.remove(os.path.join(cache.get_entry_dir(key), cache.complete_marker))
+        self.assertNotIn(key, cache)
+
+    def test_arrays(self):
+        cache = FileCache(self.cache_dir)
+        self.assertIsNone(cache.load_arrays('missing'))
+        cache.store_arrays('shifts', shifts=np.array([[0, 0], [3, -2]]))
+        np.testing.assert_array_equal(cache.load_arrays('shifts')['shifts'], [[0, 0], [3, -2]])
+
+    def test_memmap(self):
+        cache = FileCache(self.cache_dir)
+        self.assertIsNone(cache.load_memmap('spectra'))
+        memmap = cache.create_memmap('spectra', shape=(3, 4), dtype=np.complex64)
+        memmap[:2] = 1j
+        memmap.flush()
+        writable = cache.open_memmap('spectra')
+        writable[2:] = 1j
+        writable.flush()
+        self.assertNotIn('spectra', cache)
+        cache.complete('spectra')
+        loaded = cache.load_memmap('spectra')
+        self.assertIsInstance(loaded, np.memmap)
+        self.assertEqual(loaded.dtype, np.complex64)
+        np.testing.assert_array_equal(loaded, np.full((3, 4), 1j))
+
+    def test_evict(self):
+        cache = FileCache(self.cache_dir, max_size=2500)
+        for index, key in enumerate(['first', 'second']):
+            cache.store_files(key, self.files[:1])
+            os.utime(os.path.join(cache.get_entry_dir(key), cache.complete_marker), (index, index))
+
+        # Restoring the first entry makes the second the least recently used one
+        cache.restore_files('first', out_dir=self.tmp_dir.name)
+        cache.store_files('third', self.files[1:])
+        self.assertEqual(sorted(cache.entries), ['first', 'third'])
+        self.assertLessEqual(cache.size, 2500)
+
+
+if __name__ == "__main__":
+    unittest.main()
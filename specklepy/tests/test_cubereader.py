@@ -0,0 +1,110 @@
+import unittest
+import numpy as np
+import os
+import tempfile
+
+from astropy.io import fits
+
+from specklepy.io.cubereader import CubeInfo, CubeReader, bin_frames, get_dtype, iter_chunks
+from specklepy.utils.roi import ROI
+
+
+class TestCubeReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.tmp_dir.name, 'cube.fits')
+        self.cube = np.arange(7 * 5 * 4, dtype='int16').reshape((7, 5, 4))
+        hdu_list = fits.HDUList([fits.PrimaryHDU(self.cube), fits.ImageHDU(self.cube.astype(float) / 2, name='VAR')])
+        hdu_list.writeto(self.file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_init(self):
+        with CubeReader(self.file, chunk_size=3) as cube:
+            self.assertEqual(cube.shape, (7, 5, 4))
+            self.assertEqual(cube.frame_shape, (5, 4))
+            self.assertEqual(len(cube), 7)
+        with self.assertRaises(TypeError):
+            CubeReader(0)
+        with self.assertRaises(ValueError):
+            CubeReader(self.file, chunk_size=0)
+
+    def test_getitem(self):
+        with CubeReader(os.path.basename(self.file), in_dir=self.tmp_dir.name) as cube:
+            np.testing.assert_array_equal(cube[2:4], self.cube[2:4])
+        with CubeReader(self.file, extension='VAR') as cube:
+            np.testing.assert_array_equal(cube[5], self.cube[5] / 2)
+
+    def test_roi(self):
+        roi = ROI([1, 4, None, 3])
+        with CubeReader(self.file, chunk_size=3, roi=roi) as cube:
+            self.assertEqual(cube.shape, (7, 3, 3))
+            np.testing.assert_array_equal(cube[2], self.cube[2, 1:4, :3])
+            np.testing.assert_array_equal(cube[[0, 5], 1], self.cube[[0, 5], 2, :3])
+            np.testing.assert_array_equal(np.concatenate([chunk for _, chunk in cube.iter_chunks()]),
+                                          self.cube[:, 1:4, :3])
+        with CubeReader(self.file, time_binning=2, roi=roi) as cube:
+            self.assertEqual(cube.shape, (4, 3, 3))
+            np.testing.assert_array_equal(cube[1:], bin_frames(self.cube, 2)[1:, 1:4, :3])
+
+    def test_bin_frames(self):
+        binned = bin_frames(self.cube, 3)
+        self.assertEqual(binned.dtype, np.float32)
+        np.testing.assert_array_equal(binned, [self.cube[0:3].sum(axis=0), self.cube[3:6].sum(axis=0), self.cube[6]])
+        self.assertIs(bin_frames(self.cube), self.cube)
+        image = self.cube[0]
+        self.assertIs(bin_frames(image, 3), image)
+        with self.assertRaises(ValueError):
+            bin_frames(self.cube, 0)
+
+    def test_time_binning(self):
+        expected = bin_frames(self.cube, 2)
+        with CubeReader(self.file, chunk_size=3, time_binning=2) as cube:
+            self.assertEqual(cube.shape, (4, 5, 4))
+            self.assertEqual(len(cube), 4)
+            np.testing.assert_array_equal(cube[1], expected[1])
+            np.testing.assert_array_equal(cube[1:], expected[1:])
+            np.testing.assert_array_equal(cube[[0, 3]], expected[[0, 3]])
+            np.testing.assert_array_equal(cube[2, 1:3], expected[2, 1:3])
+            np.testing.assert_array_equal(np.concatenate([chunk for _, chunk in cube.iter_chunks()]), expected)
+        with CubeReader(self.file, extension='VAR', time_binning=7) as cube:
+            np.testing.assert_array_equal(cube[:], [np.sum(self.cube, axis=0) / 2])
+
+    def test_cube_info(self):
+        info = CubeInfo(os.path.basename(self.file), in_dir=self.tmp_dir.name)
+        self.assertEqual(info.shape, (7, 5, 4))
+        self.assertEqual(info.frame_shape, (5, 4))
+        self.assertEqual(len(info), 7)
+        self.assertEqual(info.dtype, np.int16)
+        self.assertEqual(info.nbytes, self.cube.nbytes)
+        self.assertEqual(CubeInfo(self.file, extension='VAR').dtype, np.float64)
+
+        image_file = os.path.join(self.tmp_dir.name, 'image.fits')
+        fits.writeto(image_file, self.cube[0].astype('uint16'))
+        info = CubeInfo(image_file)
+        self.assertEqual((info.n_frames, info.frame_shape), (1, (5, 4)))
+        self.assertEqual(info.dtype, fits.getdata(image_file).dtype)
+        with self.assertRaises(TypeError):
+            CubeInfo(0)
+
+    def test_get_dtype(self):
+        for dtype in ['uint8', 'int16', 'int32', 'float32', 'float64']:
+            header = fits.PrimaryHDU(np.zeros((2, 2), dtype=dtype)).header
+            self.assertEqual(get_dtype(header), np.dtype(dtype))
+        header = fits.PrimaryHDU(np.zeros((2, 2), dtype='int16')).header
+        header['BSCALE'] = 0.5
+        self.assertEqual(get_dtype(header), np.float32)
+
+    def test_iter_chunks(self):
+        with CubeReader(self.file, chunk_size=3) as cube:
+            starts = [start for start, chunk in cube.iter_chunks()]
+            self.assertEqual(starts, [0, 3, 6])
+            np.testing.assert_array_equal(np.concatenate([chunk for _, chunk in iter_chunks(cube)]), self.cube)
+            np.testing.assert_array_equal(np.array(list(cube)), self.cube)
+        self.assertEqual(len(list(iter_chunks(self.cube))), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import unittest
+from unittest import mock
+import numpy as np
+from numpy.fft import fft2, ifft2, fftshift
+import os
+import tempfile
+
+from astropy.io import fits
+from astropy.table import Table
+
+from specklepy.core.alignment import add_shifted, get_pad_vectors, pad_array
+from specklepy.core.fourierobject import FourierObject
+from specklepy.core.psfextraction import PSFExtractor, ReferenceStars, threshold_psfs
+from specklepy.io.cache import FileCache
+from specklepy.io.cubereader import CubeReader
+
+
+def coadd_fft_padded(image_cubes, psf_cubes, shifts, mode='same', frame_shifts=None):
+    """Reference implementation of the Fourier co-addition, based on padding and transforming every frame."""
+    pad_vectors, reference_pad_vector = get_pad_vectors(shifts, cube_mode=False, return_reference_image_pad_vector=True)
+    enumerator, denominator = 0, 0
+    for file_index, (image_cube, psf_cube) in enumerate(zip(image_cubes, psf_cubes)):
+        for frame_index, (img, psf) in enumerate(zip(image_cube, psf_cube)):
+            if frame_shifts is not None:
+                img = add_shifted(np.zeros(img.shape), img, offset=frame_shifts[file_index][frame_index])
+            img = pad_array(img, pad_vectors[file_index], mode=mode, reference_image_pad_vector=reference_pad_vector)
+            dx, dy = img.shape[0] - psf.shape[0], img.shape[1] - psf.shape[1]
+            psf = np.pad(psf, ((dx // 2, -(-dx // 2)), (dy // 2, -(-dy // 2))))
+            f_img, f_psf = fftshift(fft2(img)), fftshift(fft2(psf))
+            enumerator = enumerator + f_img * np.conjugate(f_psf)
+            denominator = denominator + np.abs(np.square(f_psf))
+    return np.abs(ifft2(enumerator / denominator))
+
+
+class TestFourierObject(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=7)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.shifts = [(0, 0), (3, -2)]
+        self.image_cubes, self.psf_cubes = [], []
+        self.in_files, self.psf_files = [], []
+        for index in range(2):
+            image_cube = rng.random((5, 24, 20)) + 1
+            psf_cube = rng.random((5, 9, 9))
+            psf_cube[:, 4, 4] += 5
+            self.image_cubes.append(image_cube)
+            self.psf_cubes.append(psf_cube)
+            self.in_files.append(f"cube_{index}.fits")
+            self.psf_files.append(os.path.join(self.tmp_dir.name, f"psf_{index}.fits"))
+            fits.writeto(os.path.join(self.tmp_dir.name, self.in_files[-1]), image_cube)
+            fits.writeto(self.psf_files[-1], psf_cube)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_coadd_fft(self):
+        for mode in ['same', 'full', 'valid']:
+            f_object = FourierObject(self.in_files, self.psf_files, shifts=self.shifts, mode=mode,
+                                     in_dir=self.tmp_dir.name, chunk_size=2)
+            fourier_image = f_object.coadd_fft()
+            self.assertEqual(fourier_image.shape, f_object.shape[:-1] + (f_object.shape[-1] // 2 + 1,))
+            self.assertEqual(f_object.denominator.dtype, np.float64)
+            expected = coadd_fft_padded(self.image_cubes, self.psf_cubes, self.shifts, mode=mode)
+            np.testing.assert_allclose(f_object.ifft(), expected, rtol=1e-4, atol=1e-4)
+
+    def test_coadd_fft_frame_shifts(self):
+        frame_shifts = [np.array([(0, 0), (1, 2), (-1, 0), (2, -1), (0, 1)])] * 2
+        f_object = FourierObject(self.in_files, self.psf_files, shifts=self.shifts, in_dir=self.tmp_dir.name,
+                                 frame_shifts=frame_shifts, chunk_size=3)
+        f_object.coadd_fft()
+        expected = coadd_fft_padded(self.image_cubes, self.psf_cubes, self.shifts, frame_shifts=frame_shifts)
+        np.testing.assert_allclose(f_object.ifft(), expected, rtol=1e-4, atol=1e-4)
+        with self.assertRaises(ValueError):
+            FourierObject(self.in_files, self.psf_files, shifts=self.shifts, in_dir=self.tmp_dir.name, chunk_size=0)
+
+    def test_n_jobs(self):
+        expected = FourierObject(self.in_files, self.psf_files, shifts=self.shifts, in_dir=self.tmp_dir.name,
+                                 chunk_size=2, task_size=3)
+        expected.coadd_fft()
+        f_object = FourierObject(self.in_files, self.psf_files, shifts=self.shifts, in_dir=self.tmp_dir.name,
+                                 chunk_size=2, task_size=3, n_jobs=2)
+        f_object.coadd_fft()
+        np.testing.assert_array_equal(f_object.fourier_image, expected.fourier_image)
+        reference = coadd_fft_padded(self.image_cubes, self.psf_cubes, self.shifts)
+        np.testing.assert_allclose(f_object.ifft(), reference, rtol=1e-4, atol=1e-4)
+        with self.assertRaises(ValueError):
+            FourierObject(self.in_files, self.psf_files, shifts=self.shifts, in_dir=self.tmp_dir.name, task_size=0)
+
+    def test_spectra_cache(self):
+        cache = FileCache(os.path.join(self.tmp_dir.name, 'cache'))
+        expected = FourierObject(self.in_files, self.psf_files, shifts=self.shifts, in_dir=self.tmp_dir.name)
+        expected.coadd_fft()
+        for iteration in range(2):
+            f_object = FourierObject(self.in_files, self.psf_files, shifts=self.shifts, in_dir=self.tmp_dir.name,
+                                     chunk_size=2, spectra_cache=cache)
+            f_object.coadd_fft()
+            self.assertEqual(len(cache.entries), 2)
+            np.testing.assert_allclose(f_object.ifft(), expected.ifft(), rtol=1e-6)
+
+        # Later iterations only read the cached image spectra
+        with mock.patch('specklepy.core.fourierobject.CubeReader', wraps=CubeReader) as reader:
+            f_object.coadd_fft()
+        self.assertEqual([call.args[0] for call in reader.call_args_list], self.psf_files)
+        np.testing.assert_allclose(f_object.ifft(), expected.ifft(), rtol=1e-6)
+
+        # The spectra are filled in parallel by tasks of partial files
+        parallel_cache = FileCache(os.path.join(self.tmp_dir.name, 'parallel_cache'))
+        for iteration in range(2):
+            f_object = FourierObject(self.in_files, self.psf_files, shifts=self.shifts, in_dir=self.tmp_dir.name,
+                                     chunk_size=2, spectra_cache=parallel_cache, n_jobs=2, task_size=2)
+            f_object.coadd_fft()
+            self.assertEqual(len(parallel_cache.entries), 2)
+            np.testing.assert_allclose(f_object.ifft(), expected.ifft(), rtol=1e-6)
+
+    def test_psf_extractor(self):
+        for image_cube in self.image_cubes:
+            image_cube[:, 10, 8] += 20
+            image_cube[:, 15, 13] += 10
+        for file, image_cube in zip(self.in_files, self.image_cubes):
+            fits.writeto(os.path.join(self.tmp_dir.name, file), image_cube, overwrite=True)
+        reference_source_file = os.path.join(self.tmp_dir.name, 'ref_sources.dat')
+        Table({'x': [8., 13.], 'y': [10., 15.]}).write(reference_source_file, format='ascii.fixed_width')
+        ref_stars = ReferenceStars(psf_radius=4, reference_source_file=reference_source_file, in_files=self.in_files,
+                                   save_dir=self.tmp_dir.name, in_dir=self.tmp_dir.name)
+
+        # Extract and threshold the PSF files, as in holography()
+        psf_files = ref_stars.extract_psfs(mode='mean')
+        for file in psf_files:
+            with fits.open(file, mode='update') as hdu_list:
+                hdu_list[0].data[:] = threshold_psfs(hdu_list[0].data, noise_threshold=1, noise_reference_margin=1)
+        expected = FourierObject(self.in_files, psf_files, shifts=self.shifts, in_dir=self.tmp_dir.name)
+        expected.coadd_fft()
+
+        # The fused co-addition extracts the same PSFs from the frames, also when the image spectra are cached
+        cache = FileCache(os.path.join(self.tmp_dir.name, 'cache'))
+        for iteration in range(2):
+            psf_extractor = PSFExtractor(ref_stars, mode='mean', noise_threshold=1, noise_reference_margin=1)
+            f_object = FourierObject(self.in_files, None, shifts=self.shifts, in_dir=self.tmp_dir.name, chunk_size=2,
+                                     spectra_cache=cache, psf_extractor=psf_extractor)
+            f_object.coadd_fft()
+            np.testing.assert_allclose(f_object.ifft(), expected.ifft(), rtol=1e-5)
+
+        # Worker processes write the PSF files that are prepared by the parent process
+        save_dir = os.path.join(self.tmp_dir.name, 'streamed')
+        os.makedirs(save_dir)
+        psf_extractor = PSFExtractor(ref_stars, mode='mean', noise_threshold=1, noise_reference_margin=1,
+                                     save_dir=save_dir)
+        f_object = FourierObject(self.in_files, None, shifts=self.shifts, in_dir=self.tmp_dir.name, chunk_size=2,
+                                 psf_extractor=psf_extractor, n_jobs=2, task_size=2)
+        f_object.coadd_fft()
+        np.testing.assert_allclose(f_object.ifft(), expected.ifft(), rtol=1e-5)
+        for psf_file, streamed_file in zip(psf_files, psf_extractor.psf_files):
+            np.testing.assert_allclose(fits.getdata(streamed_file), fits.getdata(psf_file), rtol=1e-5, atol=1e-6)
+        with self.assertRaises(ValueError):
+            FourierObject(self.in_files, None, shifts=self.shifts, in_dir=self.tmp_dir.name)
+
+        # The weights of the 'weighted_mean' mode refer to the raw frames
+        psf_extractor = PSFExtractor(ref_stars, mode='weighted_mean')
+        for kwargs in [{'time_binning': 2}, {'frame_shifts': [np.zeros((4, 2), dtype=int)] * len(self.in_files)}]:
+            with self.assertRaises(ValueError):
+                FourierObject(self.in_files, None, shifts=self.shifts, in_dir=self.tmp_dir.name,
+                              psf_extractor=psf_extractor, **kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()
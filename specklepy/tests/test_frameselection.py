@@ -0,0 +1,40 @@
+import unittest
+import numpy as np
+
+from specklepy.core.frameselection import FrameSelection
+from specklepy.utils.box import Box
+
+
+class TestFrameSelection(unittest.TestCase):
+
+    def setUp(self):
+        self.cube = np.ones((10, 16, 16))
+        self.peaks = np.array([5., 1., 9., 3., 2., 8., 7., 4., 6., 10.])
+        for index, peak in enumerate(self.peaks):
+            self.cube[index, 8, 8] = peak
+
+    def test_init(self):
+        FrameSelection()
+        with self.assertRaises(TypeError):
+            FrameSelection(method=0)
+        with self.assertRaises(ValueError):
+            FrameSelection(method='nonsense')
+        with self.assertRaises(ValueError):
+            FrameSelection(fraction=0)
+
+    def test_scores(self):
+        for method in FrameSelection.supported_methods:
+            scores = FrameSelection(method=method).get_scores(self.cube, chunk_size=3)
+            np.testing.assert_array_equal(np.argsort(scores), np.argsort(self.peaks))
+        scores = FrameSelection(method='peak', box=Box([0, 4, 0, 4])).get_scores(self.cube)
+        np.testing.assert_array_equal(scores, np.ones(10))
+
+    def test_call(self):
+        selection = FrameSelection(method='peak', fraction=0.3)
+        np.testing.assert_array_equal(selection(self.cube), [2, 5, 9])
+        self.assertEqual(selection.get_n_selected(11), 4)
+        self.assertEqual(selection.cards['SELECTION METHOD'], 'peak')
+
+
+if __name__ == "__main__":
+    unittest.main()
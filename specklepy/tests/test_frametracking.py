@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+
+from specklepy.core.frametracking import FrameTracker
+from specklepy.utils.box import Box
+
+
+class TestFrameTracker(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=3)
+        sky = rng.random((64, 64))
+        sky[40, 12] += 45.
+        self.drifts = np.cumsum(rng.integers(low=-1, high=2, size=(12, 2)), axis=0)
+
+        # The primary source flickers around the flux of a companion, such that the emission peak of single frames
+        # jumps between both sources
+        cube = np.array([sky] * 12)
+        cube[:, 20, 30] += np.where(np.arange(12) % 2, 70., 40.)
+        cube[:, 44, 50] += 55.
+        self.cube = np.array([np.roll(frame, drift, axis=(0, 1)) for frame, drift in zip(cube, self.drifts)])
+
+        self.expected = -self.drifts + np.round(np.mean(self.drifts, axis=0)).astype(int)
+
+    def test_init(self):
+        FrameTracker()
+        with self.assertRaises(ValueError):
+            FrameTracker(chunk_size=0)
+        with self.assertRaises(ValueError):
+            FrameTracker(upsample_factor=0.5)
+
+    def test_call(self):
+        tracker = FrameTracker(chunk_size=5, n_threads=1)
+        shifts = tracker(self.cube)
+        self.assertEqual(shifts.dtype.kind, 'i')
+        np.testing.assert_array_equal(shifts, self.expected)
+        np.testing.assert_array_equal(tracker(self.cube, chunk_size=12), self.expected)
+        with self.assertRaises(ValueError):
+            tracker(self.cube[0])
+        with self.assertRaises(TypeError):
+            tracker(self.cube, reference_image=[[0]])
+
+    def test_call_frame_indizes(self):
+        frame_indizes = [1, 2, 6, 9]
+        shifts = FrameTracker(chunk_size=3)(self.cube, frame_indizes=frame_indizes)
+        np.testing.assert_array_equal(shifts[[0, 3, 4, 5, 7, 8, 10, 11]], 0)
+        np.testing.assert_array_equal(np.diff(shifts[frame_indizes], axis=0),
+                                      np.diff(self.expected[frame_indizes], axis=0))
+
+    def test_call_reference_image(self):
+        shifts = FrameTracker()(self.cube, reference_image=self.cube[0])
+        np.testing.assert_array_equal(shifts, self.drifts[0] - self.drifts)
+
+    def test_call_box(self):
+        tracker = FrameTracker(box=Box([4, 60, 4, 60]))
+        np.testing.assert_array_equal(tracker(self.cube), self.expected)
+        self.assertIn('TRACKING BOX', tracker.cards)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from functools import partial
+from operator import add
+
+from specklepy.utils.parallel import get_n_jobs, parallel_map, parallel_reduce
+
+
+def power(base, exponent=2):
+    return base ** exponent
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_get_n_jobs(self):
+        self.assertEqual(get_n_jobs(3), 3)
+        self.assertGreaterEqual(get_n_jobs(None), 1)
+        self.assertGreaterEqual(get_n_jobs(-1), 1)
+        with self.assertRaises(ValueError):
+            get_n_jobs(0)
+
+    def test_parallel_map(self):
+        expected = [x ** 3 for x in range(10)]
+        self.assertEqual(parallel_map(partial(power, exponent=3), range(10)), expected)
+        self.assertEqual(parallel_map(partial(power, exponent=3), range(10), n_jobs=2), expected)
+
+    def test_parallel_reduce(self):
+        expected = sum(x ** 3 for x in range(10))
+        for n_jobs in [1, 2]:
+            self.assertEqual(parallel_reduce(partial(power, exponent=3), range(10), reduce=add, n_jobs=n_jobs),
+                             expected)
+        self.assertIsNone(parallel_reduce(power, [], reduce=add))
+
+
+if __name__ == "__main__":
+    unittest.main()
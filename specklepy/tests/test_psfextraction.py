@@ -1,5 +1,13 @@
 import unittest
-from specklepy.core.psfextraction import ReferenceStars
+from unittest import mock
+import numpy as np
+import os
+import tempfile
+
+from astropy.io import fits
+from astropy.table import Table
+
+from specklepy.core.psfextraction import PSFExtractor, ReferenceStars, threshold_psfs
 from specklepy.io.parameterset import ParameterSet
 
 
@@ -33,5 +41,65 @@ class TestPSFExtraction(unittest.TestCase):
         ref_stars.extract_epsfs(debug=False)
 
 
+class TestPSFExtractor(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=3)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cube = rng.random((6, 30, 28))
+        self.cube[:, 10, 8] += 20
+        self.cube[:, 18, 19] += 15
+        self.in_files = ['cube.fits']
+        fits.writeto(os.path.join(self.tmp_dir.name, self.in_files[0]), self.cube)
+        self.reference_source_file = os.path.join(self.tmp_dir.name, 'ref_sources.dat')
+        Table({'x': [8.2, 19.0], 'y': [10.4, 17.7]}).write(self.reference_source_file, format='ascii.fixed_width')
+        self.ref_stars = ReferenceStars(psf_radius=4, reference_source_file=self.reference_source_file,
+                                        in_files=self.in_files, save_dir=self.tmp_dir.name, in_dir=self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_extract_psf_frames(self):
+        for mode in ['mean', 'median', 'weighted_mean']:
+            psf_file = self.ref_stars.extract_psfs(mode=mode)[0]
+            vars = self.ref_stars.get_aperture_vars(self.in_files[0]) if mode == 'weighted_mean' else None
+            psfs = self.ref_stars.extract_psf_frames(self.cube[2:5], mode=mode, vars=vars)
+            np.testing.assert_allclose(psfs, fits.getdata(psf_file)[2:5])
+
+        # Positions are relative to the origin of cropped frames
+        psfs = self.ref_stars.extract_psf_frames(self.cube[:, 3:, 2:], shift=(1, -1), origin=(3, 2))
+        np.testing.assert_allclose(psfs, self.ref_stars.extract_psf_frames(self.cube, shift=(1, -1)))
+        with self.assertRaises(ValueError):
+            self.ref_stars.extract_psf_frames(self.cube[:, 12:], origin=(12, 0))
+
+    def test_psf_extractor(self):
+        psf_extractor = PSFExtractor(self.ref_stars, mode='mean', noise_threshold=1, noise_reference_margin=1,
+                                     save_dir=os.path.join(self.tmp_dir.name, 'psfs'))
+        self.assertEqual(psf_extractor.frame_shape, (9, 9))
+        psfs = np.concatenate([psf_extractor(0, self.cube[:4], start=0, n_frames=6),
+                               psf_extractor(0, self.cube[4:], start=4, n_frames=6)])
+        expected = threshold_psfs(self.ref_stars.extract_psf_frames(self.cube, mode='mean'), noise_threshold=1,
+                                  noise_reference_margin=1)
+        np.testing.assert_allclose(psfs, expected)
+        np.testing.assert_allclose(np.sum(psfs, axis=(1, 2)), 1)
+        np.testing.assert_allclose(fits.getdata(psf_extractor.psf_files[0]), expected)
+        with self.assertRaises(ValueError):
+            PSFExtractor(self.ref_stars, mode='epsf')
+
+    def test_psf_extractor_weighted_mean(self):
+        # The variances are computed once per file, also when the files alternate
+        fits.writeto(os.path.join(self.tmp_dir.name, 'cube2.fits'), self.cube[::-1])
+        ref_stars = ReferenceStars(psf_radius=4, reference_source_file=self.reference_source_file,
+                                   in_files=self.in_files + ['cube2.fits'], save_dir=self.tmp_dir.name,
+                                   in_dir=self.tmp_dir.name)
+        psf_extractor = PSFExtractor(ref_stars, mode='weighted_mean')
+        with mock.patch.object(ref_stars, 'get_aperture_vars', wraps=ref_stars.get_aperture_vars) as get_vars:
+            for file_index in [0, 1, 0, 1]:
+                psfs = psf_extractor(file_index, self.cube[:3])
+        self.assertEqual(get_vars.call_count, 2)
+        vars = ref_stars.get_aperture_vars('cube2.fits')
+        np.testing.assert_allclose(psfs, ref_stars.extract_psf_frames(self.cube[:3], mode='weighted_mean', vars=vars))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import multiprocessing
+import numpy as np
+import os
+import tempfile
+import time
+
+from astropy.io import fits
+
+from specklepy.core.quicklook import GrowingCubeReader, QuickLook, RingBuffer
+
+
+def write_growing_cube(file, frames, delay=0.05):
+    """Simulate an acquisition system, which writes the header and appends the frames one by one."""
+    header = fits.PrimaryHDU(np.zeros((0,) + frames.shape[1:], dtype='>f4')).header
+    header['NAXIS3'] = 0
+    with open(file, 'wb') as f:
+        f.write(header.tostring().encode('ascii'))
+        f.flush()
+        for frame in frames:
+            time.sleep(delay)
+            f.write(frame.astype('>f4').tobytes())
+            f.flush()
+
+
+class TestQuickLook(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.tmp_dir.name, 'growing.fits')
+        self.out_file = os.path.join(self.tmp_dir.name, 'quicklook.fits')
+        rng = np.random.default_rng(seed=3)
+        self.frames = rng.random((25, 32, 32)).astype('float32')
+        for index, frame in enumerate(self.frames):
+            frame[10 + index % 5, 12 + index % 3] = 100.
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_ring_buffer(self):
+        buffer = RingBuffer(capacity=4, frame_shape=(2, 2))
+        buffer.reserve(3)[:] = 1.
+        self.assertEqual(len(buffer.pop(2)), 2)
+        self.assertEqual(len(buffer.reserve(5)), 1)
+        self.assertEqual(len(buffer.reserve(5)), 2)
+        self.assertTrue(buffer.is_full)
+        self.assertEqual(len(buffer.pop()), 2)
+        self.assertEqual(len(buffer.pop()), 2)
+        with self.assertRaises(ValueError):
+            RingBuffer(capacity=0, frame_shape=(2, 2))
+
+    def test_reader(self):
+        write_growing_cube(self.file, self.frames[:3], delay=0)
+        reader = GrowingCubeReader(self.file)
+        self.assertEqual(reader.n_available, 3)
+        np.testing.assert_array_equal(reader.read(1, 3), self.frames[1:3])
+
+    def test_follow(self):
+        writer = multiprocessing.Process(target=write_growing_cube, args=(self.file, self.frames))
+        writer.start()
+        while not os.path.exists(self.file) or os.path.getsize(self.file) < 2880:
+            time.sleep(0.01)
+        quicklook = QuickLook(self.file, out_file=self.out_file, update_every=4)
+        quicklook.follow(poll_interval=0.02, timeout=1.)
+
+        # Following may stop early if the writer stalls, so pick up the remaining frames once it has finished
+        writer.join()
+        image = quicklook.follow(poll_interval=0.02, timeout=0.1)
+
+        self.assertEqual(quicklook.n_coadded, len(self.frames))
+        self.assertAlmostEqual(np.sum(image[10, 12]), 100. * len(self.frames), places=3)
+        np.testing.assert_array_equal(fits.getdata(self.out_file), image)
+        self.assertEqual(fits.getheader(self.out_file)['HIERARCH SPECKLEPY FILE 0 FRAMES'], len(self.frames))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import numpy as np
+
+from astropy.table import Table
+
+from specklepy.utils.roi import ROI
+
+
+class TestROI(unittest.TestCase):
+
+    def setUp(self):
+        self.cube = np.arange(3 * 10 * 8).reshape((3, 10, 8))
+
+    def test_init(self):
+        ROI([1, 5, None, 4])
+        with self.assertRaises(TypeError):
+            ROI(5)
+        with self.assertRaises(ValueError):
+            ROI([1, 5, 2])
+        with self.assertRaises(ValueError):
+            ROI([5, 1, 2, 4])
+
+    def test_call(self):
+        roi = ROI([1, 5, None, 4])
+        cropped = roi(self.cube)
+        np.testing.assert_array_equal(cropped, self.cube[:, 1:5, :4])
+        self.assertTrue(np.shares_memory(cropped, self.cube))
+        np.testing.assert_array_equal(roi(self.cube[0]), self.cube[0, 1:5, :4])
+        self.assertEqual(roi.get_shape(self.cube.shape[1:]), (4, 4))
+        self.assertEqual(roi.offset, (1, 0))
+        self.assertEqual(roi.cards['ROI OFFSET X'], 1)
+
+    def test_from_sources(self):
+        sources = Table({'x': [3.2, 6.0], 'y': [2.5, 8.7]})
+        roi = ROI.from_sources(sources, margin=2, frame_shape=(10, 8))
+        self.assertEqual((roi.x_min, roi.x_max, roi.y_min, roi.y_max), (0, 10, 1, 8))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,348 @@
+import unittest
+from unittest import mock
+import numpy as np
+import os
+import tempfile
+
+from astropy.io import fits
+
+from specklepy.core import alignment
+from specklepy.core.bootstrap import get_sample_draw_vectors
+from specklepy.core.frameselection import FrameSelection
+from specklepy.core.frametracking import FrameTracker
+from specklepy.core.ssa import ssa, coadd_file, coadd_frames, coadd_frames_oversampled, get_bilinear_splat, \
+    get_peak_indizes, get_subpixel_peaks
+from specklepy.io.cache import FileCache
+from specklepy.io.cubereader import CubeReader, bin_frames
+from specklepy.utils.tiledcanvas import TiledCanvas
+from specklepy.utils.box import Box
+from specklepy.utils.roi import ROI
+
+
+def coadd_frames_padded(cube, box=None):
+    """Reference implementation of the SSA co-addition, based on padding every frame."""
+    peak_indizes = np.zeros((cube.shape[0], 2), dtype=int)
+    for index, frame in enumerate(cube):
+        if box is not None:
+            frame = box(frame)
+        peak_indizes[index] = np.unravel_index(np.argmax(frame, axis=None), frame.shape)
+    peak_indizes = peak_indizes.transpose()
+    xmean, ymean = np.mean(peak_indizes, axis=1)
+    shifts = np.array([int(xmean) - peak_indizes[0], int(ymean) - peak_indizes[1]]).transpose()
+    pad_vectors, ref_pad_vector = alignment.get_pad_vectors(shifts, cube_mode=False,
+                                                            return_reference_image_pad_vector=True)
+    coadded = np.zeros(cube[0].shape)
+    for index, frame in enumerate(cube):
+        coadded += alignment.pad_array(frame, pad_vectors[index], mode='same',
+                                       reference_image_pad_vector=ref_pad_vector)
+    return coadded
+
+
+class TestSSA(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=42)
+        self.cube = rng.random((20, 64, 48))
+        self.peaks = rng.integers(low=5, high=40, size=(20, 2))
+        for index, peak in enumerate(self.peaks):
+            self.cube[index, peak[0], peak[1]] = 100.
+        self.var_cube = rng.random(self.cube.shape)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.tmp_dir.name, 'cube.fits')
+        fits.HDUList([fits.PrimaryHDU(self.cube), fits.ImageHDU(self.var_cube, name='VAR')]).writeto(self.file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_peak_indizes(self):
+        np.testing.assert_array_equal(get_peak_indizes(self.cube), self.peaks)
+        np.testing.assert_array_equal(get_peak_indizes(self.cube, chunk_size=3), self.peaks)
+        with self.assertRaises(ValueError):
+            get_peak_indizes(self.cube, chunk_size=0)
+
+    def test_coadd_frames(self):
+        coadded, var_coadded = coadd_frames(self.cube)
+        np.testing.assert_array_equal(coadded, coadd_frames_padded(self.cube))
+        self.assertIsNone(var_coadded)
+
+        coadded, var_coadded = coadd_frames(self.cube, var_cube=self.var_cube, chunk_size=7)
+        np.testing.assert_array_equal(coadded, coadd_frames_padded(self.cube))
+        np.testing.assert_array_equal(var_coadded.shape, coadded.shape)
+
+    def test_coadd_frames_box(self):
+        coadded, _ = coadd_frames(self.cube, box=Box([10, 40, 5, 30]))
+        np.testing.assert_array_equal(coadded, coadd_frames_padded(self.cube, box=Box([10, 40, 5, 30])))
+
+    def test_coadd_frames_streamed(self):
+        with CubeReader(self.file, chunk_size=6) as cube, CubeReader(self.file, extension='VAR') as var_cube:
+            coadded, var_coadded = coadd_frames(cube, var_cube=var_cube)
+        expected, expected_var = coadd_frames(self.cube, var_cube=self.var_cube)
+        np.testing.assert_array_equal(coadded, expected)
+        np.testing.assert_array_equal(var_coadded, expected_var)
+
+    def test_coadd_file(self):
+        coadded, var_coadded = coadd_file(self.file, chunk_size=4)
+        expected, expected_var = coadd_file(self.file)
+        np.testing.assert_array_equal(coadded, expected)
+        np.testing.assert_array_equal(var_coadded, expected_var)
+        self.assertIsNone(coadd_file(self.file, var_ext=None)[1])
+
+    def test_coadd_file_time_binning(self):
+        coadded, var_coadded = coadd_file(self.file, time_binning=3)
+        expected, expected_var = coadd_frames(bin_frames(self.cube, 3), var_cube=bin_frames(self.var_cube, 3))
+        np.testing.assert_array_equal(coadded, expected)
+        np.testing.assert_array_equal(var_coadded, expected_var)
+        streamed, streamed_var = coadd_file(self.file, chunk_size=4, time_binning=3)
+        np.testing.assert_allclose(streamed, expected)
+        np.testing.assert_allclose(streamed_var, expected_var)
+
+    def test_coadd_file_roi(self):
+        roi = ROI([0, 45, 2, 45])
+        coadded, var_coadded = coadd_file(self.file, roi=roi)
+        expected, expected_var = coadd_frames(self.cube[:, :45, 2:45], var_cube=self.var_cube[:, :45, 2:45])
+        np.testing.assert_array_equal(coadded, expected)
+        np.testing.assert_array_equal(var_coadded, expected_var)
+        streamed, streamed_var = coadd_file(self.file, chunk_size=4, time_binning=2, roi=roi)
+        np.testing.assert_allclose(streamed, coadd_file(self.file, time_binning=2, roi=roi)[0])
+        self.assertEqual(streamed_var.shape, (45, 43))
+
+    def test_coadd_frames_selection(self):
+        frame_indizes = [1, 4, 5, 11]
+        coadded, var_coadded = coadd_frames(self.cube, var_cube=self.var_cube, frame_indizes=frame_indizes,
+                                            chunk_size=4)
+        expected, expected_var = coadd_frames(self.cube[frame_indizes], var_cube=self.var_cube[frame_indizes])
+        np.testing.assert_array_equal(coadded, expected)
+        np.testing.assert_array_equal(var_coadded, expected_var)
+
+        selection = FrameSelection(method='peak', fraction=0.5)
+        coadded, _ = coadd_file(self.file, chunk_size=3, frame_selection=selection)
+        expected, _ = coadd_frames(self.cube, frame_indizes=selection(self.cube))
+        np.testing.assert_array_equal(coadded, expected)
+
+    def test_coadd_frames_shifts(self):
+        shifts = np.mean(self.peaks, axis=0).astype(int) - self.peaks
+        coadded, _ = coadd_frames(self.cube, shifts=shifts)
+        np.testing.assert_array_equal(coadded, coadd_frames_padded(self.cube))
+        with self.assertRaises(ValueError):
+            coadd_frames(self.cube, shifts=shifts[:5])
+
+        tracker = FrameTracker()
+        coadded, _ = coadd_file(self.file, frame_tracker=tracker)
+        expected, _ = coadd_frames(self.cube, shifts=tracker(self.cube))
+        np.testing.assert_array_equal(coadded, expected)
+
+    def test_coadd_frames_bootstrap(self):
+        sample_draw_vectors = get_sample_draw_vectors(5, len(self.cube), first_uniform=True, seed=1)
+        coadded, _, bootstrap_coadded = coadd_frames(self.cube, chunk_size=6, sample_draw_vectors=sample_draw_vectors)
+        np.testing.assert_array_equal(coadded, coadd_frames_padded(self.cube))
+        self.assertEqual(bootstrap_coadded.shape, (5,) + coadded.shape)
+        np.testing.assert_allclose(bootstrap_coadded[0], coadded)
+
+        # Compare against shifting the frames of every draw separately
+        peak_indizes = get_peak_indizes(self.cube)
+        shifts = np.mean(peak_indizes, axis=0).astype(int) - peak_indizes
+        for draw, weights in enumerate(sample_draw_vectors):
+            expected = np.zeros(coadded.shape)
+            for frame, shift, weight in zip(self.cube, shifts, weights):
+                alignment.add_shifted(expected, weight * frame, offset=shift)
+            np.testing.assert_allclose(bootstrap_coadded[draw], expected)
+
+        with self.assertRaises(ValueError):
+            coadd_frames(self.cube, frame_indizes=[1, 2, 3], sample_draw_vectors=sample_draw_vectors)
+
+    def test_get_subpixel_peaks(self):
+        # Gaussian spots centered between pixels
+        y, x = np.mgrid[:32, :32]
+        centers = np.array([[10.3, 12.6], [20.5, 7.2], [15., 15.]])
+        cube = np.array([np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / 4) for cy, cx in centers])
+        np.testing.assert_allclose(get_subpixel_peaks(cube), centers, atol=0.1)
+        np.testing.assert_allclose(get_subpixel_peaks(cube, method='centroid', chunk_size=2), centers, atol=0.15)
+        np.testing.assert_allclose(get_subpixel_peaks(cube, frame_indizes=[2]), centers[2:])
+        with self.assertRaises(ValueError):
+            get_subpixel_peaks(cube, method='gaussian')
+
+    def test_get_bilinear_splat(self):
+        splat = get_bilinear_splat((0., 0.), oversampling=1)
+        self.assertEqual(len(splat), 1)
+        np.testing.assert_array_equal(splat[0][1], (0, 0))
+        splat = get_bilinear_splat((0.3, -1.25), oversampling=2)
+        self.assertAlmostEqual(sum(weight for _, _, weight in splat), 1.)
+
+    def test_coadd_frames_oversampled(self):
+        coadded, var_coadded = coadd_frames_oversampled(self.cube, var_cube=self.var_cube, oversampling=3,
+                                                        chunk_size=7)
+        self.assertEqual(coadded.shape, (192, 144))
+        self.assertEqual(var_coadded.shape, coadded.shape)
+        # Flux of the peaks is conserved, as the peaks are far from the borders
+        self.assertGreater(np.sum(coadded), 100 * len(self.cube))
+        self.assertLessEqual(np.sum(coadded), np.sum(self.cube))
+
+        # Compare against scattering every pixel separately
+        coadded, _ = coadd_frames_oversampled(self.cube, oversampling=2)
+        peaks = get_subpixel_peaks(self.cube)
+        expected = np.zeros(coadded.shape)
+        y, x = np.mgrid[:self.cube.shape[1], :self.cube.shape[2]]
+        for frame, shift in zip(self.cube, np.mean(peaks, axis=0) - peaks):
+            fine_y = 2 * (y + shift[0]) + 0.5
+            fine_x = 2 * (x + shift[1]) + 0.5
+            for corner_y in (0, 1):
+                for corner_x in (0, 1):
+                    index_y = np.floor(fine_y).astype(int) + corner_y
+                    index_x = np.floor(fine_x).astype(int) + corner_x
+                    weight = (1 - np.abs(fine_y - index_y)) * (1 - np.abs(fine_x - index_x))
+                    inside = (index_y >= 0) & (index_y < coadded.shape[0]) & (index_x >= 0) & \
+                             (index_x < coadded.shape[1])
+                    np.add.at(expected, (index_y[inside], index_x[inside]), (weight * frame)[inside])
+        np.testing.assert_allclose(coadded, expected)
+
+        streamed, _ = coadd_file(self.file, chunk_size=4, oversampling=2, var_ext=None)
+        np.testing.assert_allclose(streamed, coadd_frames_oversampled(self.cube, oversampling=2)[0])
+
+    def test_ssa_oversampled(self):
+        out_file = os.path.join(self.tmp_dir.name, 'ssa.fits')
+        reconstruction, _ = ssa([self.file, self.file], outfile=out_file, oversampling=2)
+        self.assertEqual(reconstruction.shape, (128, 96))
+        self.assertEqual(fits.getheader(out_file)['HIERARCH SPECKLEPY OVERSAMPLING'], 2)
+        with self.assertRaises(ValueError):
+            ssa(self.file, oversampling=2, n_bootstrap=4)
+
+    def test_ssa_oversampled_header_cards(self):
+        # The header offsets in detector pixels are scaled to the oversampled grid
+        shifted_file = os.path.join(self.tmp_dir.name, 'shifted.fits')
+        hdu = fits.PrimaryHDU(np.roll(self.cube, (6, -4), axis=(1, 2)))
+        hdu.header.set('XOFF', -4)
+        hdu.header.set('YOFF', 6)
+        hdu.writeto(shifted_file)
+        with fits.open(self.file, mode='update') as hdu_list:
+            hdu_list[0].header.set('XOFF', 0)
+            hdu_list[0].header.set('YOFF', 0)
+        with mock.patch('specklepy.core.alignment.get_shifts', wraps=alignment.get_shifts) as get_shifts:
+            ssa([self.file, shifted_file], oversampling=2, header_cards={'XOFFSET': 'XOFF', 'YOFFSET': 'YOFF'})
+        self.assertEqual(get_shifts.call_args.kwargs['predicted_shifts'], [(0, 0), (-12, 8)])
+
+    def test_ssa_full_tiled(self):
+        shifted_file = os.path.join(self.tmp_dir.name, 'shifted.fits')
+        shifted = np.roll(self.cube, (6, -4), axis=(1, 2))
+        fits.HDUList([fits.PrimaryHDU(shifted), fits.ImageHDU(self.var_cube, name='VAR')]).writeto(shifted_file)
+
+        reconstruction, reconstruction_var = ssa([self.file, shifted_file], mode='full')
+        self.assertEqual(reconstruction.shape, (70, 52))
+        self.assertEqual(reconstruction_var.shape, reconstruction.shape)
+
+        out_file = os.path.join(self.tmp_dir.name, 'ssa.fits')
+        tiled, tiled_var = ssa([self.file, shifted_file], mode='full', outfile=out_file, max_dense_pixels=100)
+        self.assertIsInstance(tiled, TiledCanvas)
+        np.testing.assert_array_equal(tiled.to_array(), reconstruction)
+        with fits.open(out_file) as hdu_list:
+            np.testing.assert_array_equal(TiledCanvas.from_hdus(hdu_list).to_array(), reconstruction)
+            np.testing.assert_array_equal(TiledCanvas.from_hdus(hdu_list, name='VAR').to_array(), reconstruction_var)
+
+        # Bootstrap samples are accumulated on canvases as well and the error map is written as tiles
+        expected = ssa([self.file, shifted_file], mode='full', n_bootstrap=3, bootstrap_seed=1)
+        tiled_file = os.path.join(self.tmp_dir.name, 'ssa_bootstrap.fits')
+        tiled = ssa([self.file, shifted_file], mode='full', n_bootstrap=3, bootstrap_seed=1, outfile=tiled_file,
+                    max_dense_pixels=100)
+        self.assertIsInstance(tiled[2], TiledCanvas)
+        np.testing.assert_array_equal(tiled[2].to_array(), expected[2])
+        with fits.open(tiled_file) as hdu_list:
+            np.testing.assert_array_equal(TiledCanvas.from_hdus(hdu_list, name='BOOTSTRAP').to_array(), expected[2])
+
+    def test_ssa_valid(self):
+        shifted_file = os.path.join(self.tmp_dir.name, 'shifted.fits')
+        shifted = np.roll(self.cube, (6, -4), axis=(1, 2))
+        fits.HDUList([fits.PrimaryHDU(shifted), fits.ImageHDU(self.var_cube, name='VAR')]).writeto(shifted_file)
+
+        same, _ = ssa([self.file, shifted_file])
+        valid, valid_var, valid_error = ssa([self.file, shifted_file], mode='valid', n_bootstrap=3)
+        self.assertEqual(valid.shape, (58, 44))
+        self.assertEqual(valid_var.shape, valid.shape)
+        self.assertEqual(valid_error.shape, valid.shape)
+        np.testing.assert_array_equal(valid, same[:58, 4:])
+
+    def test_ssa_cache(self):
+        shifted_file = os.path.join(self.tmp_dir.name, 'shifted.fits')
+        fits.writeto(shifted_file, np.roll(self.cube, (6, -4), axis=(1, 2)))
+        cache = FileCache(os.path.join(self.tmp_dir.name, 'cache'))
+        expected = ssa([self.file, shifted_file])
+        reconstruction = ssa([self.file, shifted_file], cache=cache)
+        self.assertEqual(len(cache.entries), 3)
+        np.testing.assert_array_equal(reconstruction[0], expected[0])
+
+        # A second run restores the cube reconstructions and shifts from the cache
+        cached = ssa([self.file, shifted_file], cache=cache)
+        self.assertEqual(len(cache.entries), 3)
+        np.testing.assert_array_equal(cached[0], expected[0])
+        np.testing.assert_array_equal(cached[1], expected[1])
+
+        # Changing a parameter or file creates new entries
+        ssa([self.file, shifted_file], box_indexes=[5, 40, 5, 40], cache=cache)
+        self.assertEqual(len(cache.entries), 6)
+
+    def test_ssa_roi(self):
+        out_file = os.path.join(self.tmp_dir.name, 'ssa.fits')
+        reconstruction, _ = ssa(self.file, outfile=out_file, roi=ROI([0, 45, 2, 45]))
+        np.testing.assert_array_equal(reconstruction, coadd_frames_padded(self.cube[:, :45, 2:45]))
+        header = fits.getheader(out_file)
+        self.assertEqual(header['HIERARCH SPECKLEPY ROI OFFSET Y'], 2)
+        reconstruction, _ = ssa([self.file, self.file], roi=ROI([0, 45, 2, 45]))
+        self.assertEqual(reconstruction.shape, (45, 43))
+        with self.assertRaises(TypeError):
+            ssa(self.file, roi=[0, 45, 2, 45])
+
+    def test_ssa_upsampled(self):
+        shifted_file = os.path.join(self.tmp_dir.name, 'shifted.fits')
+        fits.writeto(shifted_file, np.roll(self.cube, (6, -4), axis=(1, 2)))
+        integer = ssa([self.file, shifted_file])
+        upsampled = ssa([self.file, shifted_file], upsample_factor=10)
+        self.assertEqual(upsampled[0].shape, integer[0].shape)
+
+        # The full field conserves the flux of both interim reconstructions
+        full = ssa([self.file, shifted_file], mode='full', upsample_factor=10)
+        total = np.sum(coadd_file(self.file)[0]) + np.sum(coadd_file(shifted_file)[0])
+        self.assertAlmostEqual(np.sum(full[0]), total, places=6)
+        with self.assertRaises(ValueError):
+            ssa([self.file, shifted_file], upsample_factor=10, incremental=True, outfile='ssa.fits')
+
+    def test_ssa_bootstrap(self):
+        out_file = os.path.join(self.tmp_dir.name, 'ssa.fits')
+        reconstruction, _, bootstrap_error = ssa(self.file, outfile=out_file, n_bootstrap=8, bootstrap_seed=3)
+        np.testing.assert_array_equal(reconstruction, coadd_frames_padded(self.cube))
+        self.assertEqual(bootstrap_error.shape, reconstruction.shape)
+        np.testing.assert_array_equal(fits.getdata(out_file, 'BOOTSTRAP'), bootstrap_error)
+        np.testing.assert_array_equal(ssa(self.file, n_bootstrap=8, bootstrap_seed=3)[2], bootstrap_error)
+
+        _, _, bootstrap_error = ssa([self.file, self.file], mode='full', n_bootstrap=4, n_jobs=2)
+        self.assertEqual(bootstrap_error.shape, reconstruction.shape)
+        with self.assertRaises(ValueError):
+            ssa(self.file, n_bootstrap=1)
+
+    def test_ssa_selection(self):
+        out_file = os.path.join(self.tmp_dir.name, 'ssa.fits')
+        ssa(self.file, outfile=out_file, selection_method='sharpness', selection_fraction=0.25)
+        header = fits.getheader(out_file)
+        self.assertEqual(header['HIERARCH SPECKLEPY SELECTION METHOD'], 'sharpness')
+        self.assertEqual(header['HIERARCH SPECKLEPY FILE 0 SELECTED'], 5)
+
+    def test_ssa_streamed(self):
+        reconstruction, reconstruction_var = ssa(self.file, chunk_size=5)
+        np.testing.assert_array_equal(reconstruction, coadd_frames_padded(self.cube))
+        with self.assertRaises(ValueError):
+            ssa(self.file, chunk_size=0)
+
+    def test_ssa_parallel(self):
+        files = [self.file, self.file]
+        serial = ssa(files, tmp_dir=self.tmp_dir.name)
+        parallel = ssa(files, tmp_dir=self.tmp_dir.name, n_jobs=2)
+        np.testing.assert_array_equal(serial[0], parallel[0])
+        np.testing.assert_array_equal(serial[1], parallel[1])
+
+    def test_ssa_tmp_files(self):
+        tmp_dir = os.path.join(self.tmp_dir.name, 'tmp')
+        ssa([self.file, self.file], tmp_dir=tmp_dir)
+        self.assertFalse(os.path.exists(tmp_dir))
+        ssa([self.file, self.file], tmp_dir=tmp_dir, write_tmp_files=True)
+        self.assertTrue(os.path.isfile(os.path.join(tmp_dir, 'cube_ssa.fits')))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import numpy as np
+import os
+import tempfile
+
+from astropy.io import fits
+
+from specklepy.core.ssa import ssa
+from specklepy.core.ssastate import SSAState
+from specklepy.utils.roi import ROI
+
+
+class TestSSAState(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(seed=1)
+        cube = rng.random((8, 40, 40))
+        cube[:, 20, 20] += 50.
+        cube[:, 12, 25] += 20.
+        self.files = []
+        for index, shift in enumerate([(0, 0), (3, -2), (-5, 4)]):
+            file = os.path.join(self.tmp_dir.name, f"cube_{index}.fits")
+            shifted = np.roll(cube, shift, axis=(1, 2))
+            fits.HDUList([fits.PrimaryHDU(shifted), fits.ImageHDU(np.ones(cube.shape), name='VAR')]).writeto(file)
+            self.files.append(file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_add(self):
+        state = SSAState(mode='full', f_reference_image=np.fft.rfft2(np.zeros((4, 5))), image=np.zeros((4, 5)))
+        state.add(np.ones((4, 5)), shift=(0, 0), file='a')
+        state.add(np.ones((4, 5)), shift=(1, -2), var=np.ones((4, 5)), file='b')
+        self.assertEqual(state.image.shape, (5, 7))
+        self.assertEqual(state.image[0, 2], 1.)
+        self.assertEqual(state.image[1, 2], 2.)
+        self.assertEqual(state.image[4, 0], 1.)
+        np.testing.assert_array_equal(state.shift_bounds, [[0, -2], [1, 0]])
+        self.assertEqual(state.files, ['a', 'b'])
+
+    def test_save_load(self):
+        file = os.path.join(self.tmp_dir.name, 'state.npz')
+        state = SSAState(mode='same', f_reference_image=np.fft.rfft2(np.ones((4, 5))), image=np.ones((4, 5)),
+                         files=['a'], grid={'oversampling': 2, 'roi': None})
+        state.save(file)
+        loaded = SSAState.load(file)
+        self.assertEqual(loaded.mode, 'same')
+        self.assertEqual(loaded.files, ['a'])
+        self.assertIsNone(loaded.var)
+        np.testing.assert_array_equal(loaded.f_reference_image, state.f_reference_image)
+        np.testing.assert_array_equal(loaded.image, state.image)
+        loaded.check_grid('test', oversampling=2, roi=None)
+        with self.assertRaises(ValueError):
+            loaded.check_grid('test', oversampling=None, roi=None)
+        self.assertEqual(SSAState.get_state_file('path/ssa.fits'), 'path/ssa_state.npz')
+
+    def test_ssa_incremental(self):
+        for mode in ['same', 'full']:
+            out_file = os.path.join(self.tmp_dir.name, f"ssa_{mode}.fits")
+            expected, expected_var = ssa(self.files, mode=mode)
+            ssa(self.files[:2], mode=mode, outfile=out_file, incremental=True)
+            image, var = ssa(self.files, mode=mode, outfile=out_file, incremental=True)
+            np.testing.assert_array_equal(image, expected)
+            np.testing.assert_array_equal(var, expected_var)
+            self.assertEqual(fits.getheader(out_file)['HIERARCH SPECKLEPY FILE 2'], 'cube_2.fits')
+        with self.assertRaises(ValueError):
+            ssa(self.files, mode='valid', outfile=out_file, incremental=True)
+        with self.assertRaises(ValueError):
+            ssa(self.files, incremental=True)
+        with self.assertRaises(ValueError):
+            ssa(self.files, outfile=out_file, incremental=True, header_cards='NACO')
+
+    def test_ssa_incremental_grid(self):
+        # Extending a state requires the same pixel grid
+        out_file = os.path.join(self.tmp_dir.name, 'ssa.fits')
+        ssa(self.files[:2], outfile=out_file, incremental=True, oversampling=2)
+        with self.assertRaises(ValueError):
+            ssa(self.files, outfile=out_file, incremental=True)
+        with self.assertRaises(ValueError):
+            ssa(self.files, outfile=out_file, incremental=True, oversampling=2, roi=ROI([0, 30, 0, 30]))
+        image, _ = ssa(self.files, outfile=out_file, incremental=True, oversampling=2)
+        self.assertEqual(image.shape, (80, 80))
+
+    def test_check_options(self):
+        SSAState.check_options('test', mode='same', outfile='ssa.fits', n_bootstrap=None)
+        with self.assertRaises(ValueError):
+            SSAState.check_options('test', mode='valid', outfile='ssa.fits')
+        with self.assertRaises(ValueError):
+            SSAState.check_options('test', mode='same', outfile=None)
+        for name in SSAState.unsupported_options:
+            with self.assertRaises(ValueError):
+                SSAState.check_options('test', mode='full', outfile='ssa.fits', **{name: 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
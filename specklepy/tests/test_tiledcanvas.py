@@ -0,0 +1,102 @@
+import unittest
+from functools import partial
+import numpy as np
+import os
+import tempfile
+
+from astropy.io import fits
+
+from specklepy.core import alignment
+from specklepy.io.outfile import Outfile
+from specklepy.utils.tiledcanvas import TiledCanvas
+
+
+class TestTiledCanvas(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=5)
+        self.images = rng.random((3, 20, 30))
+        self.shifts = np.array([[0, 0], [-7, 45], [90, -12]])
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_dense(self):
+        """Reference 'full' image, based on padding the images."""
+        pad_vectors = alignment.get_pad_vectors(self.shifts)
+        return sum(alignment.pad_array(image, pad_vector, mode='full')
+                   for image, pad_vector in zip(self.images, pad_vectors))
+
+    def test_init(self):
+        canvas = TiledCanvas()
+        self.assertEqual(canvas.shape, (0, 0))
+        self.assertEqual(len(canvas), 0)
+        with self.assertRaises(TypeError):
+            TiledCanvas(tile_shape=16)
+        with self.assertRaises(ValueError):
+            TiledCanvas(tile_shape=(0, 16))
+
+    def test_add(self):
+        canvas = TiledCanvas(tile_shape=(16, 16))
+        for image, shift in zip(self.images, self.shifts):
+            canvas.add(image, offset=shift)
+        dense = self.get_dense()
+        self.assertEqual(canvas.shape, dense.shape)
+        np.testing.assert_array_equal(canvas.to_array(), dense)
+
+        # Only the tiles covered by the images are allocated
+        self.assertLess(canvas.nbytes, dense.nbytes)
+        self.assertEqual(len(canvas), 16)
+
+    def test_add_fractional(self):
+        canvas = TiledCanvas(tile_shape=(16, 16))
+        canvas.add(self.images[0], offset=(-2.5, 3.25))
+        self.assertEqual(canvas.shape, (21, 31))
+        self.assertAlmostEqual(np.sum(canvas.to_array()), np.sum(self.images[0]))
+
+        # Variances are distributed with the squared weights
+        var = TiledCanvas(tile_shape=(16, 16))
+        var.add(self.images[0], offset=(-2.5, 3.25), squared=True)
+        expected = alignment.add_shifted(np.zeros((21, 31)), self.images[0], offset=(0.5, 0.25), squared=True)
+        np.testing.assert_allclose(var.to_array(), expected)
+
+    def test_combine(self):
+        canvases = []
+        for factor in [1, 2, 4]:
+            canvas = TiledCanvas(tile_shape=(16, 16))
+            for image, shift in zip(self.images, self.shifts):
+                canvas.add(factor * image, offset=shift)
+            canvases.append(canvas)
+        combined = TiledCanvas.combine(canvases, partial(np.std, axis=0))
+        self.assertEqual(combined.shape, canvases[0].shape)
+        self.assertEqual(len(combined), len(canvases[0]))
+        np.testing.assert_allclose(combined.to_array(), np.std([canvas.to_array() for canvas in canvases], axis=0))
+
+    def test_hdus(self):
+        canvas = TiledCanvas(tile_shape=(16, 16))
+        for image, shift in zip(self.images, self.shifts):
+            canvas.add(image, offset=shift)
+        hdus = canvas.to_hdus()
+        self.assertEqual(len(hdus), len(canvas))
+        np.testing.assert_array_equal(TiledCanvas.from_hdus(hdus).to_array(), self.get_dense())
+
+    def test_write(self):
+        canvas = TiledCanvas(tile_shape=(16, 16))
+        for image, shift in zip(self.images, self.shifts):
+            canvas.add(image, offset=shift)
+
+        outfile = Outfile(os.path.join(self.tmp_dir.name, 'dense.fits'), shape=(2, 2), verbose=False)
+        data = canvas.write(outfile)
+        np.testing.assert_array_equal(fits.getdata(outfile.file_path), data)
+
+        outfile = Outfile(os.path.join(self.tmp_dir.name, 'tiled.fits'), shape=(2, 2), verbose=False)
+        self.assertIs(canvas.write(outfile, max_dense_pixels=100), canvas)
+        with fits.open(outfile.file_path) as hdu_list:
+            self.assertIsNone(hdu_list[0].data)
+            self.assertEqual(hdu_list[0].header['TILE TILES'], len(canvas))
+            np.testing.assert_array_equal(TiledCanvas.from_hdus(hdu_list).to_array(), self.get_dense())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -63,18 +63,18 @@ class Box(object):
             # Update limits
             if update:
                 self.x_min = 0
-                self.x_max = array.shape[1] - 1
+                self.x_max = array.shape[-1] - 1
                 self.y_min = 0
-                self.y_max = array.shape[0] - 1
+                self.y_max = array.shape[-2] - 1
 
             return array
 
         else:
             # Set limits
             x_min = 0 if self.x_min is None else self.x_min
-            x_max = array.shape[1] - 1 if self.x_max is None else self.x_max
+            x_max = array.shape[-1] - 1 if self.x_max is None else self.x_max
             y_min = 0 if self.y_min is None else self.y_min
-            y_max = array.shape[0] - 1 if self.y_max is None else self.y_max
+            y_max = array.shape[-2] - 1 if self.y_max is None else self.y_max
 
             # Update limits
             if update:
@@ -83,6 +83,10 @@ class Box(object):
                 self.y_min = y_min
                 self.y_max = y_max
 
+            # Cubes are cropped frame-wise by a view
+            if array.ndim == 3:
+                return array[:, x_min:x_max, y_min:y_max]
+
             # Create index sets
             x, y = np.meshgrid(range(y_min, y_max), range(x_min, x_max))
 
@@ -0,0 +1,101 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from specklepy.exceptions import SpecklepyValueError
+from specklepy.logging import logger
+
+
+def get_n_jobs(n_jobs):
+    """Interpret the number of parallel jobs.
+
+    Args:
+        n_jobs (int or None):
+            Number of parallel jobs. None or negative values are substituted by the number of CPUs.
+
+    Returns:
+        n_jobs (int):
+            Number of parallel jobs, at least 1.
+    """
+    if n_jobs is None or n_jobs < 0:
+        return os.cpu_count() or 1
+    elif n_jobs == 0:
+        raise SpecklepyValueError('get_n_jobs()', argname='n_jobs', argvalue=n_jobs, expected='non-zero int or None')
+    return int(n_jobs)
+
+
+def parallel_map(func, iterable, n_jobs=1):
+    """Apply a function to every item of an iterable, optionally in a process pool.
+
+    The results are returned in the order of the input items, independent of the order in which the workers finish,
+    such that the outcome is deterministic.
+
+    Args:
+        func (callable):
+            Function to apply. For n_jobs > 1, this needs to be picklable, i.e. defined at module level or a
+            functools.partial of such a function.
+        iterable (iterable):
+            Items to pass to func.
+        n_jobs (int, optional):
+            Number of worker processes. With 1, the items are processed serially in the calling process. None or
+            negative values use all CPUs. Default is 1.
+
+    Returns:
+        results (list):
+            List of the return values of func.
+    """
+    items = list(iterable)
+    n_jobs = min(get_n_jobs(n_jobs), max(len(items), 1))
+    if n_jobs == 1:
+        return [func(item) for item in items]
+
+    logger.info(f"Distributing {len(items)} tasks to {n_jobs} worker processes")
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(func, items))
+
+
+def parallel_reduce(func, iterable, reduce, n_jobs=1):
+    """Apply a function to every item of an iterable, optionally in a process pool, and reduce the results.
+
+    The results are reduced in the order of the input items, such that the outcome does not depend on the number of
+    workers, also for floating-point sums. At most twice as many tasks as workers are pending at any time, which bounds
+    the number of results that are held in memory.
+
+    Args:
+        func (callable):
+            Function to apply. For n_jobs > 1, this needs to be picklable, i.e. defined at module level or a
+            functools.partial of such a function.
+        iterable (iterable):
+            Items to pass to func.
+        reduce (callable):
+            Function that combines the reduced value and the next result into the new reduced value. The first result
+            initializes the reduced value and may be updated in-place.
+        n_jobs (int, optional):
+            Number of worker processes. With 1, the items are processed serially in the calling process. None or
+            negative values use all CPUs. Default is 1.
+
+    Returns:
+        reduced (object):
+            Reduced value of all results, or None if the iterable is empty.
+    """
+    items = list(iterable)
+    n_jobs = min(get_n_jobs(n_jobs), max(len(items), 1))
+    reduced = None
+    if n_jobs == 1:
+        for item in items:
+            result = func(item)
+            reduced = result if reduced is None else reduce(reduced, result)
+        return reduced
+
+    logger.info(f"Distributing {len(items)} tasks to {n_jobs} worker processes")
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) == 2 * n_jobs:
+                result = pending.popleft().result()
+                reduced = result if reduced is None else reduce(reduced, result)
+        for future in pending:
+            result = future.result()
+            reduced = result if reduced is None else reduce(reduced, result)
+    return reduced
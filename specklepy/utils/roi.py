@@ -0,0 +1,94 @@
+import numpy as np
+
+from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
+from specklepy.io.table import read_table
+from specklepy.logging import logger
+
+
+class ROI(object):
+
+    """Region of interest on the detector, to which the cubes are cropped before any further processing.
+
+    The region is defined by index limits along the two frame axes, following the order of the Box indexes, i.e.
+    [x_min, x_max, y_min, y_max] for the zero-th and first frame axis with exclusive upper limits. Cropping returns
+    views of the input arrays, such that memory-mapped cubes are only read within the region. Positions in the cropped
+    frames map back to detector coordinates by adding the offset of the region.
+    """
+
+    def __init__(self, indexes):
+        """Create a ROI instance.
+
+        Args:
+            indexes (list):
+                Index limits [x_min, x_max, y_min, y_max] of the region. Limits may be None to extend the region to the
+                frame edges.
+        """
+
+        # Check input parameters
+        if not isinstance(indexes, (list, tuple)):
+            raise SpecklepyTypeError('ROI', argname='indexes', argtype=type(indexes), expected='list')
+        if len(indexes) != 4:
+            raise SpecklepyValueError('ROI', argname='len(indexes)', argvalue=len(indexes), expected='4')
+        for lower, upper in (indexes[:2], indexes[2:]):
+            if lower is not None and upper is not None and upper <= lower:
+                raise SpecklepyValueError('ROI', argname='indexes', argvalue=indexes,
+                                          expected='upper limits larger than lower limits')
+
+        self.x_min, self.x_max, self.y_min, self.y_max = indexes
+
+    def __repr__(self):
+        return f"[{self.x_min}, {self.x_max}, {self.y_min}, {self.y_max}]"
+
+    def __call__(self, array):
+        """Crop the last two axes of an array to the region by a view."""
+        return array[(Ellipsis,) + self.slices]
+
+    @classmethod
+    def from_sources(cls, sources, margin, frame_shape=None):
+        """Create a ROI that covers a list of sources with a margin.
+
+        Args:
+            sources (str or astropy.table.Table):
+                Table or name of a table file with the source positions in columns 'x' and 'y', where 'y' is the
+                position along the zero-th frame axis, as in the source tables of specklepy.
+            margin (int):
+                Margin around the sources in pixels, for instance the PSF radius.
+            frame_shape (tuple, optional):
+                Shape of the frames, to which the region is clipped.
+
+        Returns:
+            roi (ROI):
+                Region covering the sources.
+        """
+        if isinstance(sources, str):
+            sources = read_table(sources)
+        y = np.array(sources['y'])
+        x = np.array(sources['x'])
+        indexes = [int(np.floor(np.min(y))) - margin, int(np.ceil(np.max(y))) + margin + 1,
+                   int(np.floor(np.min(x))) - margin, int(np.ceil(np.max(x))) + margin + 1]
+        indexes[0] = max(indexes[0], 0)
+        indexes[2] = max(indexes[2], 0)
+        if frame_shape is not None:
+            indexes[1] = min(indexes[1], frame_shape[0])
+            indexes[3] = min(indexes[3], frame_shape[1])
+        roi = cls(indexes)
+        logger.info(f"Region of interest {roi} covers {len(sources)} sources")
+        return roi
+
+    @property
+    def slices(self):
+        return slice(self.x_min, self.x_max), slice(self.y_min, self.y_max)
+
+    @property
+    def offset(self):
+        """Position of the first pixel of the region in detector coordinates."""
+        return self.x_min or 0, self.y_min or 0
+
+    def get_shape(self, frame_shape):
+        """Shape of frames of the given shape after cropping to the region."""
+        return tuple(len(range(*limits.indices(extent))) for limits, extent in zip(self.slices, frame_shape))
+
+    @property
+    def cards(self):
+        """Header cards to map positions in the cropped frames back to detector coordinates."""
+        return {'ROI': str(self), 'ROI OFFSET X': self.offset[0], 'ROI OFFSET Y': self.offset[1]}
@@ -0,0 +1,226 @@
+import numpy as np
+
+from astropy.io import fits
+
+from specklepy.core.alignment import add_shifted, get_bilinear_offsets
+from specklepy.exceptions import SpecklepyTypeError, SpecklepyValueError
+from specklepy.logging import logger
+
+
+class TiledCanvas(object):
+
+    """Sparse image canvas, which allocates tiles only where data are added.
+
+    Arrays are added at integer offsets in an unbounded coordinate system, for instance their shifts relative to a
+    reference image. Only the tiles that receive data are allocated and the bounds of the canvas are given by the
+    extents of the added arrays. This avoids allocating the full bounding box of wide dither patterns, where most of
+    the image is empty.
+    """
+
+    # Canvases covering more pixels are written as tiles instead of a dense image, about 1 GB in double precision
+    max_dense_pixels = 2 ** 27
+
+    def __init__(self, tile_shape=(256, 256), dtype=float):
+        """Create a TiledCanvas instance.
+
+        Args:
+            tile_shape (tuple, optional):
+                Shape of the individual tiles. Default is (256, 256).
+            dtype (type, optional):
+                Data type of the tiles. Default is float.
+        """
+        if not isinstance(tile_shape, (tuple, list)) or len(tile_shape) != 2:
+            raise SpecklepyTypeError('TiledCanvas', argname='tile_shape', argtype=type(tile_shape),
+                                     expected='tuple of length 2')
+        if min(tile_shape) < 1:
+            raise SpecklepyValueError('TiledCanvas', argname='tile_shape', argvalue=tile_shape,
+                                      expected='positive entries')
+        self.tile_shape = np.array(tile_shape, dtype=int)
+        self.dtype = dtype
+        self.tiles = {}
+        self.lower = None
+        self.upper = None
+
+    def __len__(self):
+        return len(self.tiles)
+
+    @property
+    def shape(self):
+        """Shape of the bounding box of all added arrays."""
+        if self.lower is None:
+            return 0, 0
+        return tuple(int(extent) for extent in self.upper - self.lower)
+
+    @property
+    def size(self):
+        """Number of pixels of the bounding box of all added arrays."""
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        """Number of bytes allocated by the tiles."""
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    def add(self, array, offset=(0, 0), squared=False):
+        """Add an array in-place to the canvas, allocating the tiles that it covers if necessary.
+
+        Args:
+            array (np.ndarray, ndim=2):
+                Array to add.
+            offset (tuple, optional):
+                Position of the origin of the array within the canvas. Fractional offsets are distributed onto the
+                neighbouring integer offsets with bilinear weights. Default is (0, 0).
+            squared (bool, optional):
+                Apply the squared bilinear weights, for adding variance maps. Default is False.
+        """
+        if not isinstance(array, np.ndarray) or array.ndim != 2:
+            raise SpecklepyTypeError('TiledCanvas.add()', argname='array', argtype=type(array),
+                                     expected='2D np.ndarray')
+
+        for integer_offset, weight in get_bilinear_offsets(offset):
+            if weight is None:
+                self._add(array, integer_offset)
+            else:
+                self._add((weight ** 2 if squared else weight) * array, integer_offset)
+
+    def _add(self, array, lower):
+        """Add an array at an integer offset."""
+        upper = lower + array.shape
+        self.lower = lower if self.lower is None else np.minimum(self.lower, lower)
+        self.upper = upper if self.upper is None else np.maximum(self.upper, upper)
+
+        first = np.floor_divide(lower, self.tile_shape)
+        last = np.floor_divide(upper - 1, self.tile_shape)
+        for tile_y in range(first[0], last[0] + 1):
+            for tile_x in range(first[1], last[1] + 1):
+                key = (tile_y, tile_x)
+                if key not in self.tiles:
+                    self.tiles[key] = np.zeros(self.tile_shape, dtype=self.dtype)
+                add_shifted(self.tiles[key], array, offset=lower - self.tile_shape * key)
+
+    @classmethod
+    def combine(cls, canvases, func):
+        """Combine canvases with identical footprints tile by tile, for instance bootstrap samples of a field.
+
+        Args:
+            canvases (list of TiledCanvas):
+                Canvases, to which arrays of the same shapes have been added at the same offsets.
+            func (callable):
+                Function that combines a list of arrays along a new zero-th axis into one array, for instance
+                specklepy.core.bootstrap.get_bootstrap_error().
+
+        Returns:
+            combined (TiledCanvas):
+                Canvas with the combined tiles and the bounds of the input canvases.
+        """
+        first = canvases[0]
+        combined = cls(tile_shape=tuple(first.tile_shape), dtype=first.dtype)
+        combined.lower, combined.upper = first.lower, first.upper
+        for key in first.tiles:
+            combined.tiles[key] = func([canvas.tiles[key] for canvas in canvases])
+        return combined
+
+    def iter_tiles(self):
+        """Iterate over the tiles, cropped to the bounds of the canvas.
+
+        Yields:
+            offset (np.ndarray):
+                Position of the cropped tile within the bounding box of the canvas.
+            tile (np.ndarray):
+                Cropped tile.
+        """
+        for key in sorted(self.tiles):
+            origin = self.tile_shape * key
+            start = np.maximum(origin, self.lower)
+            stop = np.minimum(origin + self.tile_shape, self.upper)
+            tile = self.tiles[key][start[0] - origin[0]: stop[0] - origin[0], start[1] - origin[1]: stop[1] - origin[1]]
+            yield start - self.lower, tile
+
+    def to_array(self):
+        """Assemble the dense array covering the bounding box of the canvas."""
+        array = np.zeros(self.shape, dtype=self.dtype)
+        for offset, tile in self.iter_tiles():
+            add_shifted(array, tile, offset=offset)
+        return array
+
+    def to_hdus(self, name='TILE'):
+        """Create an image HDU for each tile.
+
+        The position of a tile within the bounding box of the canvas is stored in the IRAF-style LTV1 and LTV2 cards
+        and in the extension name.
+
+        Args:
+            name (str, optional):
+                Prefix of the extension names. Default is 'TILE'.
+
+        Returns:
+            hdus (list of fits.ImageHDU):
+                List of HDUs with extension names `<name>_<y>_<x>`.
+        """
+        hdus = []
+        for offset, tile in self.iter_tiles():
+            hdu = fits.ImageHDU(data=tile, name=f"{name}_{offset[0]}_{offset[1]}")
+            hdu.header.set('LTV1', -int(offset[1]), 'Offset of the tile along axis 1')
+            hdu.header.set('LTV2', -int(offset[0]), 'Offset of the tile along axis 2')
+            hdus.append(hdu)
+        return hdus
+
+    @classmethod
+    def from_hdus(cls, hdus, name='TILE', tile_shape=(256, 256)):
+        """Re-assemble a canvas from tile HDUs, as created by to_hdus().
+
+        Args:
+            hdus (fits.HDUList or list):
+                HDUs containing the tiles. HDUs whose names do not start with `name` are ignored.
+            name (str, optional):
+                Prefix of the extension names. Default is 'TILE'.
+            tile_shape (tuple, optional):
+                Shape of the tiles of the new canvas. Default is (256, 256).
+
+        Returns:
+            canvas (TiledCanvas):
+                Canvas with the bounding box starting at (0, 0).
+        """
+        canvas = cls(tile_shape=tile_shape)
+        for hdu in hdus:
+            if hdu.name.startswith(name.upper() + '_'):
+                canvas.add(hdu.data, offset=(-hdu.header['LTV2'], -hdu.header['LTV1']))
+        return canvas
+
+    def write(self, outfile, name=None, max_dense_pixels=None):
+        """Write the canvas to an outfile, either as a dense image or as tile extensions.
+
+        Args:
+            outfile (Outfile):
+                Outfile instance to write the canvas to.
+            name (str, optional):
+                Name of the extension for the dense image or prefix of the tile extension names. The dense image is
+                stored in the primary HDU and the tiles are named 'TILE_<y>_<x>' if not provided.
+            max_dense_pixels (int, optional):
+                The canvas is written as a dense image if it covers at most this number of pixels, and as tiles
+                otherwise. Defaults to the `max_dense_pixels` class attribute.
+
+        Returns:
+            data (np.ndarray or TiledCanvas):
+                The dense image or the canvas itself, if it has been written as tiles.
+        """
+        if max_dense_pixels is None:
+            max_dense_pixels = self.max_dense_pixels
+        if self.size <= max_dense_pixels:
+            data = self.to_array()
+            if name is None:
+                outfile.data = data
+            elif outfile.has_extension(name):
+                outfile.update_extension(ext_name=name, data=data)
+            else:
+                outfile.new_extension(name=name, data=data)
+            return data
+
+        logger.info(f"Writing canvas of shape {self.shape} as {len(self.tiles)} tiles to {outfile.file_path}")
+        prefix = 'TILE' if name is None else name
+        if name is None:
+            outfile.data = None
+        for hdu in self.to_hdus(name=prefix):
+            outfile.new_extension(name=hdu.name, data=hdu.data, header=hdu.header)
+        outfile.update_header({f"{prefix} SHAPE": str(self.shape), f"{prefix} TILES": len(self.tiles)})
+        return self